@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""generate_hauser.py
+
+Generate synthetic events data in the format exported by Hauser (JSON bundles of event records), for benchmarking
+
+Sessions follow a simple navigation model: the first page of a session and random jumps are drawn from a Zipfian
+popularity distribution over the site's URLs, and other navigations follow one of a few links from the current page.
+Each navigation produces a navigate and a load event, followed by a random number of clicks (some of them dead or
+rage clicks).
+
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+SITE = "https://www.example.com"
+EXTERNALREFERRERS = ["https://www.google.com/", "https://www.bing.com/", "https://www.facebook.com/",
+                     "https://t.co/"]
+DEVICES = ["Desktop", "Mobile", "Tablet"]
+DEVICEWEIGHTS = [0.78, 0.2, 0.02]
+BROWSERS = ["Chrome", "Safari", "Firefox", "Microsoft Edge"]
+BROWSERWEIGHTS = [0.7, 0.22, 0.05, 0.03]
+LINKSPERPAGE = 3
+LINKWEIGHTS = [0.6, 0.3, 0.1]
+
+
+def get_site_urls(numUrls: int) -> np.ndarray:
+    """URLs of the synthetic site, from most to least popular"""
+    urls = [SITE + "/", SITE + "/cart", SITE + "/checkout", SITE + "/checkout/confirmation"]
+    urls += [SITE + "/collections/c" + str(i) for i in range(max(0, min(numUrls, 100) - len(urls)))]
+    urls += [SITE + "/products/p" + str(i) for i in range(numUrls - len(urls))]
+    return np.array(urls[:numUrls], dtype=object)
+
+
+def zipf_probabilities(numValues: int, exponent: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, numValues + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_events(numEvents: int, numUrls: int = 1000, zipfExponent: float = 1.1, meanSessionLength: float = 8,
+                    clickRate: float = 1.0, jumpRate: float = 0.2, startTime: str = "2019-08-16",
+                    days: int = 7, numOrgs: int = 1, seed: int = 0) -> pd.DataFrame:
+    """Generate a synthetic events DataFrame with the columns of a Hauser export
+
+    :param numEvents: approximate number of events to generate
+    :param numUrls: number of distinct page URLs
+    :param zipfExponent: exponent of the Zipfian URL popularity distribution
+    :param meanSessionLength: average number of navigations per session
+    :param clickRate: average number of clicks per page
+    :param jumpRate: probability that a navigation goes to a random (popular) page instead of following a link
+    :param startTime: first day of the generated data
+    :param days: number of days the sessions are spread over
+    :param numOrgs: number of organizations (OrgId column, with Zipfian sizes) if more than 1
+    :param seed: random seed
+    :return: DataFrame of events, in time order
+    """
+    rng = np.random.default_rng(seed)
+    urls = get_site_urls(numUrls)
+    popularity = zipf_probabilities(numUrls, zipfExponent)
+    links = rng.choice(numUrls, size=(numUrls, LINKSPERPAGE), p=popularity)
+
+    # navigations: sessions are generated one position at a time, for all sessions still running
+    numSessions = max(1, int(numEvents / (meanSessionLength * (2 + clickRate))))
+    lengths = rng.geometric(1.0 / meanSessionLength, size=numSessions)
+    offsets = np.r_[0, np.cumsum(lengths)]
+    pages = np.empty(offsets[-1], dtype=np.int64)
+    current = rng.choice(numUrls, size=numSessions, p=popularity)
+    pages[offsets[:-1]] = current
+    for position in range(1, lengths.max()):
+        running = np.flatnonzero(lengths > position)
+        jump = rng.random(len(running)) < jumpRate
+        nextPages = links[current[running], rng.choice(LINKSPERPAGE, size=len(running), p=LINKWEIGHTS)]
+        nextPages[jump] = rng.choice(numUrls, size=np.count_nonzero(jump), p=popularity)
+        current[running] = nextPages
+        pages[offsets[:-1][running] + position] = nextPages
+
+    numPages = len(pages)
+    sessionOfPage = np.repeat(np.arange(numSessions), lengths)
+    firstPage = np.zeros(numPages, dtype=bool)
+    firstPage[offsets[:-1]] = True
+    referrers = np.empty(numPages, dtype=object)
+    referrers[1:] = urls[pages[:-1]]
+    referrers[firstPage] = np.where(rng.random(numSessions) < 0.5, "",
+                                    np.array(EXTERNALREFERRERS, dtype=object)[
+                                        rng.integers(len(EXTERNALREFERRERS), size=numSessions)])
+
+    # page timing: sessions start at random times, and users spend an exponential amount of time on each page
+    t0 = pd.Timestamp(startTime, tz="UTC").value // 10 ** 6
+    sessionStarts = t0 + rng.integers(days * 86400 * 1000, size=numSessions)
+    durations = rng.exponential(40000, size=numPages).astype(np.int64) + 500
+    pageStarts = np.repeat(sessionStarts, lengths) + np.cumsum(durations) - durations
+    pageStarts -= np.repeat((np.cumsum(durations) - durations)[offsets[:-1]], lengths)
+
+    userIds = rng.integers(10 ** 15, 10 ** 16, size=numSessions)
+    sessionIds = rng.integers(10 ** 15, 10 ** 16, size=numSessions)
+    pageIds = rng.integers(10 ** 15, 10 ** 16, size=numPages)
+    devices = rng.choice(DEVICES, size=numSessions, p=DEVICEWEIGHTS)
+    browsers = rng.choice(BROWSERS, size=numSessions, p=BROWSERWEIGHTS)
+
+    # events: navigate and load for every page, then clicks
+    clicks = rng.poisson(clickRate, size=numPages)
+    eventsPerPage = 2 + clicks
+    eventPage = np.repeat(np.arange(numPages), eventsPerPage)
+    eventOffset = np.arange(len(eventPage)) - np.repeat(np.cumsum(eventsPerPage) - eventsPerPage, eventsPerPage)
+    eventTypes = np.where(eventOffset == 0, "navigate", np.where(eventOffset == 1, "load", "click")).astype(object)
+    isClick = eventOffset >= 2
+    eventTimes = pageStarts[eventPage] + np.where(
+        isClick, (rng.random(len(eventPage)) * durations[eventPage]).astype(np.int64), eventOffset * 200)
+    dead = np.where(isClick & (rng.random(len(eventPage)) < 0.06), 1.0, np.nan)
+    frustrated = np.where(isClick & (rng.random(len(eventPage)) < 0.01),
+                          rng.integers(1, 6, size=len(eventPage)).astype(float), np.nan)
+    eventSession = sessionOfPage[eventPage]
+
+    events = pd.DataFrame({
+        "IndvId": userIds[eventSession],
+        "UserId": userIds[eventSession],
+        "SessionId": sessionIds[eventSession],
+        "PageId": pageIds[eventPage],
+        "EventStart": pd.to_datetime(eventTimes, unit="ms", utc=True),
+        "EventType": eventTypes,
+        "PageDuration": durations[eventPage],
+        "PageActiveDuration": (durations[eventPage] * 0.6).astype(np.int64),
+        "PageUrl": urls[pages[eventPage]],
+        "PageRefererUrl": referrers[eventPage],
+        "PageBrowser": browsers[eventSession],
+        "PageDevice": devices[eventSession],
+        "EventModDead": dead,
+        "EventModFrustrated": frustrated,
+    })
+    if numOrgs > 1:
+        orgs = np.array(["o" + str(i) for i in range(numOrgs)], dtype=object)
+        events["OrgId"] = orgs[rng.choice(numOrgs, size=numSessions, p=zipf_probabilities(numOrgs, 1.0))][eventSession]
+    return events.sort_values("EventStart", kind="mergesort").reset_index(drop=True)
+
+
+def write_bundles(events: pd.DataFrame, folder: str, eventsPerBundle: int = 500000) -> list:
+    """Write events as Hauser JSON bundles (one array of records per file, named after the first event time)
+
+    :param events: events DataFrame in time order
+    :param folder: output folder (created if needed)
+    :param eventsPerBundle: maximum number of events per file
+    :return: list of file paths
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for start in range(0, len(events), eventsPerBundle):
+        bundle = events.iloc[start:start + eventsPerBundle]
+        name = str(bundle["EventStart"].iloc[0].value // 10 ** 6) + ".json"
+        path = os.path.join(folder, name)
+        bundle.to_json(path, orient="records", date_format="iso", date_unit="ms")
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Hauser JSON bundles")
+    parser.add_argument("folder", type=str, help="Output folder")
+    parser.add_argument("numEvents", type=int, help="Approximate number of events")
+    parser.add_argument("--numUrls", type=int, default=1000, help="Number of distinct URLs")
+    parser.add_argument("--zipfExponent", type=float, default=1.1, help="Exponent of the URL popularity distribution")
+    parser.add_argument("--meanSessionLength", type=float, default=8, help="Average number of pages per session")
+    parser.add_argument("--clickRate", type=float, default=1.0, help="Average number of clicks per page")
+    parser.add_argument("--numOrgs", type=int, default=1, help="Number of organizations (adds an OrgId column)")
+    parser.add_argument("--eventsPerBundle", type=int, default=500000, help="Maximum number of events per file")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    events = generate_events(args.numEvents, args.numUrls, args.zipfExponent, args.meanSessionLength,
+                             args.clickRate, numOrgs=args.numOrgs, seed=args.seed)
+    for path in write_bundles(events, args.folder, args.eventsPerBundle):
+        print("Wrote file: " + path)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""import_time.py
+
+Time the import of pathutils modules and CLIs, each in a fresh interpreter, and list the heavy optional libraries
+(plotting, scipy.stats) that each import pulls in. Analysis modules and CLIs shouldn't load plotting libraries until
+a plot is drawn. Run from the repository root:
+
+    python -m benchmarks.import_time --repeat 5 --output import_times.json
+
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks import run_benchmarks
+
+DEFAULTMODULES = ["pathutils", "pathutils.utils", "pathutils.analyze_traffic", "pathutils.analysis_context",
+                  "pathutils.get_popular_urls", "pathutils.funnel_stats", "pathutils.funnel_in_outs",
+                  "pathutils.frequent_funnel", "pathutils.analyze_timing", "pathutils.sankey_funnel",
+                  "pathutils.path_query", "pathutils.server", "pathutils.__main__"]
+# modules that only plotting (or rarely used statistics) should need
+HEAVYMODULES = ["matplotlib", "matplotlib.pyplot", "plotly", "plotly.graph_objects", "scipy.stats", "tkinter"]
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module: str, repeat: int = 3) -> dict:
+    """Best import time of a module over `repeat` fresh interpreters, and the heavy modules it loaded"""
+    runs = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _SCRIPT.format(module=module, heavy=HEAVYMODULES)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        runs.append(result["seconds"])
+        loaded = result["loaded"]
+    return {"module": module, "seconds": min(runs), "runs": runs, "heavy_modules": loaded}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the import of pathutils modules")
+    parser.add_argument("--modules", type=str, nargs="+", default=DEFAULTMODULES, help="Modules to import")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of imports per module (the best time is kept)")
+    parser.add_argument("--output", type=str, default=None, help="Path of a JSON results file")
+    args = parser.parse_args()
+    results = []
+    for module in args.modules:
+        result = time_import(module, args.repeat)
+        results.append(result)
+        print(f"{module:<28} {result['seconds']:8.3f}s  {' '.join(result['heavy_modules'])}")
+    if args.output is not None:
+        with open(args.output, "w") as fwrite:
+            json.dump({"environment": run_benchmarks.get_environment(), "results": results}, fwrite, indent=2)
+        print("Wrote results to " + args.output)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""run_benchmarks.py
+
+Time the main pathutils stages on synthetic Hauser data of increasing size, and write the results as JSON so that
+runs can be compared over time. Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --sizes 10000 100000 --output results.json
+
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import generate_hauser
+from pathutils import analyze_clicks, analyze_timing, analyze_traffic, frequent_funnel, funnel_in_outs, \
+    funnel_stats, sankey_funnel, utils
+
+DEFAULTSIZES = [10000, 100000, 1000000, 10000000]
+FUNNEL = [generate_hauser.SITE + "/", generate_hauser.SITE + "/cart", generate_hauser.SITE + "/checkout"]
+
+
+def time_stage(results: list, size: int, stage: str, fn, repeat: int = 1):
+    """Run `fn` `repeat` times, record the best time in `results`, and return the result of the last run"""
+    times = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            value = fn()
+        times.append(time.perf_counter() - start)
+    results.append({"events": size, "stage": stage, "seconds": min(times), "runs": times})
+    print(f"{size:>10} {stage:<24} {min(times):10.3f}s")
+    return value
+
+
+def run_size(size: int, results: list, repeat: int = 1, numUrls: int = 1000, seed: int = 0):
+    folder = tempfile.mkdtemp(prefix="pathutils-bench-")
+    try:
+        events = generate_hauser.generate_events(size, numUrls=numUrls, seed=seed)
+        generate_hauser.write_bundles(events, folder)
+        del events
+
+        raw = time_stage(results, size, "get_hauser_as_df",
+                         lambda: analyze_traffic.get_hauser_as_df(folder, navigate_only=False), repeat)
+        # preproc_events modifies its input, so each run gets its own copy
+        dffull = time_stage(results, size, "preproc_events", lambda: utils.preproc_events(raw.copy()), repeat)
+        del raw
+        df = analyze_clicks.remove_non_navigation(dffull)
+        time_stage(results, size, "build_session_index",
+                   lambda: analyze_traffic.build_session_index(df, analyze_traffic.PAGEURL), repeat)
+        time_stage(results, size, "get_funnel_stats", lambda: funnel_stats.get_funnel_stats(df, FUNNEL, False), repeat)
+        time_stage(results, size, "get_in_outs", lambda: funnel_in_outs.get_in_outs(df, FUNNEL, False), repeat)
+        time_stage(results, size, "get_top_funnels_df",
+                   lambda: frequent_funnel.get_top_funnels_df(FUNNEL[1], 3, False, df), repeat)
+        time_stage(results, size, "get_timing_for_funnel",
+                   lambda: analyze_timing.get_timing_for_funnel(dffull, FUNNEL, False), repeat)
+        time_stage(results, size, "plot_funnel_data",
+                   lambda: sankey_funnel.get_funnel_lists("benchmark", df, FUNNEL, False), repeat)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time": pd.Timestamp.now(tz="UTC").isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pathutils stages on synthetic Hauser data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULTSIZES, help="Numbers of events to test")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs per stage (the best time is kept)")
+    parser.add_argument("--numUrls", type=int, default=1000, help="Number of distinct URLs in the generated data")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated data")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Path of the JSON results file")
+    args = parser.parse_args()
+    results = []
+    for size in args.sizes:
+        run_size(size, results, args.repeat, args.numUrls, args.seed)
+    with open(args.output, "w") as fwrite:
+        json.dump({"environment": get_environment(), "results": results}, fwrite, indent=2)
+    print("Wrote results to " + args.output)
@@ -17,7 +17,7 @@ from textwrap import wrap
 
 from pathutils import (get_popular_urls, funnel_in_outs,funnel_stats, sankey_funnel, 
                        frequent_funnel, analyze_clicks, analyze_traffic, utils, manage_resolutions, 
-                       url_regex_resolver, analyze_timing)
+                       url_regex_resolver, analyze_timing, analysis_context)
 
 
 # In[ ]:
@@ -61,13 +61,22 @@ df = analyze_clicks.remove_non_navigation(dffull)
 df.head(15)
 
 
+# ## Wrap the dataframe in an analysis context
+# The context caches resolved URLs and session indexes, so that the analyses below don't rebuild them on every call
+
+# In[ ]:
+
+
+ctx = analysis_context.AnalysisContext(dffull)
+
+
 # ## Plot a diagram of top most visited URLs
 
 # In[ ]:
 
 
 useResolvedUrls = False
-url_counts = get_popular_urls.get_popular(df, useResolvedUrls, LIMITROWS)
+url_counts = get_popular_urls.get_popular(ctx, useResolvedUrls, LIMITROWS)
 TOPCOUNTS = 20 # limit output rows
 analyze_traffic.plot_counts_by_freq(url_counts, TOPCOUNTS, "URL Counts", False)
 
@@ -80,7 +89,7 @@ analyze_traffic.plot_counts_by_freq(url_counts, TOPCOUNTS, "URL Counts", False)
 TESTURL = "https://www.oodatime.com/cart"
 FUNNELLEN = 3
 NUMFUNNELSTOSHOW = 4
-top_funnels = frequent_funnel.get_top_funnels_df(TESTURL, FUNNELLEN, useResolvedUrls, df, LIMITROWS)
+top_funnels = frequent_funnel.get_top_funnels_df(TESTURL, FUNNELLEN, useResolvedUrls, ctx, LIMITROWS)
 frequent_funnel.print_top_funnel_counts(top_funnels, NUMFUNNELSTOSHOW)
 
 
@@ -92,7 +101,7 @@ frequent_funnel.print_top_funnel_counts(top_funnels, NUMFUNNELSTOSHOW)
 test_funnel=["https://www.oodatime.com/collections/mens",
              "https://www.oodatime.com/collections/mens/products/blue-watch",
              "https://www.oodatime.com/cart"]
-funnel_counts = funnel_stats.get_funnel_stats(df, test_funnel, useResolvedUrls, LIMITROWS)
+funnel_counts = funnel_stats.get_funnel_stats(ctx, test_funnel, useResolvedUrls, LIMITROWS)
 analyze_traffic.plot_counts_by_freq(funnel_counts, 0, "Funnel Counts", True)
 
 
@@ -101,7 +110,7 @@ analyze_traffic.plot_counts_by_freq(funnel_counts, 0, "Funnel Counts", True)
 # In[ ]:
 
 
-sankey_funnel.plot_funnel("Blue Watch Funnel", df, test_funnel, useResolvedUrls, cutoff=4)
+sankey_funnel.plot_funnel("Blue Watch Funnel", ctx, test_funnel, useResolvedUrls, cutoff=4)
 
 
 # ## Generate session links for the specified funnel
@@ -113,7 +122,7 @@ sankey_funnel.plot_funnel("Blue Watch Funnel", df, test_funnel, useResolvedUrls,
 
 ORGID = "NHQ5G"
 STAGING = False
-sessions = analyze_traffic.get_sessions_for_funnel(df, test_funnel, useResolvedUrls, ORGID, STAGING, True, 5)
+sessions = analyze_traffic.get_sessions_for_funnel(ctx, test_funnel, useResolvedUrls, ORGID, STAGING, True, 5)
 for s in sessions:
     print(s)
 
@@ -126,7 +135,7 @@ for s in sessions:
 ORGID = "NHQ5G"
 STAGING = False
 clicktype = "rage"
-sessions = analyze_traffic.get_sessions_for_funnel_and_click(dffull, test_funnel, clicktype, useResolvedUrls, ORGID, STAGING, True, 5)
+sessions = analyze_traffic.get_sessions_for_funnel_and_click(ctx, test_funnel, clicktype, useResolvedUrls, ORGID, STAGING, True, 5)
 for s in sessions:
     print(s)
 
@@ -136,7 +145,7 @@ for s in sessions:
 # In[12]:
 
 
-funtimes = analyze_timing.get_timing_for_funnel(dffull, test_funnel, useResolvedUrls)
+funtimes = analyze_timing.get_timing_for_funnel(ctx, test_funnel, useResolvedUrls)
 analyze_timing.print_timing_averages(test_funnel, funtimes)
 
 
@@ -161,7 +170,7 @@ analyze_timing.plot_timing_data(test_funnel, funtimes, -1)
 # In[15]:
 
 
-ingress, egress = funnel_in_outs.get_in_outs(df, test_funnel, useResolvedUrls, LIMITROWS)
+ingress, egress = funnel_in_outs.get_in_outs(ctx, test_funnel, useResolvedUrls, LIMITROWS)
 
 
 # ## Plot inflow statistics
@@ -185,7 +194,7 @@ analyze_traffic.plot_counts_by_freq(egress, 0, "Egress", False)
 # In[18]:
 
 
-url_counts = get_popular_urls.get_popular(df, useResolvedUrls, LIMITROWS)
+url_counts = get_popular_urls.get_popular(ctx, useResolvedUrls, LIMITROWS)
 TOPCOUNTS = 20
 analyze_traffic.plot_counts_by_freq(url_counts, TOPCOUNTS, "URL Counts", False)
 
@@ -220,7 +229,7 @@ manage_resolutions.show_rules()
 
 
 useResolvedUrls = True
-url_counts = get_popular_urls.get_popular(df, useResolvedUrls, LIMITROWS)
+url_counts = get_popular_urls.get_popular(ctx, useResolvedUrls, LIMITROWS)
 TOPCOUNTS = 20
 analyze_traffic.plot_counts_by_freq(url_counts, TOPCOUNTS, "URL Counts", False)
 
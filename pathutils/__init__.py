@@ -8,4 +8,23 @@ __all__ = ["analyze_traffic",
            "sankey_funnel",
            "frequent_funnel",
            "analyze_clicks",
-           "analyze_timing"]
+           "analyze_timing",
+           "path_query",
+           "analysis_context",
+           "transition_matrix",
+           "markov_model",
+           "path_trie",
+           "profiling",
+           "progress",
+           "sampling",
+           "schema",
+           "hauser_reader",
+           "bundle_store",
+           "server",
+           "result_cache",
+           "partitions",
+           "day_buckets",
+           "funnel_registry",
+           "session_links",
+           "top_sessions",
+           "plotting"]
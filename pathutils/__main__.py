@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+"""__main__.py
+
+Command line entry point (`pathutils`, or `python -m pathutils`):
+
+    pathutils serve my_hauser_folder --port 8050
+
+"""
+
+import argparse
+
+from pathutils import server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pathutils", description="Pathing analytics on Hauser export data")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serveParser = commands.add_parser("serve", help="Serve analyses on a Hauser folder over HTTP/JSON",
+                                      description="Load a Hauser folder once and serve analyses on it over HTTP/JSON")
+    server.add_serve_arguments(serveParser)
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        server.serve(args.hauser_folder, args.host, args.port, args.useResolvedUrls, args.cache_size,
+                     args.cache_folder, args.refresh_interval, args.quiet, sample_fraction=args.sample_fraction)
+
+
+if __name__ == "__main__":
+    main()
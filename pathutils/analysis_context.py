@@ -0,0 +1,263 @@
+"""analysis_context.py
+
+Wraps a preprocessed events DataFrame and caches the intermediates that the analysis functions would otherwise
+recompute on every call: the resolved URL column, inverted session indexes, encoded session paths, URL transition
+matrices, Markov models, path tries, click type indexes and the session metadata table.
+
+Functions accepting an `events` DataFrame (`get_popular_urls.get_popular`, `funnel_stats.get_funnel_stats`,
+`funnel_in_outs.get_in_outs`, `frequent_funnel.get_top_funnels_df`, `sankey_funnel.plot_funnel`,
+`analyze_timing.get_timing_for_funnel` and `analyze_traffic.get_sessions_for_funnel*`) also accept an
+`AnalysisContext` in its place:
+
+    ctx = analysis_context.AnalysisContext(dffull)
+    url_counts = get_popular_urls.get_popular(ctx, useResolvedUrls)
+    funnel_counts = funnel_stats.get_funnel_stats(ctx, test_funnel, useResolvedUrls)
+
+Cached values are evicted in least recently used order once their estimated size exceeds the memory budget. A context
+can be shared between threads: intermediates are computed once, under a lock, and analyses then read them
+concurrently. Cached session indexes are read-only (see `freeze_index`), so that no analysis can change them while
+others read them, and URLs are resolved into a copy of the events for each set of resolution rules rather than in
+place.
+
+"""
+import sys
+import threading
+import types
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from pathutils import analyze_clicks, analyze_traffic, manage_resolutions, markov_model, path_trie, \
+    profiling, transition_matrix, url_regex_resolver, utils
+
+DEFAULTMEMORYBUDGET = 1 << 30  # bytes
+
+
+class AnalysisContext:
+    """Memoizing wrapper around a preprocessed events DataFrame"""
+
+    def __init__(self, events: pd.DataFrame, memory_budget: int = DEFAULTMEMORYBUDGET):
+        """
+        :param events: events DataFrame processed by `utils.preproc_events`. It may contain non-navigate events (which
+        are needed for click type indexes); analyses only use the navigate events.
+        :param memory_budget: approximate upper bound (in bytes) for the cached intermediates
+        """
+        self.events = events
+        self.memory_budget = memory_budget
+        self._cache = OrderedDict()
+        self._cacheSize = 0
+        # reentrant, as intermediates are computed from other intermediates
+        self._lock = threading.RLock()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for `key`, computing (and caching) it with `compute()` if needed
+
+        :param key: hashable cache key
+        :param compute: function with no arguments that computes the value
+        :return: cached or computed value
+        """
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key][0]
+            with profiling.stage("analysis_context." + str(key[0] if isinstance(key, tuple) else key)):
+                value = compute()
+            size = estimate_size(value)
+            self._cache[key] = (value, size)
+            self._cacheSize += size
+            while self._cacheSize > self.memory_budget and len(self._cache) > 1:
+                _, (_, evictedSize) = self._cache.popitem(last=False)
+                self._cacheSize -= evictedSize
+            return value
+
+    def clear(self):
+        """Drop all cached intermediates"""
+        with self._lock:
+            self._cache.clear()
+            self._cacheSize = 0
+
+    def get_column(self, useResolvedUrls: bool) -> str:
+        if useResolvedUrls:
+            return analyze_traffic.RESOLVEDURL
+        return analyze_traffic.PAGEURL
+
+    def get_navigation_events(self) -> pd.DataFrame:
+        """Navigate-only events
+
+        :return: events DataFrame without non-navigate events
+        """
+        return self.get_or_compute("navigation", self._compute_navigation)
+
+    def _compute_navigation(self) -> pd.DataFrame:
+        if (self.events["EventType"] == "navigate").all():
+            return self.events
+        return analyze_clicks.remove_non_navigation(self.events)
+
+    def get_events(self, useResolvedUrls: bool, limit_rows: int = 0) -> pd.DataFrame:
+        """Navigate-only events, with the resolved URL column up to date with the current resolution rules
+
+        :param useResolvedUrls: indicates whether resolved URLs are needed
+        :param limit_rows: number of rows of events DataFrame to use (use all rows if 0)
+        :return: events DataFrame
+        """
+        return self._get_events(self._get_rules_key(useResolvedUrls), limit_rows)
+
+    def _get_events(self, rulesKey, limit_rows: int) -> pd.DataFrame:
+        if limit_rows == 0:
+            return self._get_resolved_events(rulesKey)
+        return self.get_or_compute(("events", limit_rows, rulesKey),
+                                   lambda: self._get_resolved_events(rulesKey).head(limit_rows))
+
+    def _get_rules_key(self, useResolvedUrls: bool):
+        """Key identifying the URL resolution rules in use, or None for the original URLs"""
+        if not useResolvedUrls:
+            return None
+        # rules are applied in order
+        return tuple((manage_resolutions.get_regex_dict() or {}).items())
+
+    def _get_column(self, rulesKey) -> str:
+        return self.get_column(rulesKey is not None)
+
+    def _get_resolved_events(self, rulesKey) -> pd.DataFrame:
+        """Navigate events, with URLs resolved by the rules of `rulesKey` (unless it is None)"""
+        if rulesKey is None:
+            return self.get_navigation_events()
+        return self.get_or_compute(("resolved", rulesKey), lambda: self._compute_resolved(rulesKey))
+
+    def _compute_resolved(self, rulesKey) -> pd.DataFrame:
+        # the navigate events may be the caller's DataFrame, and other threads may be reading them or the URLs
+        # resolved by other rules: resolve into a shallow copy instead of changing them
+        events = self.get_navigation_events().copy(deep=False)
+        if analyze_traffic.RESOLVEDURL in events.columns:
+            del events[analyze_traffic.RESOLVEDURL]
+        url_regex_resolver.resolve_urls(events, dict(rulesKey), analyze_traffic.PAGEURL, analyze_traffic.RESOLVEDURL)
+        return events
+
+    def get_session_index(self, useResolvedUrls: bool, limit_rows: int = 0) -> dict:
+        """Inverted index of URLs to sets of SIDs (see `analyze_traffic.build_session_index`)"""
+        return self._get_session_index(self._get_rules_key(useResolvedUrls), limit_rows)
+
+    def _get_session_index(self, rulesKey, limit_rows: int) -> dict:
+        events = self._get_events(rulesKey, limit_rows)
+        key = ("index", limit_rows, rulesKey)
+        return self.get_or_compute(
+            key, lambda: freeze_index(analyze_traffic.build_session_index(events, self._get_column(rulesKey))))
+
+    def get_encoded_paths(self, useResolvedUrls: bool, limit_rows: int = 0) -> utils.EncodedPaths:
+        """Session paths encoded as integer arrays (see `utils.encode_paths`)"""
+        return self._get_encoded_paths(self._get_rules_key(useResolvedUrls), limit_rows)
+
+    def _get_encoded_paths(self, rulesKey, limit_rows: int) -> utils.EncodedPaths:
+        events = self._get_events(rulesKey, limit_rows)
+        key = ("paths", limit_rows, rulesKey)
+        return self.get_or_compute(key, lambda: utils.encode_paths(events, self._get_column(rulesKey)))
+
+    def get_transition_matrix(self, useResolvedUrls: bool, limit_rows: int = 0):
+        """URL transition matrix (see `transition_matrix.build_transition_matrix`)"""
+        rulesKey = self._get_rules_key(useResolvedUrls)
+        events = self._get_events(rulesKey, limit_rows)
+        paths = self._get_encoded_paths(rulesKey, limit_rows)
+        key = ("transitions", limit_rows, rulesKey)
+        return self.get_or_compute(key, lambda: transition_matrix.build_transition_matrix_from_paths(
+            paths, transition_matrix.get_entry_referrers(events, analyze_traffic.REFERAL)))
+
+    def get_markov_model(self, useResolvedUrls: bool, order: int = 1, limit_rows: int = 0):
+        """Markov model of the specified order (see `markov_model.build_markov_model`)"""
+        rulesKey = self._get_rules_key(useResolvedUrls)
+        paths = self._get_encoded_paths(rulesKey, limit_rows)
+        key = ("markov", order, limit_rows, rulesKey)
+        return self.get_or_compute(key, lambda: markov_model.build_markov_model_from_paths(paths, order))
+
+    def get_path_trie(self, useResolvedUrls: bool, maxDepth: int = path_trie.DEFAULTMAXDEPTH, reverse: bool = False,
+                      limit_rows: int = 0):
+        """Path trie (see `path_trie.build_path_trie`)"""
+        rulesKey = self._get_rules_key(useResolvedUrls)
+        paths = self._get_encoded_paths(rulesKey, limit_rows)
+        key = ("trie", maxDepth, reverse, limit_rows, rulesKey)
+        return self.get_or_compute(key, lambda: path_trie.build_path_trie_from_paths(paths, maxDepth, reverse))
+
+    def get_click_index(self) -> dict:
+        """Click types to lists of SIDs (see `analyze_clicks.build_clicktype_index`)"""
+        return self.get_or_compute("clicks", lambda: analyze_clicks.build_clicktype_index(self.events))
+
+    def get_session_meta(self) -> pd.DataFrame:
+        """Session metadata table of all the events (see `utils.build_session_meta`)"""
+        return self.get_or_compute("session_meta", lambda: utils.build_session_meta(self.events))
+
+    def prepare(self, useResolvedUrls: bool, limit_rows: int = 0) -> (pd.DataFrame, dict, str):
+        """Events, inverted index and URL column name, as used by most analysis functions
+
+        :param useResolvedUrls: indicates whether original or resolved URLs should be used
+        :param limit_rows: number of rows of events DataFrame to use (use all rows if 0)
+        :return: navigate-only events, inverted index, and URL column name
+        """
+        # the events and index are built with the same rules, even if they change meanwhile
+        rulesKey = self._get_rules_key(useResolvedUrls)
+        si = self._get_session_index(rulesKey, limit_rows)
+        events = self._get_events(rulesKey, limit_rows)
+        return events, si, self.get_column(useResolvedUrls)
+
+
+def prepare_events(events, useResolvedUrls: bool, limit_rows: int = 0) -> (pd.DataFrame, dict, str):
+    """Prepare events for analysis: limit rows, resolve URLs, and build the inverted index
+
+    :param events: events DataFrame or AnalysisContext
+    :param useResolvedUrls: indicates whether original or resolved URLs should be used
+    :param limit_rows: number of rows of events DataFrame to use (use all rows if 0)
+    :return: events DataFrame, inverted index, and URL column name
+    """
+    if isinstance(events, AnalysisContext):
+        return events.prepare(useResolvedUrls, limit_rows)
+    if useResolvedUrls:
+        columnToUse = analyze_traffic.RESOLVEDURL
+    else:
+        columnToUse = analyze_traffic.PAGEURL
+    if limit_rows != 0:
+        events = events.head(limit_rows)
+    if useResolvedUrls:
+        url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL, analyze_traffic.RESOLVEDURL)
+    si = analyze_traffic.build_session_index(events, columnToUse)
+    return events, si, columnToUse
+
+
+def freeze_index(sessionIndex: dict) -> types.MappingProxyType:
+    """Read-only view of an inverted index of URLs to sets of SIDs, with frozen sets of SIDs
+
+    Looking up a missing URL raises KeyError instead of adding it (as the `defaultdict` built by
+    `analyze_traffic.build_session_index` would), so the index can be read by concurrent analyses.
+    """
+    return types.MappingProxyType({url: frozenset(sids) for url, sids in sessionIndex.items()})
+
+
+def estimate_size(value) -> int:
+    """Rough estimate of memory used by a cached value, in bytes"""
+    if isinstance(value, AnalysisContext):
+        return estimate_size(value.events) + value._cacheSize
+    if isinstance(value, transition_matrix.TransitionMatrix):
+        return 2 * _sparse_size(value.counts) + estimate_size(value.labels)
+    if isinstance(value, markov_model.MarkovModel):
+        return _sparse_size(value.symbolCounts) + _sparse_size(value.stateCounts) + value.states.nbytes + \
+            estimate_size(value.labels)
+    if isinstance(value, path_trie.PathTrie):
+        # node object, its children dict and the dict entry pointing to it
+        return value.numNodes * 200 + estimate_size(value.labels)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(estimate_size(v) for v in value)
+    if isinstance(value, types.MappingProxyType):
+        return estimate_size(dict(value))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (set, frozenset, list)):
+        # container plus one (shared) string reference per element
+        return sys.getsizeof(value) + 8 * len(value)
+    return sys.getsizeof(value)
+
+
+def _sparse_size(matrix) -> int:
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
@@ -5,7 +5,7 @@ A collection of utilities for extracting specific sessions based on what types o
 """
 import pandas as pd
 
-from pathutils import utils
+from pathutils import profiling, utils
 from collections import defaultdict
 
 CLICKTYPES = ["rage", "error", "dead"]
@@ -28,6 +28,7 @@ def click_counts(df: pd.DataFrame) -> dict:
     clicks["normal"] = frame_regular.shape[0]
     return clicks
 
+@profiling.profiled
 def build_clicktype_index(df: pd.DataFrame) -> dict:
     sessIndex = defaultdict(list)
     frame = df.loc[df["EventType"] == "click"]
@@ -48,14 +49,19 @@ def build_clicktype_index(df: pd.DataFrame) -> dict:
         sessIndex["error"] = []
     return sessIndex
 
+@profiling.profiled
 def filter_dataset_by_clicktype(df: pd.DataFrame, clicktype: str) -> pd.DataFrame:
     if clicktype not in CLICKTYPES:
         print("Error: unknown click type: " + clicktype)
         return None
     si = build_clicktype_index(df)
+    # an empty session list doesn't filter anything in `filter_events`
+    if len(si[clicktype]) == 0:
+        return df.iloc[0:0]
     filtered = utils.filter_events(df, session=si[clicktype])
     return filtered
 
+@profiling.profiled
 def remove_non_navigation(df: pd.DataFrame) -> pd.DataFrame:
     """Removes non-navigation events from the dataframe
 
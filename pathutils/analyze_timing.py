@@ -5,46 +5,57 @@ from session data.
 
 """
 import numpy as np
-import plotly.graph_objects as gobj
 
 from pandas import DataFrame
 
-from pathutils import analyze_clicks, analyze_traffic, manage_resolutions, url_regex_resolver
+from pathutils import analysis_context, analyze_clicks, analyze_traffic, plotting, profiling, progress
 
 EVENTSTART = "EventStart"
 
 def get_timing_for_funnel(eventsfull: DataFrame, funnel: list, useResolvedUrls: bool) -> list:
     """Get a list of funnel step times (amounts of time users spend before navigating to next step) for a funnel
 
-    :param eventsfull: full events DataFrame (that includes non-navigate events)
+    :param eventsfull: full events DataFrame (that includes non-navigate events), or AnalysisContext
     :param funnel: funnel of interest
     :param useResolvedUrls: indicates whether original or resolved URLs should be used
     :return: list of funnel step times for each step
     """
+    if isinstance(eventsfull, analysis_context.AnalysisContext):
+        events = eventsfull
+    else:
+        events = analyze_clicks.remove_non_navigation(eventsfull)
+    events, si, columnToUse = analysis_context.prepare_events(events, useResolvedUrls)
+    return get_funnel_timing(events, si, funnel, columnToUse)
+
+
+@profiling.profiled
+def get_funnel_timing(events: DataFrame, sessionIndex: dict, funnel: list, colName: str) -> list:
+    """Get a list of funnel step times for a funnel, using a prebuilt inverted index
+
+    :param events: navigate-only events DataFrame
+    :param sessionIndex: inverted index of URLs to SIDs
+    :param funnel: funnel of interest
+    :param colName: column name to use
+    :return: list of funnel step times for each step
+    """
     funneltimes = []
     for i in range(len(funnel)):
         funneltimes.append([])
-    events = analyze_clicks.remove_non_navigation(eventsfull)
-    if useResolvedUrls:
-        columnToUse = analyze_traffic.RESOLVEDURL
-    else:
-        columnToUse = analyze_traffic.PAGEURL
-    if useResolvedUrls:
-        url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL, analyze_traffic.RESOLVEDURL)
-    si = analyze_traffic.build_session_index(events, columnToUse)
-    sessFound = analyze_traffic.get_unordered_sessions_for_funnel(si, funnel)
-    sessOrdered = analyze_traffic.get_sessions_with_ordered(events, sessFound, funnel, columnToUse, strict=True)
-    for sid in sessOrdered:
-        sess_df = events.loc[sid]
-        indices = analyze_traffic.get_sublist_indices(funnel, sess_df[columnToUse].tolist(), True)
-        for index in indices:
-            timestamps = []
-            timespent = []
-            for i in range(len(funnel)):
-                timestamps.append(sess_df.iloc[index + i].loc[EVENTSTART])
-                if i > 0:
-                    delta = timestamps[i] - timestamps[i - 1]
-                    funneltimes[i-1].append(delta.total_seconds())
+    sessFound = analyze_traffic.get_unordered_sessions_for_funnel(sessionIndex, funnel)
+    sessOrdered = analyze_traffic.get_sessions_with_ordered(events, sessFound, funnel, colName, strict=True)
+    with progress.track("analyze_timing.get_funnel_timing", len(sessOrdered)) as tracker:
+        for sid in sessOrdered:
+            sess_df = events.loc[sid]
+            indices = analyze_traffic.get_sublist_indices(funnel, sess_df[colName].tolist(), True)
+            for index in indices:
+                timestamps = []
+                timespent = []
+                for i in range(len(funnel)):
+                    timestamps.append(sess_df.iloc[index + i].loc[EVENTSTART])
+                    if i > 0:
+                        delta = timestamps[i] - timestamps[i - 1]
+                        funneltimes[i-1].append(delta.total_seconds())
+            tracker.update()
     return funneltimes
 
 
@@ -71,6 +82,7 @@ def plot_timing_data(funnel: list, funneltimes: list, step: int = -1):
     :param step: Step of the funnel to plot the histogram for. If a negative number, overlaid histograms are plotted for all steps
     :return:
     """
+    gobj = plotting.get_graph_objects()
     if step < 0:
         fig = gobj.Figure()
         for i in range(len(funnel) - 1):
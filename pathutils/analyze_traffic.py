@@ -10,24 +10,19 @@ Author: Gregory Larchev
 Date: May 30, 2019
 """
 
-import matplotlib
-
-try:
-    matplotlib.use("TkAgg")
-except:
-    print("Looks like your system doesn't support TkAgg backend. If you're running the script from the command line, \
-          there is a small chance plots won't display correctly.")
-
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import os
 
+from pathutils import analysis_context
 from pathutils import analyze_clicks
+from pathutils import hauser_reader
+from pathutils import plotting
+from pathutils import profiling
+from pathutils import progress
+from pathutils import session_links
+from pathutils import top_sessions
 from pathutils import utils
-from pathutils import manage_resolutions
-from pathutils import url_regex_resolver
-from pathutils.utils import pseudo_beaker
 
 from collections import Counter, defaultdict
 from textwrap import wrap
@@ -36,6 +31,9 @@ from urllib.parse import urlparse
 
 # some useful internal constants
 NUMBEROFLOOPS = "numberOfLoops"
+NUMBEROFBACKTRACKS = "numberOfBacktracks"
+NUMBEROFREVISITS = "numberOfRevisits"
+LOOPCOLUMNS = [NUMBEROFLOOPS, NUMBEROFBACKTRACKS, NUMBEROFREVISITS]
 REFERAL = "PageRefererUrl"
 PAGEURL = "PageUrl"
 RESOLVEDURL = "ResolvedUrl"
@@ -44,22 +42,57 @@ CLEANPATH = "pg_clean_path"
 RFNETLOC = "rf_netloc"
 RFPATH = "rf_path"
 RFRESOLVEDURL = "RefResolvedUrl"
+PGPREFIX = "pg_"
+RFPREFIX = "rf_"
+URLPARTS = ["scheme", "netloc", "path"]
+RFSCHEME = RFPREFIX + "scheme"
 
 
+@profiling.profiled
 def add_loop_count(events: pd.DataFrame, colName: str):
     """
-    add_loop_count modifies a Dataframe in-place to add a loop count column. Currently the loop count
-    alogrithm is extremely naive (it counts the repeating URLs), but we can improve later.
+    add_loop_count modifies a Dataframe in-place to add loop count columns (see `get_loop_stats`): NUMBEROFLOOPS (the
+    number of times the most frequently visited URL is repeated), NUMBEROFBACKTRACKS and NUMBEROFREVISITS.
 
     :param events: pd.Dataframe with events data. It's a MultiIndex with sid as the key.
     :param colName: The name of the column containing the URLs. We made this a parameter so that we can define
     'loops' as we see fit (either original or cleaned up URLs can be used).
     :return:
     """
-    unique_session_ids = utils.get_sessions(events)
-    for idx, sid in enumerate(unique_session_ids):
-        sess_df = events.loc[sid]
-        events.loc[sid, NUMBEROFLOOPS] = number_of_loops(sess_df[colName].tolist())
+    paths = utils.encode_paths(events, colName)
+    loopStats = get_loop_stats(paths)
+    sessionOfRow = np.repeat(np.arange(len(paths.sids)), np.diff(paths.offsets))
+    events[LOOPCOLUMNS] = loopStats.to_numpy()[sessionOfRow]
+
+
+def get_loop_stats(paths: utils.EncodedPaths) -> pd.DataFrame:
+    """
+    get_loop_stats computes loop metrics for every session from encoded session paths:
+    - NUMBEROFLOOPS: number of repeats of the most frequently visited URL (same as `number_of_loops`)
+    - NUMBEROFBACKTRACKS: number of immediate back-and-forth cycles (A -> B -> A)
+    - NUMBEROFREVISITS: number of visits to a URL already visited earlier in the session
+
+    :param paths: encoded session paths (see `utils.encode_paths`)
+    :return: DataFrame of loop metrics, indexed by sid
+    """
+    codes = paths.codes
+    numSessions = len(paths.sids)
+    sessionOfRow = np.repeat(np.arange(numSessions), np.diff(paths.offsets))
+    # count visits for each (session, URL) pair
+    pairs = sessionOfRow.astype(np.int64) * (len(paths.labels) + 1) + (codes + 1)
+    uniquePairs, visits = np.unique(pairs, return_counts=True)
+    sessionOfPair = uniquePairs // (len(paths.labels) + 1)
+    mostVisits = np.zeros(numSessions, dtype=np.int64)
+    np.maximum.at(mostVisits, sessionOfPair, visits)
+    distinctUrls = np.bincount(sessionOfPair, minlength=numSessions)
+    # A -> B -> A: same URL as two steps back (within the session), but not as one step back
+    backtracks = np.zeros(len(codes), dtype=bool)
+    backtracks[2:] = (codes[2:] == codes[:-2]) & (codes[2:] != codes[1:-1]) & (sessionOfRow[2:] == sessionOfRow[:-2])
+    return pd.DataFrame({
+        NUMBEROFLOOPS: mostVisits - 1,
+        NUMBEROFBACKTRACKS: np.bincount(sessionOfRow[backtracks], minlength=numSessions),
+        NUMBEROFREVISITS: np.diff(paths.offsets) - distinctUrls,
+    }, index=pd.Index(paths.sids, name="sid"))
 
 
 def number_of_loops(sessList: list) -> int:
@@ -73,14 +106,47 @@ def number_of_loops(sessList: list) -> int:
     return c.most_common(1)[0][1] - 1
 
 
+def add_url_parts(events: pd.DataFrame, fromCol: str = PAGEURL, prefix: str = PGPREFIX):
+    """
+    add_url_parts modifies a DataFrame in-place to add the scheme, netloc and path components of the URLs in 'fromCol'
+    as categorical columns (named prefix + "scheme", prefix + "netloc" and prefix + "path"). Each distinct URL is only
+    parsed once, and missing URLs get empty components.
+
+    :param events: events DataFrame
+    :param fromCol: name of the column containing the URLs
+    :param prefix: prefix for the names of the new columns
+    :return:
+    """
+    codes, uniques = pd.factorize(events[fromCol])
+    # missing values (code -1) point to an empty URL appended after the distinct ones
+    codes = np.where(codes < 0, len(uniques), codes)
+    parsed = [urlparse(u) for u in uniques] + [urlparse("")]
+    for part in URLPARTS:
+        partCodes, partValues = pd.factorize(np.array([getattr(p, part) for p in parsed], dtype=object))
+        events[prefix + part] = pd.Categorical.from_codes(partCodes[codes], categories=partValues)
+
+
+def add_ref_url_parts(events: pd.DataFrame):
+    """
+    add_ref_url_parts adds the components of referrer URLs to DataFrame in RFSCHEME, RFNETLOC and RFPATH columns.
+
+    :param events: events DataFrame
+    :return:
+    """
+    add_url_parts(events, REFERAL, RFPREFIX)
+
+
 def add_ref_resolved_url(events: pd.DataFrame):
     """
-    add_ref_resolved_url adds a resolved reference URL to DataFrame in RFRESOLVEDURL column.
+    add_ref_resolved_url adds a resolved reference URL to DataFrame in RFRESOLVEDURL column. The RFNETLOC and RFPATH
+    columns are added from REFERAL column first, if they are not present.
 
     :param events: events DataFrame
     :return:
     """
-    events[RFRESOLVEDURL] = events.apply(construct_resolved_ref_url, axis=1)
+    if RFNETLOC not in events.columns or RFPATH not in events.columns:
+        add_ref_url_parts(events)
+    events[RFRESOLVEDURL] = map_unique([events[RFNETLOC], events[RFPATH]], construct_resolved_ref_url_parts)
 
 
 def construct_resolved_ref_url(row: pd.Series):
@@ -90,11 +156,15 @@ def construct_resolved_ref_url(row: pd.Series):
     :param row: events DataFrame row
     :return:
     """
-    netloc = row[RFNETLOC]
-    rfPath = row[RFPATH]
-    if len(netloc) == 0:
+    return construct_resolved_ref_url_parts(row[RFNETLOC], row[RFPATH])
+
+
+def construct_resolved_ref_url_parts(netloc: str, rfPath: str):
+    if not type(netloc) == str or len(netloc) == 0:
         return np.NaN
     schemeNetloc = "https://" + netloc
+    if not type(rfPath) == str:
+        return schemeNetloc
     fullpath = schemeNetloc + rfPath
     return fullpath
 
@@ -107,7 +177,9 @@ def add_resolved_url(events: pd.DataFrame):
     :param events: events DataFrame
     :return:
     """
-    events[RESOLVEDURL] = events.apply(construct_resolved_url, axis=1)
+    # lists can't be hashed, so clean paths are joined first
+    cleanPaths = events[CLEANPATH].map(join_clean_path)
+    events[RESOLVEDURL] = map_unique([events[PAGEURL], cleanPaths], construct_resolved_url_parts)
 
 
 def construct_resolved_url(row: pd.Series):
@@ -117,17 +189,64 @@ def construct_resolved_url(row: pd.Series):
     :param row: events DataFrame row
     :return: resolved URL
     """
-    pageUrl = row[PAGEURL]
-    cleanPath = row[CLEANPATH]
+    return construct_resolved_url_parts(row[PAGEURL], join_clean_path(row[CLEANPATH]))
+
+
+def join_clean_path(cleanPath) -> str:
+    if type(cleanPath) == list:
+        return "".join(["/" + p for p in cleanPath])
+    return ""
+
+
+def construct_resolved_url_parts(pageUrl: str, joinedCleanPath: str) -> str:
     parsedUrl = urlparse(pageUrl)
     schemeNetloc = parsedUrl.scheme + "://" + parsedUrl.netloc
-    if type(cleanPath) == list:
-        fullpath = [schemeNetloc] + cleanPath
-    else:
-        fullpath = [schemeNetloc]
-    return "/".join(fullpath)
+    return schemeNetloc + joinedCleanPath
 
 
+def map_unique(columns: list, fn) -> pd.Categorical:
+    """
+    map_unique computes fn(a, b, ...) for every row of the given columns, but only calls fn once for each distinct
+    combination of values. Missing values are passed to fn as NaN.
+
+    :param columns: list of equal length columns (Series or arrays)
+    :param fn: function taking one argument per column
+    :return: categorical with the results, one per row
+    """
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    uniquesList = []
+    for col in columns:
+        codes, uniques = pd.factorize(col)
+        key = key * (len(uniques) + 1) + (codes + 1)
+        uniquesList.append(uniques)
+    keyCodes, keyUniques = pd.factorize(key)
+    results = []
+    for k in keyUniques:
+        args = []
+        for uniques in reversed(uniquesList):
+            k, c = divmod(int(k), len(uniques) + 1)
+            args.append(uniques[c - 1] if c > 0 else np.NaN)
+        results.append(fn(*reversed(args)))
+    resultCodes, resultValues = pd.factorize(np.array(results, dtype=object))
+    return pd.Categorical.from_codes(resultCodes[keyCodes], categories=resultValues)
+
+
+def get_referrer_domain_counts(events: pd.DataFrame) -> dict:
+    """
+    get_referrer_domain_counts counts sessions by the referrer domain (netloc) of their first event. Sessions without
+    a referrer are counted as UNKNOWN.
+
+    :param events: events DataFrame
+    :return: dictionary of referrer domains and session counts
+    """
+    if RFNETLOC not in events.columns:
+        add_ref_url_parts(events)
+    firsts = events.loc[~events.index.get_level_values(0).duplicated(), RFNETLOC]
+    counts = firsts.astype(object).replace("", UNKNOWN).fillna(UNKNOWN).value_counts()
+    return counts.to_dict()
+
+
+@profiling.profiled
 def build_session_index(events: pd.DataFrame, colName: str) -> dict:
     """
     build_session_index builds an inverted index of values in 'colName' to list of sessions.
@@ -138,13 +257,16 @@ def build_session_index(events: pd.DataFrame, colName: str) -> dict:
     """
     unique_session_ids = utils.get_sessions(events)
     sessIndex = defaultdict(set)
-    for idx, sid in enumerate(unique_session_ids):
-        sess_df = events.loc[sid]
-        for url in set(sess_df[colName].tolist()):
-            sessIndex[url].add(sid)
+    with progress.track("analyze_traffic.build_session_index", len(unique_session_ids)) as tracker:
+        for idx, sid in enumerate(unique_session_ids):
+            sess_df = events.loc[sid]
+            for url in set(sess_df[colName].tolist()):
+                sessIndex[url].add(sid)
+            tracker.update()
     return sessIndex
 
 
+@profiling.profiled
 def get_funnel_in_outs(
     events: pd.DataFrame,
     sessionIndex: dict,
@@ -171,26 +293,32 @@ def get_funnel_in_outs(
     ingressCounts = defaultdict(int)
     funnelMatches = utils.filter_events(events, session=sessOrdered)
     uniqSids = utils.get_sessions(funnelMatches)
-    for idx, sid in enumerate(uniqSids):
-        sess_df = funnelMatches.loc[sid]
-        for index in get_sublist_indices(
-            funnel, sess_df[colName].tolist(), strict=True
-        ):
-            if index == 0:
-                ingress = sess_df.iloc[index].loc[referalColName]
+    with progress.track("analyze_traffic.get_funnel_in_outs", len(uniqSids)) as tracker:
+        for idx, sid in enumerate(uniqSids):
+            sess_df = funnelMatches.loc[sid]
+            for index in get_sublist_indices(
+                funnel, sess_df[colName].tolist(), strict=True
+            ):
+                if index == 0:
+                    ingress = sess_df.iloc[index].loc[referalColName]
+                else:
+                    ingress = sess_df.iloc[index - 1].loc[colName]
+                # missing referrers and URLs are unknown (as in `transition_matrix.TransitionMatrix.get_in_outs`)
                 if not type(ingress) == str:
                     ingress = UNKNOWN
-            else:
-                ingress = sess_df.iloc[index - 1].loc[colName]
-            if index + len(funnel) == len(sess_df[colName].tolist()):
-                egress = UNKNOWN
-            else:
-                egress = sess_df.iloc[index + len(funnel)].loc[colName]
-            ingressCounts[ingress] += 1
-            egressCounts[egress] += 1
+                if index + len(funnel) == len(sess_df[colName].tolist()):
+                    egress = UNKNOWN
+                else:
+                    egress = sess_df.iloc[index + len(funnel)].loc[colName]
+                    if not type(egress) == str:
+                        egress = UNKNOWN
+                ingressCounts[ingress] += 1
+                egressCounts[egress] += 1
+            tracker.update()
     return ingressCounts, egressCounts
 
 
+@profiling.profiled
 def get_funnel_conversion_stats(
     events: pd.DataFrame, sessionIndex: dict, funnel: list, colName: str
 ) -> list:
@@ -206,20 +334,8 @@ def get_funnel_conversion_stats(
 
 
 def get_session_link(sid: str, OrgId: str, is_staging: bool) -> str:
-    if len(sid) != 32:
-        raise ValueError("Expect sid to be 32 characters long")
-    userId = sid[:16]
-    sessionId = sid[16:]
-    urlDict = pseudo_beaker(
-        userId,
-        sessionId,
-        replay=False,
-        scope=False,
-        browser=None,
-        OrgId=OrgId,
-        is_staging=is_staging,
-    )
-    return urlDict["session_url"]
+    # sub-sessions (see `utils.split_sessions`) link to the session they belong to
+    return session_links.get_session_urls([sid], OrgId, is_staging)[0]
 
 
 def get_sessions_for_funnel(
@@ -230,31 +346,28 @@ def get_sessions_for_funnel(
     is_staging: bool = False,
     strict: bool = True,
     numSessions: int = 0,
+    rankBy: str = None,
 ) -> list:
     """Get a list of sessions where each session contains the specified funnel
 
-    :param events: events DataFrame
+    :param events: events DataFrame or AnalysisContext
     :param funnel: funnel of interest
     :param useResolvedUrls: indicates whether original or resolved URLs should be used
     :param OrgId: FullStory OrgId for the organization
     :param is_staging: set to True if FullStory staging environment should be used (for debugging purposes)
     :param strict: If `True`, the session has to follow the funnel steps in exact order (with no diversions between the steps). The `False` option is currently not supported.
     :param numSessions: number of sessions to return (if 0, return all available)
+    :param rankBy: return the top sessions of a ranking (see `top_sessions.RANKINGS`), or None for SID order
     :return: list of session URLs
     """
-    if useResolvedUrls:
-        columnToUse = RESOLVEDURL
-    else:
-        columnToUse = PAGEURL
-    if useResolvedUrls:
-        url_regex_resolver.resolve_urls(
-            events, manage_resolutions.get_regex_dict(), PAGEURL, RESOLVEDURL
-        )
-    sids = build_and_get_sids_for_funnel(events, funnel, columnToUse, strict)
+    if rankBy is not None:
+        ranked = top_sessions.get_top_sessions(events, funnel, useResolvedUrls, numSessions, rankBy, strict)
+        return session_links.get_session_urls([sid for sid, _ in ranked], OrgId, is_staging)
+    events, si, columnToUse = analysis_context.prepare_events(events, useResolvedUrls)
+    sids = get_sids_for_funnel(events, si, funnel, columnToUse, strict)
     if numSessions != 0:
         sids = sids[:numSessions]
-    sessions = list(map(lambda p: get_session_link(p, OrgId, is_staging), sids))
-    return sessions
+    return session_links.get_session_urls(sids, OrgId, is_staging)
 
 def get_sessions_for_funnel_and_click(
     events: pd.DataFrame,
@@ -264,11 +377,12 @@ def get_sessions_for_funnel_and_click(
     OrgId: str = None,
     is_staging: bool = False,
     strict: bool = True,
-    numSessions: int = 0
+    numSessions: int = 0,
+    rankBy: str = None
 ) -> list:
     """Get a list of sessions for the specified funnel, where each session has to contain a click of the specified type
 
-    :param events: full events DataFrame (that includes non-navigate events)
+    :param events: full events DataFrame (that includes non-navigate events), or AnalysisContext
     :param funnel: funnel of interest
     :param clicktype: the type of click ("rage", "dead", or "error") that we want to filter for
     :param useResolvedUrls: indicates whether original or resolved URLs should be used
@@ -276,9 +390,35 @@ def get_sessions_for_funnel_and_click(
     :param is_staging: set to True if FullStory staging environment should be used (for debugging purposes)
     :param strict: If `True`, the session has to follow the funnel steps in exact order (with no diversions between the steps). The `False` option is currently not supported.
     :param numSessions: number of sessions to return (if 0, return all available)
+    :param rankBy: return the top sessions of a ranking (see `top_sessions.RANKINGS`), or None for SID order
     :return: list of session URLs
     """
+    if rankBy is not None:
+        if clicktype not in analyze_clicks.CLICKTYPES:
+            print("Error: unknown click type: " + clicktype)
+            return None
+        if not isinstance(events, analysis_context.AnalysisContext):
+            events = analysis_context.AnalysisContext(events)
+        ranked = top_sessions.get_top_sessions(events, funnel, useResolvedUrls, numSessions, rankBy, strict,
+                                               sessions=events.get_click_index()[clicktype])
+        return session_links.get_session_urls([sid for sid, _ in ranked], OrgId, is_staging)
+    if isinstance(events, analysis_context.AnalysisContext):
+        if clicktype not in analyze_clicks.CLICKTYPES:
+            print("Error: unknown click type: " + clicktype)
+            return None
+        clickSids = set(events.get_click_index()[clicktype])
+        navEvents, si, columnToUse = events.prepare(useResolvedUrls)
+        sessFound = (get_unordered_sessions_for_funnel(si, funnel) or set()).intersection(clickSids)
+        sids = get_sessions_with_ordered(navEvents, sessFound, funnel, columnToUse, strict)
+        if numSessions != 0:
+            sids = sids[:numSessions]
+        return session_links.get_session_urls(sids, OrgId, is_staging)
     filtered = analyze_clicks.filter_dataset_by_clicktype(events, clicktype)
+    if filtered is None:
+        return None
+    if len(filtered) == 0:
+        # no session has a click of this type
+        return []
     filtered = analyze_clicks.remove_non_navigation(filtered)
     return get_sessions_for_funnel(filtered, funnel, useResolvedUrls, OrgId, is_staging, strict, numSessions)
 
@@ -335,6 +475,7 @@ def plot_in_outs(ingressCounts: dict, egressCounts: dict):
     extags, excounts = zip(*egresses)
     extags = ["\n".join(wrap(i, 60)) for i in extags]
 
+    plt = plotting.get_pyplot()
     fig1, ax1 = plt.subplots(figsize=(16, 9))
     ypos = np.arange(len(intags))
     ax1.barh(ypos, incounts)
@@ -375,6 +516,7 @@ def plot_counts_by_freq(counts, topcounts: int, title: str, isSortedList: bool):
         counts = counts[:topcounts]
     countTags, countNums = zip(*counts)
     countTags = ["\n".join(wrap(i, 50)) for i in countTags]
+    plt = plotting.get_pyplot()
     fig, ax = plt.subplots(figsize=(12,12))
     ypos = np.arange(len(countTags))
     ax.barh(ypos, countNums)
@@ -387,6 +529,7 @@ def plot_counts_by_freq(counts, topcounts: int, title: str, isSortedList: bool):
     plt.show()
 
 
+@profiling.profiled
 def get_sessions_with_ordered(
     events: pd.DataFrame,
     sessUnordered: set,
@@ -406,13 +549,19 @@ def get_sessions_with_ordered(
     :param strict: if True, enforce the funnel order strictly
     :return: list of sessions containing the funnel
     """
-    filteredEvents = utils.filter_events(events, session=list(sessUnordered))
+    # an empty session list doesn't filter anything in `filter_events`
+    if not sessUnordered:
+        return []
+    # a mask keeps the sessions in row (SID) order, whatever the order of the set
+    filteredEvents = events.loc[events.index.get_level_values(0).isin(list(sessUnordered))]
     uniqSids = utils.get_sessions(filteredEvents)
     sessOrdered = []
-    for idx, sid in enumerate(uniqSids):
-        sess_df = filteredEvents.loc[sid]
-        if len(get_sublist_indices(funnel, sess_df[colName].tolist(), strict)) > 0:
-            sessOrdered.append(sid)
+    with progress.track("analyze_traffic.get_sessions_with_ordered", len(uniqSids)) as tracker:
+        for idx, sid in enumerate(uniqSids):
+            sess_df = filteredEvents.loc[sid]
+            if len(get_sublist_indices(funnel, sess_df[colName].tolist(), strict)) > 0:
+                sessOrdered.append(sid)
+            tracker.update()
     return sessOrdered
 
 
@@ -447,44 +596,56 @@ def get_unordered_sessions_for_funnel(sessionIndex: dict, funnel: list) -> set:
     """
     sessSets = []
     for url in funnel:
-        sessSets.append(sessionIndex[url])
+        # `get` rather than [], so that a missing URL isn't added to a shared (cached) index
+        sessSets.append(sessionIndex.get(url, set()))
     if len(sessSets) == 0:
         return None
     sessFound = sessSets[0].intersection(*sessSets[1:])
     return sessFound
 
 
+@profiling.profiled
 def get_hauser_as_df(
-    folder: str, navigate_only: bool = True, no_robots: bool = True
+    folder: str, navigate_only: bool = True, no_robots: bool = True, sample_fraction: float = 1.0,
+    sample_seed: int = 0, compact: bool = True, drop_pii: bool = False,
+    chunksize: int = hauser_reader.DEFAULTCHUNKSIZE
 ) -> pd.DataFrame:
-    """Import JSON data from Hauser data export tool into a Pandas dataframe.
+    """Import data from Hauser data export tool into a Pandas dataframe.
+
+    Bundles can be JSON arrays, NDJSON or CSV files, optionally compressed
+    (see `hauser_reader`). Rows are filtered and sampled as each chunk is
+    read.
 
     :param folder: path to the Hauser data folder
     :param navigate_only: Only use "navigate" event types (default True)
     :param no_robots: Filter out devices identifying themselves as robots
        (default True)
+    :param sample_fraction: Only keep a deterministic sample of this fraction
+       of sessions (see `sampling.sample_sessions`, default 1.0)
+    :param sample_seed: Seed selecting the sample of sessions (default 0)
+    :param compact: Convert columns to compact types (see
+       `schema.apply_schema`, default True)
+    :param drop_pii: Drop columns holding personal data (default False)
+    :param chunksize: Number of rows parsed at a time from NDJSON and CSV
+       bundles
     :return: dataframe of event data
     """
     if os.path.isdir(folder):
-        df = None
-        for f in os.listdir(folder):
-            if f.endswith(".csv"):
-                raise IOError(
-                    "It looks like you're trying to analyze CSV records. This is not currently supported. Please export your data as JSON."
-                )
-            if f.endswith(".json"):
+        files = [f for f in os.listdir(folder) if hauser_reader.is_bundle(f)]
+        frames = []
+        with progress.track("analyze_traffic.get_hauser_as_df", len(files), interval=1) as tracker:
+            for f in files:
                 f = os.path.join(folder, f)
-                if df is None:
-                    df = pd.read_json(f, orient="records")
-                else:
-                    dftemp = pd.read_json(f, orient="records")
-                    df = df.append(dftemp, sort=False)
+                for chunk in hauser_reader.read_bundle(f, chunksize):
+                    with profiling.stage("analyze_traffic.read_bundle", len(chunk)):
+                        frames.append(hauser_reader.prepare_chunk(chunk, navigate_only, no_robots, sample_fraction,
+                                                                  sample_seed, drop_pii))
                 print("Read file: " + f)
-        if navigate_only:
-            df = df.loc[df["EventType"] == "navigate"].copy()
-        if no_robots:
-            df = df.loc[df["PageDevice"] != "Robot"].copy()
-        return df
+                tracker.update()
+        if len(frames) == 0:
+            print("Warning: no Hauser bundles found in " + folder)
+            return None
+        return hauser_reader.concat_chunks(frames, compact)
     else:
         print("Warning: " + folder + " is not a directory")
         return None
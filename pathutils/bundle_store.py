@@ -0,0 +1,245 @@
+"""bundle_store.py
+
+Concurrent loading of Hauser bundles from an object store (e.g. an S3-compatible bucket), without syncing them to disk
+first. Bundles are listed and streamed through a `BundleStore`, several at a time. The blocks of each bundle are piped
+into the streaming readers of `hauser_reader`, which decompress and parse them in a worker thread while the rest of
+the bundle downloads, so that network, decompression and parsing overlap within a bundle as well as across bundles:
+
+    store = bundle_store.LocalBundleStore("/data/hauser-bucket")
+    df = bundle_store.get_hauser_as_df_from_store(store, prefix="org1/", concurrency=8)
+    df = utils.preproc_events(df)
+
+`LocalBundleStore` reads a local folder laid out like a bucket (keys are paths relative to the folder, separated by
+"/"), which is what MinIO serves from its data directory; implementing `list_bundles` and `stream_bundle` (or just
+`get_bundle`) with an async S3 client gives a store for the real bucket. At most `MAXPIPEDBLOCKS` downloaded blocks
+wait for the parser of each bundle, so memory doesn't grow with the size of the bundles.
+
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import io
+import os
+import queue
+
+import pandas as pd
+
+from pathutils import hauser_reader, profiling, progress
+
+DEFAULTCONCURRENCY = 8
+BLOCKSIZE = 1 << 20  # bytes per block read by LocalBundleStore
+MAXPIPEDBLOCKS = 4  # downloaded blocks waiting for the parser, per bundle
+
+
+class BundleStore:
+    """Storage interface for Hauser bundles. Keys are bundle names relative to the store, with "/" separators."""
+
+    async def list_bundles(self, prefix: str = "") -> list:
+        """Keys of all the objects starting with `prefix`"""
+        raise NotImplementedError
+
+    async def get_bundle(self, key: str) -> bytes:
+        """Contents of one object"""
+        raise NotImplementedError
+
+    async def stream_bundle(self, key: str):
+        """Contents of one object, as an async iterator of blocks of bytes (in one block, from `get_bundle`, unless
+        the store streams downloads)"""
+        yield await self.get_bundle(key)
+
+
+class LocalBundleStore(BundleStore):
+    """Store backed by a local folder (a stand-in for an object store, e.g. in tests). Files are read in a worker
+    thread so that reads don't block the event loop."""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    async def list_bundles(self, prefix: str = "") -> list:
+        return await asyncio.get_running_loop().run_in_executor(None, self._list, prefix)
+
+    def _list(self, prefix: str) -> list:
+        keys = []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                key = os.path.relpath(os.path.join(folder, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    async def get_bundle(self, key: str) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+
+    async def stream_bundle(self, key: str):
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, self._open, key)
+        try:
+            while True:
+                block = await loop.run_in_executor(None, f.read, BLOCKSIZE)
+                if len(block) == 0:
+                    break
+                yield block
+        finally:
+            f.close()
+
+    def _open(self, key: str):
+        path = os.path.join(self.root, *key.split("/"))
+        if not os.path.abspath(path).startswith(self.root + os.sep):
+            raise KeyError(key)
+        return open(path, "rb")
+
+    def _read(self, key: str) -> bytes:
+        with self._open(key) as f:
+            return f.read()
+
+
+class _BlockPipe(io.RawIOBase):
+    """Blocking, read-only file fed with blocks of bytes from another thread (at most `maxBlocks` blocks waiting)"""
+
+    _END = object()
+
+    def __init__(self, maxBlocks: int = MAXPIPEDBLOCKS):
+        super().__init__()
+        self._blocks = queue.Queue(maxBlocks)
+        self._buffer = memoryview(b"")
+        self._error = None
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self._buffer) == 0:
+            if self._eof:
+                return 0
+            block = self._blocks.get()
+            if block is self._END:
+                self._eof = True
+                if self._error is not None:
+                    raise IOError("Bundle download failed") from self._error
+            else:
+                self._buffer = memoryview(block)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def feed(self, block) -> bool:
+        """Add a block, waiting while the pipe is full
+
+        :return: False if the reader was closed (the rest of the bundle isn't needed)
+        """
+        while not self.closed:
+            try:
+                self._blocks.put(block, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self, error: BaseException = None):
+        """Mark the end of the bundle (reads then raise IOError if `error` is given)"""
+        self._error = error
+        self.feed(self._END)
+
+
+def parse_bundle(key: str, data, chunksize: int = hauser_reader.DEFAULTCHUNKSIZE, **chunkArgs) -> list:
+    """Parse a bundle (format and compression are found from the key) into prepared chunks
+
+    :param key: bundle key (e.g. "org1/1565913600.ndjson.gz")
+    :param data: bundle contents, as bytes or a binary file-like object (read as a stream)
+    :param chunksize: number of rows per chunk for NDJSON and CSV bundles
+    :param chunkArgs: filtering and sampling arguments of `hauser_reader.prepare_chunk`
+    :return: list of DataFrames
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    return [hauser_reader.prepare_chunk(chunk, **chunkArgs)
+            for chunk in hauser_reader.read_bundle(data, chunksize, name=key)]
+
+
+def _parse_piped(key: str, pipe: _BlockPipe, chunksize: int, chunkArgs: dict) -> list:
+    try:
+        return parse_bundle(key, io.BufferedReader(pipe), chunksize, **chunkArgs)
+    finally:
+        # stops the download if parsing failed before the end of the bundle
+        pipe.close()
+
+
+async def _feed(store: BundleStore, key: str, pipe: _BlockPipe, loop):
+    try:
+        async for block in store.stream_bundle(key):
+            if not await loop.run_in_executor(None, pipe.feed, block):
+                return
+    except BaseException as e:
+        await loop.run_in_executor(None, pipe.finish, e)
+        raise
+    await loop.run_in_executor(None, pipe.finish)
+
+
+async def fetch_hauser_df(store: BundleStore, prefix: str = "", concurrency: int = DEFAULTCONCURRENCY,
+                          navigate_only: bool = True, no_robots: bool = True, sample_fraction: float = 1.0,
+                          sample_seed: int = 0, compact: bool = True, drop_pii: bool = False,
+                          chunksize: int = hauser_reader.DEFAULTCHUNKSIZE) -> pd.DataFrame:
+    """Download and parse all the bundles of a store under `prefix`, at most `concurrency` at a time
+
+    Each bundle is parsed in a worker thread while it downloads, with at most MAXPIPEDBLOCKS downloaded blocks waiting
+    for its parser. The result is the same as `analyze_traffic.get_hauser_as_df` on a folder holding the same bundles
+    (rows are in key order, whatever order the downloads complete in).
+
+    :param store: BundleStore to read from
+    :param prefix: key prefix of the bundles to load (e.g. an organization or a day)
+    :param concurrency: maximum number of bundles downloaded or parsed at the same time
+    :return: events DataFrame, or None if there is no bundle under `prefix` (see `analyze_traffic.get_hauser_as_df`
+    for the other parameters)
+    """
+    keys = [key for key in await store.list_bundles(prefix) if hauser_reader.is_bundle(key)]
+    if len(keys) == 0:
+        print("WARNING: No bundles found under " + repr(prefix))
+        return None
+    chunkArgs = dict(navigate_only=navigate_only, no_robots=no_robots, sample_fraction=sample_fraction,
+                     sample_seed=sample_seed, drop_pii=drop_pii)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def load(key):
+            async with semaphore:
+                pipe = _BlockPipe()
+                parsing = loop.run_in_executor(executor, _parse_piped, key, pipe, chunksize, chunkArgs)
+                try:
+                    await _feed(store, key, pipe, loop)
+                except BaseException:
+                    # the parser reads the end of the pipe and stops; wait for it before reporting the failure
+                    await asyncio.gather(parsing, return_exceptions=True)
+                    raise
+                return await parsing
+
+        with profiling.stage("bundle_store.fetch_hauser_df"), \
+                progress.track("bundle_store.fetch_hauser_df", len(keys), interval=1) as tracker:
+            tasks = [asyncio.ensure_future(load(key)) for key in keys]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    await task
+                    tracker.update()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    frames = [chunk for task in tasks for chunk in task.result()]
+    return hauser_reader.concat_chunks(frames, compact)
+
+
+def get_hauser_as_df_from_store(store: BundleStore, prefix: str = "", concurrency: int = DEFAULTCONCURRENCY,
+                                **kwargs) -> pd.DataFrame:
+    """Blocking version of `fetch_hauser_df`. Works from a running event loop too (e.g. in Jupyter), by running the
+    download in a separate thread."""
+    coroutine = fetch_hauser_df(store, prefix, concurrency, **kwargs)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # keep the progress reporter of the calling thread
+    context = contextvars.copy_context()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(context.run, asyncio.run, coroutine).result()
@@ -0,0 +1,254 @@
+"""day_buckets.py
+
+Per-day aggregates that can be merged into the results of any window of days. Each day bucket holds the aggregates
+of the sessions starting on that (UTC) day: URL session counts, URL transition counts, and, for registered funnels,
+step counts and step timing histograms. Sessions are counted in the bucket of the day they start on, even if they
+continue after midnight, so every session is in exactly one bucket and sums of buckets are exact:
+
+    buckets = day_buckets.DayBuckets(funnels={"checkout": test_funnel})
+    buckets.update(dffull)
+    buckets.save("buckets")
+    week = buckets.last(7)
+    counts = week.get_popular()
+    funnelCounts = week.get_funnel_stats("checkout")
+
+Window results have the format of the corresponding analysis functions (`get_popular_urls.get_popular`,
+`funnel_stats.get_funnel_stats`, `transition_matrix.build_transition_matrix`) run on the sessions starting within
+the window. Step times are binned, so timing quantiles are approximate (to the width of a bin, 10% of the time).
+
+"""
+import os
+import pickle
+
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from pathutils import analyze_clicks, analyze_timing, analyze_traffic, manage_resolutions, partitions, profiling, \
+    result_cache, transition_matrix, url_regex_resolver
+
+# step time bin edges in seconds (log scale, from 0.1 s to about 28 hours); the last bin holds longer times
+TIMINGBINEDGES = np.r_[0.0, np.logspace(-1, 5, 145)]
+BUCKETEXTENSION = ".pkl"
+METAFILE = "buckets_meta.pkl"
+
+
+class TimingHistogram:
+    """Histograms of funnel step times (time between consecutive funnel steps), one per step"""
+
+    def __init__(self, counts: np.ndarray, sums: np.ndarray):
+        """
+        :param counts: array of shape (number of steps - 1, len(TIMINGBINEDGES)) of binned step time counts
+        :param sums: total step time of each step, in seconds (for exact means)
+        """
+        self.counts = counts
+        self.sums = sums
+
+    @classmethod
+    def from_times(cls, funneltimes: list):
+        """Histograms of the step times returned by `analyze_timing.get_funnel_timing`"""
+        counts = np.zeros((max(len(funneltimes) - 1, 0), len(TIMINGBINEDGES)), dtype=np.int64)
+        sums = np.zeros(len(counts))
+        for step in range(len(counts)):
+            times = np.asarray(funneltimes[step], dtype=float)
+            bins = np.searchsorted(TIMINGBINEDGES, times, side="right") - 1
+            counts[step] = np.bincount(np.clip(bins, 0, len(TIMINGBINEDGES) - 1), minlength=len(TIMINGBINEDGES))
+            sums[step] = times.sum()
+        return cls(counts, sums)
+
+    def merge(self, other: "TimingHistogram") -> "TimingHistogram":
+        return TimingHistogram(self.counts + other.counts, self.sums + other.sums)
+
+    def count(self, step: int) -> int:
+        """Number of step times measured between funnel steps `step` and `step + 1`"""
+        return int(self.counts[step].sum())
+
+    def mean(self, step: int) -> float:
+        count = self.count(step)
+        return self.sums[step] / count if count > 0 else float("nan")
+
+    def quantile(self, step: int, q: float) -> float:
+        """Approximate quantile of a step time, interpolated within its bin"""
+        counts = self.counts[step]
+        total = counts.sum()
+        if total == 0:
+            return float("nan")
+        cumulative = np.cumsum(counts)
+        target = q * total
+        b = int(np.searchsorted(cumulative, target, side="left"))
+        if b >= len(TIMINGBINEDGES) - 1:
+            return float(TIMINGBINEDGES[-1])
+        before = cumulative[b] - counts[b]
+        fraction = (target - before) / counts[b] if counts[b] > 0 else 0.0
+        return float(TIMINGBINEDGES[b] + fraction * (TIMINGBINEDGES[b + 1] - TIMINGBINEDGES[b]))
+
+
+class DayAggregate:
+    """Aggregates of the sessions starting on a set of days (one day, or a merged window)"""
+
+    def __init__(self, days: list, numSessions: int, urlCounts: dict, transitions: transition_matrix.TransitionMatrix,
+                 funnelCounts: dict, funnelTiming: dict):
+        """
+        :param days: days covered ("YYYY-MM-DD" strings)
+        :param numSessions: number of sessions
+        :param urlCounts: URL to number of sessions visiting it
+        :param transitions: URL transition counts
+        :param funnelCounts: funnel name to (funnel, list of session counts per step)
+        :param funnelTiming: funnel name to TimingHistogram
+        """
+        self.days = days
+        self.numSessions = numSessions
+        self.urlCounts = urlCounts
+        self.transitions = transitions
+        self.funnelCounts = funnelCounts
+        self.funnelTiming = funnelTiming
+
+    def get_popular(self) -> dict:
+        """URL session counts, as returned by `get_popular_urls.get_popular`"""
+        return dict(self.urlCounts)
+
+    def get_funnel_stats(self, name: str) -> list:
+        """Conversion statistics of a registered funnel, as returned by `funnel_stats.get_funnel_stats`"""
+        funnel, counts = self.funnelCounts[name]
+        return list(zip(funnel, counts))
+
+    def get_funnel_timing(self, name: str) -> TimingHistogram:
+        return self.funnelTiming[name]
+
+    def get_transition_matrix(self) -> transition_matrix.TransitionMatrix:
+        return self.transitions
+
+
+@profiling.profiled
+def build_day_aggregate(day: str, events: pd.DataFrame, funnels: dict, columnToUse: str) -> DayAggregate:
+    """Aggregates of the sessions of one day
+
+    :param day: day of the sessions ("YYYY-MM-DD")
+    :param events: navigate-only preprocessed events of the sessions starting on `day`
+    :param funnels: funnel name to funnel (list of URLs)
+    :param columnToUse: URL column name
+    :return: DayAggregate
+    """
+    si = analyze_traffic.build_session_index(events, columnToUse)
+    urlCounts = dict(analyze_traffic.get_counts_for_url(si))
+    transitions = transition_matrix.build_transition_matrix(events, columnToUse, analyze_traffic.REFERAL)
+    funnelCounts = {}
+    funnelTiming = {}
+    for name, funnel in funnels.items():
+        counts = [count for _, count in analyze_traffic.get_funnel_conversion_stats(events, si, funnel, columnToUse)]
+        funnelCounts[name] = (list(funnel), counts)
+        funnelTiming[name] = TimingHistogram.from_times(
+            analyze_timing.get_funnel_timing(events, si, funnel, columnToUse))
+    numSessions = len(partitions.get_session_starts(events))
+    return DayAggregate([day], numSessions, urlCounts, transitions, funnelCounts, funnelTiming)
+
+
+def merge_aggregates(aggregates: list) -> DayAggregate:
+    """Merge the aggregates of disjoint sets of days (funnels missing from some days are left out)"""
+    if len(aggregates) == 0:
+        raise ValueError("No day aggregates to merge")
+    urlCounts = defaultdict(int)
+    for aggregate in aggregates:
+        for url, count in aggregate.urlCounts.items():
+            urlCounts[url] += count
+    funnelCounts = {}
+    funnelTiming = {}
+    names = set.intersection(*[set(aggregate.funnelCounts) for aggregate in aggregates])
+    for name in sorted(names):
+        funnel = aggregates[0].funnelCounts[name][0]
+        funnelCounts[name] = (funnel, np.sum([aggregate.funnelCounts[name][1] for aggregate in aggregates],
+                                              axis=0).tolist())
+        timing = aggregates[0].funnelTiming[name]
+        for aggregate in aggregates[1:]:
+            timing = timing.merge(aggregate.funnelTiming[name])
+        funnelTiming[name] = timing
+    return DayAggregate(sorted(day for aggregate in aggregates for day in aggregate.days),
+                        sum(aggregate.numSessions for aggregate in aggregates), dict(urlCounts),
+                        transition_matrix.merge_transition_matrices([aggregate.transitions for aggregate in aggregates]),
+                        funnelCounts, funnelTiming)
+
+
+class DayBuckets:
+    """Day aggregates of a dataset, updated as data is ingested and merged for window queries"""
+
+    def __init__(self, funnels: dict = None, useResolvedUrls: bool = False):
+        """
+        :param funnels: registered funnels (name to list of URLs), whose step counts and timing are aggregated
+        :param useResolvedUrls: aggregate resolved URLs (with the resolution rules in use when days are added)
+        instead of original URLs
+        """
+        self.funnels = dict(funnels or {})
+        self.useResolvedUrls = useResolvedUrls
+        self.rulesFingerprint = result_cache.get_rules_fingerprint() if useResolvedUrls else None
+        self.buckets = {}
+
+    @property
+    def days(self) -> list:
+        return sorted(self.buckets)
+
+    def update(self, events: pd.DataFrame) -> list:
+        """Compute the buckets of the days sessions in `events` start on, replacing existing buckets of those days
+
+        `events` should hold all the sessions starting on each of its days (e.g. the bundles of whole days), since
+        the buckets of these days are recomputed from them alone.
+
+        :param events: preprocessed events (non-navigate events are ignored)
+        :return: updated days
+        """
+        if self.useResolvedUrls and result_cache.get_rules_fingerprint() != self.rulesFingerprint:
+            raise ValueError("URL resolution rules changed since the buckets were built; rebuild them")
+        events = analyze_clicks.remove_non_navigation(events)
+        columnToUse = analyze_traffic.PAGEURL
+        if self.useResolvedUrls:
+            columnToUse = analyze_traffic.RESOLVEDURL
+            url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL,
+                                            columnToUse)
+        starts = partitions.get_session_starts(events)
+        days = partitions.get_session_days(events, starts)
+        for day, dayEvents in partitions.group_sessions(events, days, starts).items():
+            self.buckets[day] = build_day_aggregate(day, dayEvents, self.funnels, columnToUse)
+        return sorted(set(days))
+
+    def window(self, firstDay: str, lastDay: str) -> DayAggregate:
+        """Merged aggregates of the days from `firstDay` to `lastDay` ("YYYY-MM-DD" strings, inclusive)"""
+        aggregates = [self.buckets[day] for day in self.days if firstDay <= day <= lastDay]
+        if len(aggregates) == 0:
+            raise KeyError("No day buckets between " + firstDay + " and " + lastDay)
+        return merge_aggregates(aggregates)
+
+    def last(self, numDays: int, lastDay: str = None) -> DayAggregate:
+        """Merged aggregates of `numDays` calendar days, ending on `lastDay` (the latest bucket by default)"""
+        if lastDay is None:
+            lastDay = self.days[-1]
+        firstDay = (pd.Timestamp(lastDay) - pd.Timedelta(days=numDays - 1)).strftime("%Y-%m-%d")
+        return self.window(firstDay, lastDay)
+
+    def save(self, folder: str, days: list = None):
+        """Store the buckets in a folder, one file per day
+
+        :param folder: folder to store the buckets in (created if needed)
+        :param days: days to write (e.g. those returned by `update`), or None for all days
+        """
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, METAFILE), "wb") as fwrite:
+            pickle.dump((self.funnels, self.useResolvedUrls, self.rulesFingerprint), fwrite)
+        for day in self.days if days is None else days:
+            with open(os.path.join(folder, day + BUCKETEXTENSION), "wb") as fwrite:
+                pickle.dump(self.buckets[day], fwrite, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, folder: str, firstDay: str = None, lastDay: str = None) -> "DayBuckets":
+        """Load buckets stored by `save`, optionally only the days from `firstDay` to `lastDay`"""
+        with open(os.path.join(folder, METAFILE), "rb") as fread:
+            funnels, useResolvedUrls, rulesFingerprint = pickle.load(fread)
+        buckets = cls(funnels, useResolvedUrls)
+        buckets.rulesFingerprint = rulesFingerprint
+        for name in sorted(os.listdir(folder)):
+            day, ext = os.path.splitext(name)
+            if ext != BUCKETEXTENSION or name == METAFILE:
+                continue
+            if (firstDay is None or day >= firstDay) and (lastDay is None or day <= lastDay):
+                with open(os.path.join(folder, name), "rb") as fread:
+                    buckets.buckets[day] = pickle.load(fread)
+        return buckets
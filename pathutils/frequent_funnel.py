@@ -10,7 +10,7 @@ import argparse
 from collections import defaultdict
 from pandas import DataFrame
 
-from pathutils import analyze_traffic, utils, url_regex_resolver, manage_resolutions
+from pathutils import analysis_context, analyze_traffic, profiling, progress, utils
 
 
 def get_top_funnels(funurl, funlen, useResolvedUrls, folder, limit_rows, numResults):
@@ -26,33 +26,28 @@ def get_top_funnels_df(funurl: str, funlen: int, useResolvedUrls: bool, events:
     :param funurl: URL that should be contained in the funnel
     :param funlen: funnel length
     :param useResolvedUrls: indicates whether original or resolved URLs should be used
-    :param events: events DataFrame
+    :param events: events DataFrame or AnalysisContext
     :param limit_rows: number of rows of events DataFrame to use (use all rows if 0)
     :return: dictionary of funnels and their frequencies
     """
-    if useResolvedUrls:
-        columnToUse = analyze_traffic.RESOLVEDURL
-    else:
-        columnToUse = analyze_traffic.PAGEURL
-    if limit_rows != 0:
-        events = events.head(limit_rows)
-    if useResolvedUrls:
-        url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL, analyze_traffic.RESOLVEDURL)
-    si = analyze_traffic.build_session_index(events, columnToUse)
+    events, si, columnToUse = analysis_context.prepare_events(events, useResolvedUrls, limit_rows)
     funnelCounts = get_funnel_lists(events, si, funurl, funlen, columnToUse)
     return funnelCounts
 
 
+@profiling.profiled
 def get_funnel_lists(events, sessIndex, funurl, funlen, columnToUse):
-    sessions = sessIndex[funurl]
+    sessions = sessIndex.get(funurl, set())
     filteredEvents = utils.filter_events(events, session=list(sessions))
     uniqSids = utils.get_sessions(filteredEvents)
     funnelCounts = defaultdict(int)
-    for idx, sid in enumerate(uniqSids):
-        sess_df = filteredEvents.loc[sid]
-        sess_funnels = get_funnels_for_session(sess_df[columnToUse].tolist(), funurl, funlen)
-        for fun in sess_funnels:
-            funnelCounts[fun] += 1
+    with progress.track("frequent_funnel.get_funnel_lists", len(uniqSids)) as tracker:
+        for idx, sid in enumerate(uniqSids):
+            sess_df = filteredEvents.loc[sid]
+            sess_funnels = get_funnels_for_session(sess_df[columnToUse].tolist(), funurl, funlen)
+            for fun in sess_funnels:
+                funnelCounts[fun] += 1
+            tracker.update()
     return funnelCounts
 
 
@@ -103,5 +98,7 @@ if __name__ == "__main__":
                         help="Use resolved page URLs")
     parser.add_argument("--limit_rows", type=int, default=0,
                         help="Limit the number of rows in the dataset")
+    profiling.add_profile_argument(parser)
     args = parser.parse_args()
-    get_top_funnels(args.url, args.funnelLength, args.useResolvedUrls, args.hauser_folder, args.limit_rows, args.numResults)
+    with profiling.profile_cli(args.profile):
+        get_top_funnels(args.url, args.funnelLength, args.useResolvedUrls, args.hauser_folder, args.limit_rows, args.numResults)
@@ -11,7 +11,7 @@ import json
 
 from pandas import DataFrame
 
-from pathutils import analyze_traffic, utils, url_regex_resolver, manage_resolutions
+from pathutils import analysis_context, analyze_traffic, profiling, utils
 
 def print_in_outs(folder, funnelFile, useResolvedUrls, limit_rows, doPlot):
     with open(funnelFile, "r") as fread:
@@ -29,21 +29,16 @@ def print_in_outs(folder, funnelFile, useResolvedUrls, limit_rows, doPlot):
 def get_in_outs(events: DataFrame, funnel: list, useResolvedUrls: bool, limit_rows: int = 0) -> (dict, dict):
     """Get information about inflows and outflows for a funnel
 
-    :param events: events DataFrame
+    :param events: events DataFrame or AnalysisContext
     :param funnel: funnel of interest
     :param useResolvedUrls: indicates whether original or resolved URLs should be used
     :param limit_rows: number of rows of events DataFrame to use (use all rows if 0)
     :return: a pair of dictionaries, with inflow and outflow URL frequency counts
     """
-    if useResolvedUrls:
-        columnToUse = analyze_traffic.RESOLVEDURL
-    else:
-        columnToUse = analyze_traffic.PAGEURL
-    if limit_rows != 0:
-        events = events.head(limit_rows)
-    if useResolvedUrls:
-        url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL, analyze_traffic.RESOLVEDURL)
-    si = analyze_traffic.build_session_index(events, columnToUse)
+    if isinstance(events, analysis_context.AnalysisContext) and len(funnel) == 1:
+        # single step inflows and outflows are a lookup in the transition matrix
+        return events.get_transition_matrix(useResolvedUrls, limit_rows).get_in_outs(funnel[0])
+    events, si, columnToUse = analysis_context.prepare_events(events, useResolvedUrls, limit_rows)
     ingressCounts, egressCounts = analyze_traffic.get_funnel_in_outs(events, si, funnel, columnToUse, analyze_traffic.REFERAL)
     return ingressCounts, egressCounts
 
@@ -54,5 +49,7 @@ if __name__ == "__main__":
     parser.add_argument("--useResolvedUrls", dest="useResolvedUrls", action="store_const", const=True, help="Use resolved page URLs")
     parser.add_argument("--limit_rows", type=int, default=0, help="Limit the number of rows in the dataset")
     parser.add_argument("--plotInOuts", dest="plotInOuts", action="store_const", const=True, help="Plot inflows and outflows (instead of printing the values)")
+    profiling.add_profile_argument(parser)
     args = parser.parse_args()
-    print_in_outs(args.hauser_folder, args.funnel, args.useResolvedUrls, args.limit_rows, args.plotInOuts)
\ No newline at end of file
+    with profiling.profile_cli(args.profile):
+        print_in_outs(args.hauser_folder, args.funnel, args.useResolvedUrls, args.limit_rows, args.plotInOuts)
\ No newline at end of file
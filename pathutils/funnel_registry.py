@@ -0,0 +1,196 @@
+"""funnel_registry.py
+
+Materialized views of registered funnels, updated incrementally as sessions are ingested. Each view holds the
+funnel's conversion counts, the ingress and egress counts of each of its prefixes (first step, first two steps...)
+and histograms of its step times, so that reading a funnel's statistics or Sankey diagram doesn't run an analysis:
+
+    registry = funnel_registry.FunnelRegistry()
+    registry.register_folder("funnels")          # {"funnel": [...]} files, as read by funnel_stats.py
+    registry.ingest(new_events)                   # after each batch of bundles
+    funnelCounts = registry.get("checkout").get_funnel_stats()
+    registry.get("checkout").plot_sankey("Checkout")
+
+Counts are sums over sessions, so each batch only costs an analysis of its own sessions. Sessions that may still be
+running (their last event is within `pendingGap` of the latest event ingested) are held back until a later batch
+completes them, or until `flush`; a session is only counted once all its events are in. Funnels registered after
+some ingestion only count the sessions ingested after them.
+
+"""
+import json
+import os
+import pickle
+
+from collections import defaultdict
+
+import pandas as pd
+
+from pathutils import analyze_clicks, analyze_timing, analyze_traffic, day_buckets, manage_resolutions, profiling, \
+    sankey_funnel, url_regex_resolver, utils
+
+FUNNELEXTENSION = ".json"
+
+
+class FunnelView:
+    """Statistics of one funnel over all the sessions ingested since it was registered"""
+
+    def __init__(self, name: str, funnel: list):
+        self.name = name
+        self.funnel = list(funnel)
+        self.numSessions = 0
+        self.counts = [0] * len(funnel)
+        self.ingresses = [defaultdict(int) for _ in funnel]
+        self.egresses = [defaultdict(int) for _ in funnel]
+        self.timing = day_buckets.TimingHistogram.from_times([[] for _ in funnel])
+
+    def get_funnel_stats(self) -> list:
+        """Conversion statistics, as returned by `funnel_stats.get_funnel_stats`"""
+        return list(zip(self.funnel, self.counts))
+
+    def get_in_outs(self) -> (dict, dict):
+        """Ingress and egress counts, as returned by `funnel_in_outs.get_in_outs`"""
+        return dict(self.ingresses[-1]), dict(self.egresses[-1])
+
+    def get_timing(self) -> day_buckets.TimingHistogram:
+        """Histograms of the step times (see `analyze_timing.get_timing_for_funnel`)"""
+        return self.timing
+
+    def get_sankey_lists(self, title: str, cutoff: int = 10):
+        """Sankey nodes and links, as returned by `sankey_funnel.get_funnel_lists`"""
+        return sankey_funnel.get_funnel_lists_from_stats(title, self.funnel, self.get_funnel_stats(),
+                                                         self.ingresses[0], self.egresses, cutoff)
+
+    def plot_sankey(self, title: str, cutoff: int = 10):
+        sankey_funnel.plot_funnel_lists(*self.get_sankey_lists(title, cutoff))
+
+    def update(self, events: pd.DataFrame, sessionIndex: dict, colName: str):
+        """Add the statistics of new sessions
+
+        :param events: navigate-only events of the new sessions
+        :param sessionIndex: inverted index of URLs to SIDs of `events`
+        :param colName: URL column name
+        """
+        for i, (_, count) in enumerate(analyze_traffic.get_funnel_conversion_stats(events, sessionIndex,
+                                                                                    self.funnel, colName)):
+            self.counts[i] += count
+        for j in range(1, len(self.funnel) + 1):
+            ingress, egress = analyze_traffic.get_funnel_in_outs(events, sessionIndex, self.funnel[:j], colName,
+                                                                 analyze_traffic.REFERAL)
+            for url, count in ingress.items():
+                self.ingresses[j - 1][url] += count
+            for url, count in egress.items():
+                self.egresses[j - 1][url] += count
+        self.timing = self.timing.merge(day_buckets.TimingHistogram.from_times(
+            analyze_timing.get_funnel_timing(events, sessionIndex, self.funnel, colName)))
+
+
+def read_funnel_file(path: str) -> list:
+    """Funnel of a {"funnel": [...]} JSON file"""
+    with open(path, "r") as fread:
+        return json.load(fread)["funnel"]
+
+
+class FunnelRegistry:
+    """Registered funnels and their views, updated by `ingest`"""
+
+    def __init__(self, useResolvedUrls: bool = False, pendingGap: pd.Timedelta = utils.DEFAULTINACTIVITYGAP):
+        """
+        :param useResolvedUrls: match funnels on resolved URLs (with the rules in use at ingestion) instead of
+        original URLs
+        :param pendingGap: sessions with events within this time of the latest ingested event are held back, as
+        they may continue in the next batch
+        """
+        self.useResolvedUrls = useResolvedUrls
+        self.pendingGap = pendingGap
+        self.views = {}
+        self.numSessions = 0
+        self._pending = None
+
+    def register(self, name: str, funnel: list) -> FunnelView:
+        """Register a funnel (replacing the view of a funnel registered with the same name and a different funnel)"""
+        view = self.views.get(name)
+        if view is None or view.funnel != list(funnel):
+            view = self.views[name] = FunnelView(name, funnel)
+        return view
+
+    def register_file(self, path: str, name: str = None) -> FunnelView:
+        """Register the funnel of a {"funnel": [...]} JSON file, named after the file by default"""
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        return self.register(name, read_funnel_file(path))
+
+    def register_folder(self, folder: str) -> list:
+        """Register the funnels of all the JSON files in a folder
+
+        :return: names of the funnels
+        """
+        names = []
+        for fileName in sorted(os.listdir(folder)):
+            if fileName.endswith(FUNNELEXTENSION):
+                names.append(self.register_file(os.path.join(folder, fileName)).name)
+        return names
+
+    def unregister(self, name: str):
+        del self.views[name]
+
+    def get(self, name: str) -> FunnelView:
+        return self.views[name]
+
+    @property
+    def numPending(self) -> int:
+        """Number of sessions held back until they are complete"""
+        return 0 if self._pending is None else self._pending["distinct_session_id"].nunique()
+
+    @profiling.profiled
+    def ingest(self, events: pd.DataFrame) -> int:
+        """Update the views with the complete sessions of newly ingested events
+
+        :param events: new events, processed by `utils.preproc_events` (non-navigate events are ignored). Events of
+        sessions held back from previous batches are added to them.
+        :return: number of sessions added to the views
+        """
+        events = analyze_clicks.remove_non_navigation(events)
+        if self._pending is not None:
+            events = pd.concat([self._pending, events]).sort_values(["sid", "EventStart"], kind="mergesort")
+        if len(events) == 0:
+            return 0
+        lastEvents = events.groupby(level=0, sort=False)["EventStart"].max()
+        pending = lastEvents.index[lastEvents >= lastEvents.max() - self.pendingGap]
+        isPending = events.index.get_level_values(0).isin(pending)
+        self._pending = events.loc[isPending] if isPending.any() else None
+        return self._add_sessions(events.loc[~isPending])
+
+    def flush(self) -> int:
+        """Add the sessions held back to the views (e.g. at the end of the data)
+
+        :return: number of sessions added to the views
+        """
+        if self._pending is None:
+            return 0
+        events, self._pending = self._pending, None
+        return self._add_sessions(events)
+
+    def _add_sessions(self, events: pd.DataFrame) -> int:
+        if len(events) == 0:
+            return 0
+        colName = analyze_traffic.PAGEURL
+        if self.useResolvedUrls:
+            colName = analyze_traffic.RESOLVEDURL
+            url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL,
+                                            colName)
+        si = analyze_traffic.build_session_index(events, colName)
+        numSessions = events["distinct_session_id"].nunique()
+        for view in self.views.values():
+            view.update(events, si, colName)
+            view.numSessions += numSessions
+        self.numSessions += numSessions
+        return numSessions
+
+    def save(self, path: str):
+        """Store the registry (views and sessions held back) in a pickle file"""
+        with open(path, "wb") as fwrite:
+            pickle.dump(self, fwrite, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> "FunnelRegistry":
+        with open(path, "rb") as fread:
+            return pickle.load(fread)
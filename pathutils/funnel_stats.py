@@ -11,7 +11,7 @@ import json
 
 from pandas import DataFrame
 
-from pathutils import analyze_traffic, utils, url_regex_resolver, manage_resolutions
+from pathutils import analysis_context, analyze_traffic, profiling, utils
 
 def print_in_outs(folder, funnelFile, useResolvedUrls, limit_rows):
     with open(funnelFile, "r") as fread:
@@ -26,21 +26,13 @@ def print_in_outs(folder, funnelFile, useResolvedUrls, limit_rows):
 def get_funnel_stats(events: DataFrame, funnel: list, useResolvedUrls: bool, limit_rows: int = 0) -> list:
     """Get conversion statistics for a funnel
 
-    :param events: events DataFrame
+    :param events: events DataFrame or AnalysisContext
     :param funnel: funnel of interest
     :param useResolvedUrls: indicates whether original or resolved URLs should be used
     :param limit_rows: number of rows of events DataFrame to use (use all rows if 0)
     :return: sorted list of funnel conversions by step
     """
-    if useResolvedUrls:
-        columnToUse = analyze_traffic.RESOLVEDURL
-    else:
-        columnToUse = analyze_traffic.PAGEURL
-    if limit_rows != 0:
-        events = events.head(limit_rows)
-    if useResolvedUrls:
-        url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL, analyze_traffic.RESOLVEDURL)
-    si = analyze_traffic.build_session_index(events, columnToUse)
+    events, si, columnToUse = analysis_context.prepare_events(events, useResolvedUrls, limit_rows)
     funnelCounts = analyze_traffic.get_funnel_conversion_stats(events, si, funnel, columnToUse)
     funnelCounts = list(funnelCounts)
     return funnelCounts
@@ -59,5 +51,7 @@ if __name__ == "__main__":
     parser.add_argument("funnel", type=str, help="Path to json file containing the funnel")
     parser.add_argument("--useResolvedUrls", dest="useResolvedUrls", action="store_const", const=True, help="Use resolved page URLs")
     parser.add_argument("--limit_rows", type=int, default=0, help="Limit the number of rows in the dataset")
+    profiling.add_profile_argument(parser)
     args = parser.parse_args()
-    print_in_outs(args.hauser_folder, args.funnel, args.useResolvedUrls, args.limit_rows)
\ No newline at end of file
+    with profiling.profile_cli(args.profile):
+        print_in_outs(args.hauser_folder, args.funnel, args.useResolvedUrls, args.limit_rows)
\ No newline at end of file
@@ -9,7 +9,7 @@ Find and display most frequently visited URLs
 import argparse
 import pandas as pd
 
-from pathutils import analyze_traffic, utils, url_regex_resolver, manage_resolutions
+from pathutils import analysis_context, analyze_traffic, profiling, utils
 
 def print_popular(folder, useResolvedUrls, limit_rows, topCounts):
     df = analyze_traffic.get_hauser_as_df(folder)
@@ -21,20 +21,12 @@ def print_popular(folder, useResolvedUrls, limit_rows, topCounts):
 def get_popular(events: pd.DataFrame, useResolvedUrls: bool, limit_rows: int = 0) -> dict:
     """Returns a dictionary of visited URLs and visit counts for each URL
 
-    :param events: events DataFrame
+    :param events: events DataFrame or AnalysisContext
     :param useResolvedUrls: boolean indicating whether original or resolved URLs should be used
     :param limit_rows: number of rows from the original DataFrame to use (if 0, then use entire DataFrame)
     :return:
     """
-    if useResolvedUrls:
-        columnToUse = analyze_traffic.RESOLVEDURL
-    else:
-        columnToUse = analyze_traffic.PAGEURL
-    if limit_rows != 0:
-        events = events.head(limit_rows)
-    if useResolvedUrls:
-        url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL, analyze_traffic.RESOLVEDURL)
-    si = analyze_traffic.build_session_index(events, columnToUse)
+    events, si, columnToUse = analysis_context.prepare_events(events, useResolvedUrls, limit_rows)
     urlCounts = analyze_traffic.get_counts_for_url(si)
     return urlCounts
 
@@ -54,5 +46,7 @@ if __name__ == "__main__":
     parser.add_argument("--useResolvedUrls", dest="useResolvedUrls", action="store_const", const=True, help="Use resolved page URLs")
     parser.add_argument("--limit_rows", type=int, default=0, help="Limit the number of rows in the dataset")
     parser.add_argument("--limitTopCounts", type=int, default=0, help="Limit the number of top URLs printed")
+    profiling.add_profile_argument(parser)
     args = parser.parse_args()
-    print_popular(args.hauser_folder, args.useResolvedUrls, args.limit_rows, args.limitTopCounts)
\ No newline at end of file
+    with profiling.profile_cli(args.profile):
+        print_popular(args.hauser_folder, args.useResolvedUrls, args.limit_rows, args.limitTopCounts)
\ No newline at end of file
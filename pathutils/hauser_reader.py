@@ -0,0 +1,97 @@
+"""hauser_reader.py
+
+Readers for Hauser export bundles: JSON arrays (`.json`), newline-delimited JSON (`.ndjson`, `.jsonl`) and CSV
+(`.csv`), each optionally compressed with gzip (`.gz`), bzip2 (`.bz2`) or zstandard (`.zst`, requires the
+`zstandard` package). Compressed files are decompressed as they are parsed, and NDJSON and CSV bundles are parsed in
+chunks of rows, so a bundle never needs to be decompressed to disk or held in memory as a whole.
+
+"""
+import os
+
+import pandas as pd
+
+from pathutils import sampling, schema
+
+JSON = "json"
+NDJSON = "ndjson"
+CSV = "csv"
+FORMATEXTENSIONS = {".json": JSON, ".ndjson": NDJSON, ".jsonl": NDJSON, ".csv": CSV}
+COMPRESSIONEXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+DEFAULTCHUNKSIZE = 200000
+
+# column types for CSV bundles, which carry no type information. Identifiers are too large for float64, and are read
+# as nullable integers so that a row with a missing identifier doesn't fail the load; numbers with missing values
+# can't be ints, so they are given explicitly
+CSVDTYPES = dict(
+    {col: "Int64" for col in schema.IDCOLUMNS},
+    **{col: "object" for col in schema.CATEGORYCOLUMNS + schema.PIICOLUMNS},
+    EventModDead="float64", EventModFrustrated="float64", EventModError="float64",
+)
+
+
+def get_bundle_format(path: str) -> (str, str):
+    """Format and compression of a bundle, from its file name
+
+    :param path: bundle path (e.g. "1565913600.ndjson.gz")
+    :return: (format, compression) where compression is None for uncompressed files, or (None, None) if the file
+    isn't a bundle
+    """
+    base, ext = os.path.splitext(path.lower())
+    compression = COMPRESSIONEXTENSIONS.get(ext)
+    if compression is not None:
+        base, ext = os.path.splitext(base)
+    return FORMATEXTENSIONS.get(ext), compression if ext in FORMATEXTENSIONS else None
+
+
+def is_bundle(path: str) -> bool:
+    return get_bundle_format(path)[0] is not None
+
+
+def read_bundle(path, chunksize: int = DEFAULTCHUNKSIZE, name: str = None):
+    """Read a bundle as a sequence of DataFrames
+
+    JSON arrays are read in one piece (the format can't be split without parsing it); NDJSON and CSV bundles are read
+    `chunksize` rows at a time.
+
+    :param path: bundle path, or binary file-like object (e.g. io.BytesIO with downloaded bytes)
+    :param chunksize: number of rows per chunk for NDJSON and CSV bundles
+    :param name: bundle file name, used to find the format when `path` is a file-like object
+    :return: iterator of DataFrames
+    """
+    fmt, compression = get_bundle_format(name or path)
+    if fmt == JSON:
+        yield pd.read_json(path, orient="records", compression=compression)
+    elif fmt == NDJSON:
+        with pd.read_json(path, orient="records", lines=True, chunksize=chunksize, compression=compression) as reader:
+            for chunk in reader:
+                yield chunk
+    elif fmt == CSV:
+        with pd.read_csv(path, dtype=CSVDTYPES, chunksize=chunksize, compression=compression) as reader:
+            for chunk in reader:
+                yield chunk
+    else:
+        raise IOError("Unsupported file type: " + str(name or path))
+
+
+def prepare_chunk(chunk: pd.DataFrame, navigate_only: bool = True, no_robots: bool = True,
+                  sample_fraction: float = 1.0, sample_seed: int = 0, drop_pii: bool = False) -> pd.DataFrame:
+    """Sample and filter a chunk of raw events, as read by `read_bundle` (see `analyze_traffic.get_hauser_as_df` for
+    the parameters)"""
+    chunk = sampling.sample_sessions(chunk, sample_fraction, sample_seed)
+    if navigate_only:
+        chunk = chunk.loc[chunk["EventType"] == "navigate"]
+    if no_robots:
+        chunk = chunk.loc[chunk["PageDevice"] != "Robot"]
+    if drop_pii:
+        chunk = chunk.drop(columns=[col for col in schema.PIICOLUMNS if col in chunk.columns])
+    return chunk
+
+
+def concat_chunks(chunks: list, compact: bool = True) -> pd.DataFrame:
+    """Concatenate prepared chunks into one events DataFrame, converted to compact types if `compact`"""
+    df = pd.concat(chunks, sort=False)
+    if compact:
+        before = schema.memory_usage(df)
+        df = schema.apply_schema(df)
+        print(schema.format_memory_report(before, schema.memory_usage(df)))
+    return df
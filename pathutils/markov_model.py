@@ -0,0 +1,219 @@
+"""markov_model.py
+
+Markov chain model of user paths, estimated from the same transition counts that `transition_matrix` and
+`analyze_traffic.get_funnel_in_outs` aggregate. A model of order k predicts the next URL from the last k URLs of a
+session (sessions are padded with START at the beginning, and end in the absorbing EXIT state).
+
+The model scores arbitrary paths and funnels without rescanning the events:
+
+    model = markov_model.build_markov_model(df, analyze_traffic.PAGEURL, order=1)
+    model.expected_funnel_conversion(test_funnel)
+    model.rank_leaky_steps(test_funnel)
+    model.goal_probability("https://www.example.com/cart", "https://www.example.com/confirmation")
+
+"""
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+
+from pathutils import analyze_traffic, profiling, utils
+from pathutils.transition_matrix import START, EXIT, normalize_rows
+
+
+class MarkovModel:
+    """Markov chain over URL histories of fixed length (the model order)"""
+
+    def __init__(self, order: int, labels: np.ndarray, states: np.ndarray, symbolCounts: sparse.csr_matrix,
+                 stateCounts: sparse.csr_matrix):
+        """
+        :param order: number of previous URLs the next URL depends on
+        :param labels: node labels (URLs, UNKNOWN for missing URLs, START and EXIT)
+        :param states: array of shape (number of states, order) with the node codes of each state's URL history
+        :param symbolCounts: sparse (states x nodes) counts of the next node observed after each state
+        :param stateCounts: sparse (states x states) transition counts between states
+        """
+        self.order = order
+        self.labels = labels
+        self.states = states
+        self.symbolCounts = symbolCounts
+        self.stateCounts = stateCounts
+        self._labelIndex = {label: i for i, label in enumerate(labels)}
+        self._exitNode = self._labelIndex[EXIT]
+
+    def _encode(self, urls: list) -> np.ndarray:
+        """Node codes for a list of URLs (-1 for URLs the model hasn't seen)"""
+        return np.array([self._labelIndex.get(url, -1) for url in urls], dtype=np.int64)
+
+    def _states_ending_with(self, context: np.ndarray) -> np.ndarray:
+        """Boolean mask of states whose history ends with `context` (at most `order` node codes)"""
+        if len(context) == 0:
+            return np.ones(len(self.states), dtype=bool)
+        return (self.states[:, self.order - len(context):] == context).all(axis=1)
+
+    def next_distribution(self, context: list) -> dict:
+        """Probabilities of the next URL (or EXIT) after a sequence of URLs
+
+        Only the last `order` URLs of the context are used. Shorter contexts are matched against the end of every state
+        (which amounts to a lower order estimate).
+
+        :param context: list of URLs visited so far
+        :return: dictionary of next URLs and their probabilities
+        """
+        counts = self._next_counts(self._encode(context[-self.order:]))
+        total = counts.sum()
+        if total == 0:
+            return {}
+        nonzero = np.flatnonzero(counts)
+        return dict(zip(self.labels[nonzero], (counts[nonzero] / total).tolist()))
+
+    def _next_counts(self, context: np.ndarray) -> np.ndarray:
+        if (context < 0).any():
+            return np.zeros(len(self.labels))
+        mask = self._states_ending_with(context)
+        return np.asarray(self.symbolCounts[mask].sum(axis=0)).ravel()
+
+    def transition_probability(self, context: list, url: str) -> float:
+        """Probability of navigating to `url` right after the sequence of URLs in `context`"""
+        counts = self._next_counts(self._encode(context[-self.order:]))
+        total = counts.sum()
+        node = self._labelIndex.get(url, -1)
+        if total == 0 or node < 0:
+            return 0.0
+        return counts[node] / total
+
+    def path_probability(self, path: list) -> float:
+        """Probability that a session at the first URL of `path` follows the rest of it in strict succession"""
+        prob = 1.0
+        for i in range(1, len(path)):
+            prob *= self.transition_probability(path[max(0, i - self.order):i], path[i])
+            if prob == 0.0:
+                break
+        return prob
+
+    def expected_funnel_conversion(self, funnel: list) -> list:
+        """Expected conversion rate for each step of a funnel, relative to the first step
+
+        :param funnel: funnel list
+        :return: list of (URL, probability of having followed the funnel up to this URL)
+        """
+        conversion = []
+        prob = 1.0
+        for i, url in enumerate(funnel):
+            if i > 0:
+                prob *= self.transition_probability(funnel[max(0, i - self.order):i], url)
+            conversion.append((url, prob))
+        return conversion
+
+    def rank_leaky_steps(self, funnel: list) -> list:
+        """Funnel steps ranked by the probability of not continuing to the next step
+
+        :param funnel: funnel list
+        :return: list of (URL, next URL, drop-off probability, exit probability), leakiest step first
+        """
+        steps = []
+        for i in range(len(funnel) - 1):
+            context = funnel[max(0, i + 1 - self.order):i + 1]
+            distribution = self.next_distribution(context)
+            continuation = distribution.get(funnel[i + 1], 0.0)
+            steps.append((funnel[i], funnel[i + 1], 1.0 - continuation, distribution.get(EXIT, 0.0)))
+        return sorted(steps, key=lambda x: x[2], reverse=True)
+
+    def absorption_probabilities(self, goal: str = None) -> np.ndarray:
+        """Probability, from each state, of reaching `goal` before the session ends
+
+        Solves the absorbing chain equations (I - Q) x = r with sparse linear algebra, where Q holds the transition
+        probabilities between transient states and r the probabilities of moving into the goal.
+
+        :param goal: goal URL. If None, the probability of reaching EXIT is returned (1 for every state that leads
+        to a session end).
+        :return: array of probabilities, one per state
+        """
+        goalNode = self._exitNode if goal is None else self._labelIndex.get(goal, -1)
+        if goalNode < 0:
+            return np.zeros(len(self.states))
+        lastNodes = self.states[:, -1]
+        absorbing = (lastNodes == goalNode) | (lastNodes == self._exitNode)
+        transient = np.flatnonzero(~absorbing)
+        probs = normalize_rows(self.stateCounts)
+        Q = probs[transient][:, transient]
+        r = np.asarray(probs[transient][:, np.flatnonzero(lastNodes == goalNode)].sum(axis=1)).ravel()
+        result = (lastNodes == goalNode).astype(float)
+        if len(transient) > 0:
+            from scipy.sparse import linalg
+            A = (sparse.identity(len(transient), format="csc") - Q).tocsc()
+            result[transient] = np.atleast_1d(linalg.spsolve(A, r))
+        return result
+
+    def goal_probability(self, url: str, goal: str = None) -> float:
+        """Probability that a session currently at `url` reaches `goal` (or EXIT if None) before it ends
+
+        For models of order > 1, the probabilities of all states ending at `url` are averaged, weighted by how often
+        each state occurs.
+
+        :param url: current URL
+        :param goal: goal URL
+        :return: probability
+        """
+        node = self._labelIndex.get(url, -1)
+        if node < 0:
+            return 0.0
+        mask = self.states[:, -1] == node
+        weights = np.asarray(self.symbolCounts[mask].sum(axis=1)).ravel()
+        if weights.sum() == 0:
+            return 0.0
+        return float(np.dot(weights, self.absorption_probabilities(goal)[mask]) / weights.sum())
+
+
+def build_markov_model(events: pd.DataFrame, colName: str, order: int = 1) -> MarkovModel:
+    """Estimate a Markov model of the specified order from a navigate-only events DataFrame
+
+    :param events: navigate-only events DataFrame
+    :param colName: column name to use for URLs
+    :param order: number of previous URLs the next URL depends on
+    :return: Markov model
+    """
+    return build_markov_model_from_paths(utils.encode_paths(events, colName), order)
+
+
+@profiling.profiled
+def build_markov_model_from_paths(paths: utils.EncodedPaths, order: int = 1) -> MarkovModel:
+    """Estimate a Markov model of the specified order from encoded session paths (see `utils.encode_paths`)
+
+    :param paths: encoded session paths
+    :param order: number of previous URLs the next URL depends on
+    :return: Markov model
+    """
+    if order < 1:
+        raise ValueError("Model order should be at least 1")
+    numLabels = len(paths.labels)
+    missingNode, startNode, exitNode = numLabels, numLabels + 1, numLabels + 2
+    labels = np.array(list(paths.labels) + [analyze_traffic.UNKNOWN, START, EXIT], dtype=object)
+    nodes = np.where(paths.codes < 0, missingNode, paths.codes)
+
+    # pad every session with `order` START nodes and one EXIT node
+    numSessions = len(paths.sids)
+    lengths = np.diff(paths.offsets) + order + 1
+    augOffsets = np.r_[0, np.cumsum(lengths)]
+    augmented = np.full(augOffsets[-1], startNode, dtype=np.int64)
+    sessionOfNode = np.repeat(np.arange(numSessions), np.diff(paths.offsets))
+    augmented[np.arange(len(nodes)) + (order * (sessionOfNode + 1)) + sessionOfNode] = nodes
+    augmented[augOffsets[1:] - 1] = exitNode
+
+    # state at position q is the history augmented[q - order + 1 : q + 1]; positions before the first full history
+    # of a session are skipped
+    positionInSession = np.arange(len(augmented)) - np.repeat(augOffsets[:-1], lengths)
+    valid = np.flatnonzero(positionInSession >= order - 1)
+    windows = np.stack([augmented[valid - order + 1 + j] for j in range(order)], axis=1)
+    states, stateOfWindow = np.unique(windows, axis=0, return_inverse=True)
+    stateOfWindow = stateOfWindow.ravel()
+
+    # transitions between consecutive windows of a session
+    follows = positionInSession[valid] >= order
+    src = stateOfWindow[:-1][follows[1:]]
+    dst = stateOfWindow[1:][follows[1:]]
+    ones = np.ones(len(src), dtype=np.int64)
+    stateCounts = sparse.coo_matrix((ones, (src, dst)), shape=(len(states), len(states))).tocsr()
+    symbolCounts = sparse.coo_matrix((ones, (src, states[dst, -1])), shape=(len(states), len(labels))).tocsr()
+    return MarkovModel(order, labels, states, symbolCounts, stateCounts)
+
@@ -0,0 +1,272 @@
+"""partitions.py
+
+Events partitioned by organization (OrgId) and, optionally, by day, in memory and on disk. `filter_events(org=...)`
+scans the whole dataset for every query; with partitions, a per-org query only touches the org's own events (and
+only the org's files when loading from disk):
+
+    parts = partitions.partition_events(dffull, byDay=True)
+    partitions.save_partitions(parts, "partitioned")
+    parts = partitions.load_partitions("partitioned", orgs=["o1", "o2"], days=("2019-08-16", "2019-08-22"))
+    counts = get_popular_urls.get_popular(parts.get_context("o1"), useResolvedUrls)
+
+`map_orgs` runs an analysis on every org in parallel and combines the results into one DataFrame:
+
+    stats = partitions.map_orgs(parts, funnel_stats.get_funnel_stats, partitions.EVENTS, test_funnel, False)
+
+A session belongs to the partition of its first event: the org of that event, and the (UTC) day the session starts
+on, so that sessions crossing midnight are never split.
+
+"""
+import concurrent.futures
+import os
+import threading
+
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+from pathutils import analysis_context, path_query, profiling
+
+ORGID = "OrgId"
+# day of partitions that aren't split by day
+ALLDAYS = "all"
+PARTITIONEXTENSION = ".pkl"
+
+
+class _EventsPlaceholder:
+    def __repr__(self):
+        return "EVENTS"
+
+
+# marks the position of the events argument in the arguments given to `map_orgs`
+EVENTS = _EventsPlaceholder()
+
+
+def get_session_starts(events: pd.DataFrame) -> np.ndarray:
+    """Row positions of the first event of each session (sessions are contiguous in preprocessed events)"""
+    sidValues = np.asarray(events.index.get_level_values(0))
+    if len(sidValues) == 0:
+        return np.array([], dtype=int)
+    return np.flatnonzero(np.r_[True, sidValues[1:] != sidValues[:-1]])
+
+
+def get_session_days(events: pd.DataFrame, starts: np.ndarray = None) -> np.ndarray:
+    """UTC day ("YYYY-MM-DD") each session starts on, in session order
+
+    :param events: preprocessed events DataFrame
+    :param starts: row positions of the first event of each session (see `get_session_starts`)
+    :return: array of day strings, one per session
+    """
+    if starts is None:
+        starts = get_session_starts(events)
+    times = pd.DatetimeIndex(events["EventStart"].to_numpy()[starts])
+    if times.tz is not None:
+        times = times.tz_convert("UTC")
+    return np.asarray(times.strftime("%Y-%m-%d"), dtype=object)
+
+
+class PartitionedEvents:
+    """Preprocessed events split into (org, day) partitions"""
+
+    def __init__(self, partitions: dict, memory_budget: int = analysis_context.DEFAULTMEMORYBUDGET):
+        """
+        :param partitions: dictionary of (OrgId, day) to preprocessed events DataFrames (day is ALLDAYS for
+        partitions not split by day)
+        :param memory_budget: memory budget of each org's AnalysisContext
+        """
+        self.partitions = partitions
+        self.memory_budget = memory_budget
+        self._contexts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def orgs(self) -> list:
+        return sorted({org for org, _ in self.partitions})
+
+    @property
+    def days(self) -> list:
+        return sorted({day for _, day in self.partitions})
+
+    def get_events(self, org: str, days=None) -> pd.DataFrame:
+        """Events of one org, optionally restricted to a range of days
+
+        :param org: OrgId
+        :param days: (first day, last day) pair of "YYYY-MM-DD" strings (inclusive), or None for all days
+        :return: preprocessed events DataFrame (empty if the org has no events)
+        """
+        frames = [self.partitions[key] for key in sorted(self.partitions) if key[0] == org and _in_days(key[1], days)]
+        if len(frames) == 0:
+            return next(iter(self.partitions.values())).iloc[:0] if self.partitions else pd.DataFrame()
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames)
+
+    def get_context(self, org: str) -> analysis_context.AnalysisContext:
+        """AnalysisContext over all the events of one org (created once per org)"""
+        with self._lock:
+            ctx = self._contexts.get(org)
+            if ctx is None:
+                ctx = self._contexts[org] = analysis_context.AnalysisContext(self.get_events(org), self.memory_budget)
+            return ctx
+
+    def query(self, org: str) -> path_query.PathQuery:
+        """PathQuery over the events of one org"""
+        return path_query.PathQuery(self.get_context(org))
+
+
+def _in_days(day: str, days) -> bool:
+    return days is None or day == ALLDAYS or days[0] <= day <= days[1]
+
+
+@profiling.profiled
+def partition_events(events: pd.DataFrame, byDay: bool = False,
+                     memory_budget: int = analysis_context.DEFAULTMEMORYBUDGET) -> PartitionedEvents:
+    """Split preprocessed events by org (and by session start day if `byDay`)
+
+    :param events: events DataFrame processed by `utils.preproc_events`, with an OrgId column
+    :param byDay: also split each org by the UTC day sessions start on
+    :param memory_budget: memory budget of each org's AnalysisContext
+    :return: PartitionedEvents
+    """
+    if ORGID not in events.columns:
+        raise ValueError("Events have no " + ORGID + " column")
+    starts = get_session_starts(events)
+    sessionKeys = events[ORGID].to_numpy(dtype=object)[starts].astype(str)
+    if byDay:
+        sessionKeys = np.char.add(np.char.add(sessionKeys, "\n"), get_session_days(events, starts).astype(str))
+    partitions = {}
+    for key, partition in group_sessions(events, sessionKeys, starts).items():
+        org, day = key.split("\n") if byDay else (key, ALLDAYS)
+        partitions[(org, day)] = partition
+    return PartitionedEvents(partitions, memory_budget)
+
+
+def group_sessions(events: pd.DataFrame, sessionKeys: np.ndarray, starts: np.ndarray = None) -> dict:
+    """Split preprocessed events into groups of whole sessions
+
+    :param events: preprocessed events DataFrame
+    :param sessionKeys: group key of each session, in session order
+    :param starts: row positions of the first event of each session (see `get_session_starts`)
+    :return: dictionary of keys (sorted) to events DataFrames, keeping the order of the events
+    """
+    if starts is None:
+        starts = get_session_starts(events)
+    keys, codes = np.unique(sessionKeys, return_inverse=True)
+    rowCodes = np.repeat(codes, np.diff(np.r_[starts, len(events)]))
+    # one stable sort groups the rows of each key together, in their original order
+    rows = np.argsort(rowCodes, kind="stable")
+    bounds = np.searchsorted(rowCodes[rows], np.arange(len(keys) + 1))
+    return {key: events.iloc[rows[bounds[code]:bounds[code + 1]]] for code, key in enumerate(keys)}
+
+
+def save_partitions(parts: PartitionedEvents, folder: str) -> list:
+    """Store partitions as one pickle file per partition, in one folder per org (<folder>/<OrgId>/<day>.pkl)
+
+    :return: list of file paths
+    """
+    paths = []
+    for (org, day), events in sorted(parts.partitions.items()):
+        orgFolder = os.path.join(folder, quote(org, safe=""))
+        os.makedirs(orgFolder, exist_ok=True)
+        path = os.path.join(orgFolder, day + PARTITIONEXTENSION)
+        events.to_pickle(path)
+        paths.append(path)
+    return paths
+
+
+def load_partitions(folder: str, orgs: list = None, days=None,
+                    memory_budget: int = analysis_context.DEFAULTMEMORYBUDGET) -> PartitionedEvents:
+    """Load partitions stored by `save_partitions`, reading only the files of the requested orgs and days
+
+    :param folder: folder the partitions were saved to
+    :param orgs: OrgIds to load (all if None)
+    :param days: (first day, last day) pair of "YYYY-MM-DD" strings (inclusive), or None for all days
+    :param memory_budget: memory budget of each org's AnalysisContext
+    :return: PartitionedEvents
+    """
+    partitions = {}
+    for orgFolder in sorted(os.listdir(folder)):
+        org = unquote(orgFolder)
+        if orgs is not None and org not in orgs:
+            continue
+        for name in sorted(os.listdir(os.path.join(folder, orgFolder))):
+            day, ext = os.path.splitext(name)
+            if ext == PARTITIONEXTENSION and _in_days(day, days):
+                with profiling.stage("partitions.load_partition"):
+                    partitions[(org, day)] = pd.read_pickle(os.path.join(folder, orgFolder, name))
+    return PartitionedEvents(partitions, memory_budget)
+
+
+def map_orgs(parts: PartitionedEvents, fn, *args, orgs: list = None, workers: int = None, processes: bool = False,
+             orgArg: str = None, **kwargs) -> pd.DataFrame:
+    """Run an analysis on every org in parallel and combine the results
+
+    :param parts: PartitionedEvents
+    :param fn: analysis function (e.g. `funnel_stats.get_funnel_stats`). The events argument is given as EVENTS in
+    `args` or `kwargs`, and receives each org's AnalysisContext; without EVENTS, it is passed as first argument.
+    :param args: arguments of `fn`
+    :param orgs: orgs to analyze (all if None)
+    :param workers: maximum number of orgs analyzed at the same time (default of the executor if None)
+    :param processes: run in worker processes instead of threads (for CPU bound analyses on many orgs; `fn` must be
+    a module level function, and each org's events are copied to its worker)
+    :param orgArg: name of a keyword argument of `fn` receiving the OrgId (e.g. "OrgId" for session links)
+    :param kwargs: keyword arguments of `fn`
+    :return: DataFrame of the results (see `result_to_frame`) with an OrgId column
+    """
+    if orgs is None:
+        orgs = parts.orgs
+    executorClass = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+    with executorClass(max_workers=workers) as executor:
+        futures = []
+        for org in orgs:
+            orgKwargs = dict(kwargs, **{orgArg: org}) if orgArg else kwargs
+            if processes:
+                futures.append(executor.submit(_run_on_events, fn, parts.get_events(org), args, orgKwargs,
+                                               parts.memory_budget))
+            else:
+                futures.append(executor.submit(_run, fn, parts.get_context(org), args, orgKwargs))
+        frames = []
+        for org, future in zip(orgs, futures):
+            frame = result_to_frame(future.result())
+            frame.insert(0, ORGID, org)
+            frames.append(frame)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=[ORGID])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _run(fn, ctx: analysis_context.AnalysisContext, args: tuple, kwargs: dict):
+    if any(arg is EVENTS for arg in args) or any(arg is EVENTS for arg in kwargs.values()):
+        args = [ctx if arg is EVENTS else arg for arg in args]
+        kwargs = {key: ctx if arg is EVENTS else arg for key, arg in kwargs.items()}
+        return fn(*args, **kwargs)
+    return fn(ctx, *args, **kwargs)
+
+
+def _run_on_events(fn, events: pd.DataFrame, args: tuple, kwargs: dict, memory_budget: int):
+    # EVENTS is a new object after pickling, so find it by type
+    args = tuple(EVENTS if isinstance(arg, _EventsPlaceholder) else arg for arg in args)
+    kwargs = {key: EVENTS if isinstance(arg, _EventsPlaceholder) else arg for key, arg in kwargs.items()}
+    return _run(fn, analysis_context.AnalysisContext(events, memory_budget), args, kwargs)
+
+
+def result_to_frame(result) -> pd.DataFrame:
+    """Tabulate an analysis result
+
+    Dictionaries of counts (`get_popular`, `get_top_funnels_df`) and lists of pairs (`get_funnel_stats`) become
+    "key" and "value" columns, pairs of dictionaries (`get_in_outs`) get an additional "part" column (0 for the first,
+    1 for the second), DataFrames are kept and other values go to a "value" column.
+    """
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    if isinstance(result, dict):
+        return pd.DataFrame({"key": list(result.keys()), "value": list(result.values())})
+    if isinstance(result, tuple) and len(result) > 0 and all(isinstance(part, dict) for part in result):
+        frames = [result_to_frame(part) for part in result]
+        for i, frame in enumerate(frames):
+            frame.insert(0, "part", i)
+        return pd.concat(frames, ignore_index=True)
+    if isinstance(result, list) and all(isinstance(item, tuple) and len(item) == 2 for item in result):
+        return pd.DataFrame({"key": [item[0] for item in result], "value": [item[1] for item in result]})
+    return pd.DataFrame({"value": [result]})
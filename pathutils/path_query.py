@@ -0,0 +1,201 @@
+"""path_query.py
+
+Lazy, chainable queries over events data. A query only records filters, URL mode and the analysis to run. The
+work (filtering, URL resolution, building the inverted index, funnel matching and aggregation) happens on `collect`.
+
+Queries derived from the same `PathQuery` share an `AnalysisContext` holding the intermediates (resolved URLs, filtered
+events and inverted indexes), so asking several questions of the same dataset only pays for the shared stages once:
+
+    q = PathQuery(dffull).resolved()
+    counts = q.popular().collect()
+    stats = q.funnel(test_funnel).collect()
+    ingress, egress = q.in_outs(test_funnel).collect()
+
+"""
+import copy
+
+import pandas as pd
+
+from pathutils import analysis_context, analyze_clicks, analyze_timing, analyze_traffic, frequent_funnel, \
+    manage_resolutions, sampling, url_regex_resolver, utils
+
+POPULAR = "popular"
+FUNNEL = "funnel"
+INOUTS = "in_outs"
+TIMING = "timing"
+TOPFUNNELS = "top_funnels"
+ANALYSES = [POPULAR, FUNNEL, INOUTS, TIMING, TOPFUNNELS]
+
+
+class PathQuery:
+    """Lazy query builder over an events DataFrame
+
+    All builder methods return a new query and leave the original unchanged, so a base query can be reused for
+    several analyses.
+    """
+
+    def __init__(self, events, session_meta: pd.DataFrame = None):
+        """
+        :param events: events DataFrame processed by `utils.preproc_events`, or an AnalysisContext wrapping one. It
+        may contain non-navigate events, which are needed for click type filtering.
+        :param session_meta: optional session metadata table for `events` (see `utils.build_session_meta`). By default,
+        the context builds it the first time a query filters by org or time.
+        """
+        if not isinstance(events, analysis_context.AnalysisContext):
+            events = analysis_context.AnalysisContext(events)
+        self._context = events
+        self._session_meta = session_meta
+        self._org = None
+        self._start_time = None
+        self._clicktype = None
+        self._device = None
+        self._max_gap = None
+        self._collapse = None
+        self._sample = None
+        self._useResolvedUrls = False
+        self._limit_rows = 0
+        self._analysis = None
+        self._args = ()
+
+    def _derive(self, **changes):
+        query = copy.copy(self)
+        for key in changes:
+            setattr(query, "_" + key, changes[key])
+        return query
+
+    # Filters
+
+    def org(self, org):
+        """Restrict the query to sessions from one or more OrgIds"""
+        return self._derive(org=org)
+
+    def time(self, t0, t1):
+        """Restrict the query to sessions starting between t0 and t1 (inclusive)"""
+        return self._derive(start_time=(t0, t1))
+
+    def clicktype(self, clicktype: str):
+        """Restrict the query to sessions containing a click of the specified type ("rage", "dead", or "error")"""
+        if clicktype not in analyze_clicks.CLICKTYPES:
+            raise ValueError("Unknown click type: " + clicktype)
+        return self._derive(clicktype=clicktype)
+
+    def device(self, device):
+        """Restrict the query to sessions from one or more device types (e.g. "Desktop", "Mobile")"""
+        return self._derive(device=device)
+
+    def split(self, maxGap=utils.DEFAULTINACTIVITYGAP):
+        """Split sessions after inactivity gaps longer than `maxGap` and analyze the parts as sessions (see
+        `utils.split_sessions`). Org and time filters still apply to the original sessions."""
+        return self._derive(max_gap=pd.Timedelta(maxGap))
+
+    def collapse(self, collapse: bool = True, dedupPageIds: bool = True):
+        """Collapse consecutive navigations to the same URL (original or resolved, see `utils.collapse_repeats`)"""
+        return self._derive(collapse=dedupPageIds if collapse else None)
+
+    def sample(self, fraction: float, seed: int = 0):
+        """Only use a deterministic sample of sessions (see `sampling.sample_sessions`). Results are computed on the
+        sample; scale them with `sampling.scale_counts` or `sampling.scale_funnel_stats`."""
+        return self._derive(sample=(fraction, seed))
+
+    def resolved(self, useResolvedUrls: bool = True):
+        """Use resolved (or original) page URLs"""
+        return self._derive(useResolvedUrls=useResolvedUrls)
+
+    def limit(self, limit_rows: int):
+        """Only use the first `limit_rows` navigate events (use all rows if 0)"""
+        return self._derive(limit_rows=limit_rows)
+
+    # Analyses
+
+    def popular(self):
+        """Visited URLs and the number of sessions visiting each URL (see `get_popular_urls.get_popular`)"""
+        return self._derive(analysis=POPULAR, args=())
+
+    def funnel(self, funnel: list):
+        """Conversion statistics for a funnel (see `funnel_stats.get_funnel_stats`)"""
+        return self._derive(analysis=FUNNEL, args=(list(funnel),))
+
+    def in_outs(self, funnel: list):
+        """Inflow and outflow counts for a funnel (see `funnel_in_outs.get_in_outs`)"""
+        return self._derive(analysis=INOUTS, args=(list(funnel),))
+
+    def timing(self, funnel: list):
+        """Funnel step times (see `analyze_timing.get_timing_for_funnel`)"""
+        return self._derive(analysis=TIMING, args=(list(funnel),))
+
+    def top_funnels(self, funurl: str, funlen: int):
+        """Funnels of specified length through a URL (see `frequent_funnel.get_top_funnels_df`)"""
+        return self._derive(analysis=TOPFUNNELS, args=(funurl, funlen))
+
+    # Execution
+
+    def collect(self):
+        """Execute the query
+
+        :return: the result of the selected analysis, in the same format as the corresponding module function
+        """
+        if self._analysis is None:
+            raise ValueError("No analysis selected for the query")
+        events, si, columnToUse = self._prepare()
+        if self._analysis == POPULAR:
+            return analyze_traffic.get_counts_for_url(si)
+        elif self._analysis == FUNNEL:
+            return list(analyze_traffic.get_funnel_conversion_stats(events, si, self._args[0], columnToUse))
+        elif self._analysis == INOUTS:
+            return analyze_traffic.get_funnel_in_outs(events, si, self._args[0], columnToUse, analyze_traffic.REFERAL)
+        elif self._analysis == TIMING:
+            return analyze_timing.get_funnel_timing(events, si, self._args[0], columnToUse)
+        else:
+            funurl, funlen = self._args
+            return frequent_funnel.get_funnel_lists(events, si, funurl, funlen, columnToUse)
+
+    def _prepare(self) -> (pd.DataFrame, dict, str):
+        """Run (or fetch from cache) the stages shared by all analyses
+
+        :return: filtered navigate-only events, inverted index, and the URL column used
+        """
+        collapseKey = None
+        if self._collapse is not None:
+            # collapsed paths depend on the URLs being compared
+            rulesKey = self._context._get_rules_key(self._useResolvedUrls)
+            collapseKey = (self._collapse, self._useResolvedUrls, rulesKey)
+        filterKey = (_freeze(self._org), _freeze(self._start_time), self._clicktype, _freeze(self._device),
+                     self._max_gap, collapseKey, self._sample)
+        if filterKey == (None, None, None, None, None, None, None):
+            context = self._context
+        else:
+            context = self._context.get_or_compute(
+                ("query", filterKey), lambda: analysis_context.AnalysisContext(self._get_filtered(),
+                                                                               self._context.memory_budget))
+        return context.prepare(self._useResolvedUrls, self._limit_rows)
+
+    def _get_filtered(self) -> pd.DataFrame:
+        session_meta = self._session_meta
+        if session_meta is None and (self._org is not None or self._start_time is not None):
+            session_meta = self._context.get_session_meta()
+        events = utils.filter_events(self._context.events, org=self._org, start_time=self._start_time,
+                                     session_meta=session_meta)
+        if self._sample is not None:
+            events = sampling.sample_sessions(events, *self._sample)
+        if self._max_gap is not None:
+            events = utils.split_sessions(events, self._max_gap)
+        if self._device is not None:
+            device = [self._device] if isinstance(self._device, str) else list(self._device)
+            events = events.loc[events["PageDevice"].isin(device)]
+        if self._clicktype is not None:
+            events = analyze_clicks.filter_dataset_by_clicktype(events, self._clicktype)
+        events = analyze_clicks.remove_non_navigation(events)
+        if self._collapse is not None:
+            columnToUse = self._context.get_column(self._useResolvedUrls)
+            if self._useResolvedUrls:
+                url_regex_resolver.resolve_urls(events, manage_resolutions.get_regex_dict(), analyze_traffic.PAGEURL,
+                                                columnToUse)
+            events = utils.collapse_repeats(events, columnToUse, self._collapse)
+        return events
+
+
+def _freeze(value):
+    """Turn list-valued query arguments into hashable cache keys"""
+    if value is None or isinstance(value, str):
+        return value
+    return tuple(str(v) for v in value)
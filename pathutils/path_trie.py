@@ -0,0 +1,192 @@
+"""path_trie.py
+
+Prefix tree (trie) over session paths, capped at a configurable depth. Every node stands for a sequence of
+consecutive URLs and stores how many times the sequence occurs, and in how many distinct sessions. Forward and
+backward path questions become tree walks instead of scans over all sessions:
+
+    forward = path_trie.build_path_trie(df, analyze_traffic.PAGEURL, maxDepth=4)
+    forward.top_continuations(["https://www.example.com/cart", "https://www.example.com/checkout"])
+
+    backward = path_trie.build_path_trie(df, analyze_traffic.PAGEURL, maxDepth=4, reverse=True)
+    backward.top_paths(["https://www.example.com/confirmation"], 3)
+
+A trie built with `reverse=True` indexes paths backwards, so its queries are about what happens *before* a path.
+Paths are always given and returned in navigation order. URLs are stored as integer codes, and tries can be saved to
+disk with `save_trie`.
+
+"""
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from pathutils import analyze_traffic, profiling, utils
+
+DEFAULTMAXDEPTH = 5
+
+
+class TrieNode:
+    __slots__ = ["occurrences", "sessions", "children"]
+
+    def __init__(self):
+        self.occurrences = 0
+        self.sessions = 0
+        self.children = {}
+
+    def __getstate__(self):
+        return self.occurrences, self.sessions, self.children
+
+    def __setstate__(self, state):
+        self.occurrences, self.sessions, self.children = state
+
+
+class PathTrie:
+    """Trie of session path segments up to `maxDepth` URLs long"""
+
+    def __init__(self, labels: np.ndarray, maxDepth: int, reverse: bool = False):
+        """
+        :param labels: URL labels, so that node keys are indexes into `labels`
+        :param maxDepth: maximum length of indexed path segments
+        :param reverse: if True, segments are indexed from their last URL backwards
+        """
+        self.labels = labels
+        self.maxDepth = maxDepth
+        self.reverse = reverse
+        self.root = TrieNode()
+        self.numNodes = 1
+        self._labelIndex = {label: i for i, label in enumerate(labels)}
+
+    def __getstate__(self):
+        return self.labels, self.maxDepth, self.reverse, self.root, self.numNodes
+
+    def __setstate__(self, state):
+        self.labels, self.maxDepth, self.reverse, self.root, self.numNodes = state
+        self._labelIndex = {label: i for i, label in enumerate(self.labels)}
+
+    def _walk(self, path: list) -> TrieNode:
+        """Node for a path (in navigation order), or None if the path doesn't occur"""
+        if len(path) > self.maxDepth:
+            raise ValueError("Path is longer than the trie depth (" + str(self.maxDepth) + ")")
+        if self.reverse:
+            path = path[::-1]
+        node = self.root
+        for url in path:
+            node = node.children.get(self._labelIndex.get(url, -1))
+            if node is None:
+                return None
+        return node
+
+    def get_counts(self, path: list) -> (int, int):
+        """Number of occurrences of a path (as consecutive navigations), and number of sessions containing it"""
+        node = self._walk(path)
+        if node is None:
+            return 0, 0
+        return node.occurrences, node.sessions
+
+    def top_continuations(self, path: list, numResults: int = 10) -> list:
+        """Most frequent URLs right after `path` (or right before it, for a reverse trie)
+
+        :param path: list of URLs
+        :param numResults: number of results to return (all if 0)
+        :return: list of (URL, occurrences, sessions), most frequent first
+        """
+        node = self._walk(path)
+        if node is None or len(path) >= self.maxDepth:
+            return []
+        results = [(self.labels[code], child.occurrences, child.sessions) for code, child in node.children.items()]
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results[:numResults] if numResults > 0 else results
+
+    def top_paths(self, path: list, length: int, numResults: int = 10) -> list:
+        """Most frequent paths of specified length starting with `path` (or ending with it, for a reverse trie)
+
+        :param path: list of URLs
+        :param length: total length of the returned paths
+        :param numResults: number of results to return (all if 0)
+        :return: list of (path tuple, occurrences, sessions), most frequent first
+        """
+        if length > self.maxDepth:
+            raise ValueError("Path length is larger than the trie depth (" + str(self.maxDepth) + ")")
+        node = self._walk(path)
+        if node is None or length < len(path):
+            return []
+        prefix = [self._labelIndex[url] for url in (path[::-1] if self.reverse else path)]
+        results = []
+        stack = [(node, prefix)]
+        while stack:
+            current, codes = stack.pop()
+            if len(codes) == length:
+                urls = tuple(self.labels[c] for c in (codes[::-1] if self.reverse else codes))
+                results.append((urls, current.occurrences, current.sessions))
+                continue
+            for code, child in current.children.items():
+                stack.append((child, codes + [code]))
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results[:numResults] if numResults > 0 else results
+
+
+def build_path_trie(events: pd.DataFrame, colName: str, maxDepth: int = DEFAULTMAXDEPTH,
+                    reverse: bool = False) -> PathTrie:
+    """Build a path trie for a navigate-only events DataFrame
+
+    :param events: navigate-only events DataFrame
+    :param colName: column name to use for URLs
+    :param maxDepth: maximum length of indexed path segments
+    :param reverse: if True, index path segments backwards (for questions about what leads to a path)
+    :return: path trie
+    """
+    return build_path_trie_from_paths(utils.encode_paths(events, colName), maxDepth, reverse)
+
+
+@profiling.profiled
+def build_path_trie_from_paths(paths: utils.EncodedPaths, maxDepth: int = DEFAULTMAXDEPTH,
+                               reverse: bool = False) -> PathTrie:
+    """Build a path trie from encoded session paths (see `utils.encode_paths`)
+
+    Segment counts are computed with numpy for each depth, so the trie only needs one insertion per distinct segment.
+
+    :param paths: encoded session paths
+    :param maxDepth: maximum length of indexed path segments
+    :param reverse: if True, index path segments backwards
+    :return: path trie
+    """
+    labels = np.array(list(paths.labels) + [analyze_traffic.UNKNOWN], dtype=object)
+    nodes = np.where(paths.codes < 0, len(paths.labels), paths.codes).astype(np.int64)
+    sessionLengths = np.diff(paths.offsets)
+    sessionOfRow = np.repeat(np.arange(len(sessionLengths)), sessionLengths)
+    positionInSession = np.arange(len(nodes)) - np.repeat(paths.offsets[:-1], sessionLengths)
+    remaining = np.repeat(sessionLengths, sessionLengths) - positionInSession
+    trie = PathTrie(labels, maxDepth, reverse)
+    for depth in range(1, maxDepth + 1):
+        starts = np.flatnonzero(remaining >= depth)
+        if len(starts) == 0:
+            break
+        segments = np.stack([nodes[starts + j] for j in range(depth)], axis=1)
+        if reverse:
+            segments = segments[:, ::-1]
+        uniqueSegments, occurrences = np.unique(segments, axis=0, return_counts=True)
+        sessionSegments = np.unique(np.column_stack([sessionOfRow[starts], segments]), axis=0)
+        _, sessions = np.unique(sessionSegments[:, 1:], axis=0, return_counts=True)
+        # both unique calls sort segments the same way, so counts line up
+        for segment, occ, sess in zip(uniqueSegments.tolist(), occurrences.tolist(), sessions.tolist()):
+            node = trie.root
+            for code in segment[:-1]:
+                node = node.children[code]
+            child = TrieNode()
+            child.occurrences = occ
+            child.sessions = sess
+            node.children[segment[-1]] = child
+        trie.numNodes += len(uniqueSegments)
+    return trie
+
+
+def save_trie(trie: PathTrie, path: str):
+    """Store a path trie on disk"""
+    with open(path, "wb") as fwrite:
+        pickle.dump(trie, fwrite, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_trie(path: str) -> PathTrie:
+    """Load a path trie stored with `save_trie`"""
+    with open(path, "rb") as fread:
+        return pickle.load(fread)
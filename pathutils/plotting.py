@@ -0,0 +1,44 @@
+"""plotting.py
+
+Plotting libraries, imported on first use. Analysis modules don't import matplotlib or plotly when they are loaded,
+so that scripts, servers and batch jobs that only compute results start quickly and run on machines without a
+display; plotting functions get the libraries from here when they are called:
+
+    plt = plotting.get_pyplot()
+    gobj = plotting.get_graph_objects()
+
+"""
+import os
+import sys
+
+BACKENDENV = "MPLBACKEND"
+INTERACTIVEBACKEND = "TkAgg"
+
+
+def _can_use_interactive_backend() -> bool:
+    # notebooks and explicit MPLBACKEND settings choose their own backend
+    if os.environ.get(BACKENDENV) or "ipykernel" in sys.modules:
+        return False
+    if sys.platform.startswith("linux"):
+        return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+    return True
+
+
+def get_pyplot():
+    """matplotlib.pyplot, selecting the TkAgg backend the first time if a display is available (and no backend
+    was chosen)"""
+    if "matplotlib.pyplot" not in sys.modules and _can_use_interactive_backend():
+        import matplotlib
+        try:
+            matplotlib.use(INTERACTIVEBACKEND)
+        except Exception:
+            print("Looks like your system doesn't support TkAgg backend. If you're running the script from the "
+                  "command line, there is a small chance plots won't display correctly.")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def get_graph_objects():
+    """plotly.graph_objects"""
+    import plotly.graph_objects as gobj
+    return gobj
@@ -0,0 +1,253 @@
+"""profiling.py
+
+Stage timing instrumentation. Loading, preprocessing, URL resolution, indexing and funnel matching functions are
+wrapped in named stages, which record wall time, rows processed and (optionally) peak memory when profiling is on:
+
+    with profiling.profile() as prof:
+        sankey_funnel.plot_funnel(title, dffull, test_funnel, useResolvedUrls)
+    prof.print_report()
+
+Setting the PATHUTILS_PROFILE environment variable (to "table" or "json") profiles the whole process and prints the
+report to stderr on exit. The command line scripts accept a `--profile` flag doing the same for one run. When
+profiling is off, a stage costs one global lookup.
+
+Stages can run in several threads at once (e.g. server requests or partitions processed in a thread pool): each
+thread has its own stack of stages. Peak memory is traced for the whole process, so it is only recorded for stages
+during which no other thread was running a stage.
+
+"""
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+PROFILEENVVAR = "PATHUTILS_PROFILE"
+TABLE = "table"
+JSON = "json"
+FORMATS = [TABLE, JSON]
+
+# active Profile, or None when profiling is off
+_current = None
+# process-wide profile enabled by the PATHUTILS_PROFILE environment variable
+_environmentProfile = None
+
+
+class Stage:
+    """One running stage. Set `rows` to record the number of rows processed, if the stage can't infer it."""
+    __slots__ = ["name", "rows", "start", "peak", "childPeak", "epoch"]
+
+    def __init__(self, name: str, rows: int = None):
+        self.name = name
+        self.rows = rows
+        self.start = 0.0
+        self.peak = 0
+        self.childPeak = 0
+        # overlap epoch the stage started in, or None if another thread was running a stage
+        self.epoch = None
+
+
+# shared by all stages while profiling is off
+_NULLSTAGE = Stage("")
+
+
+class Profile:
+    """Aggregated stage statistics (calls, total time, rows and peak memory per stage name)"""
+
+    def __init__(self, trackMemory: bool = True):
+        """
+        :param trackMemory: record the peak memory of each stage with tracemalloc (slows down allocations)
+        """
+        self.trackMemory = trackMemory
+        self.stats = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # number of threads running a stage, and number of times several threads did so at once
+        self._activeThreads = 0
+        self._epoch = 0
+
+    def _get_stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, stage: Stage):
+        stack = self._get_stack()
+        with self._lock:
+            if not stack:
+                self._activeThreads += 1
+                if self._activeThreads > 1:
+                    # the running stages of other threads can no longer tell their peak memory from this thread's
+                    self._epoch += 1
+            if self._activeThreads == 1 and self.trackMemory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                if stack:
+                    # the peak so far belongs to the enclosing stage, and is lost on reset
+                    stack[-1].childPeak = max(stack[-1].childPeak, peak)
+                tracemalloc.reset_peak()
+                stage.peak = current
+                stage.epoch = self._epoch
+        stack.append(stage)
+        stage.start = time.perf_counter()
+
+    def _exit(self, stage: Stage):
+        elapsed = time.perf_counter() - stage.start
+        stack = self._get_stack()
+        stack.pop()
+        with self._lock:
+            peakMemory = None
+            if stage.epoch == self._epoch and self.trackMemory and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], stage.childPeak)
+                peakMemory = peak - stage.peak
+                if stack:
+                    stack[-1].childPeak = max(stack[-1].childPeak, peak)
+            if not stack:
+                self._activeThreads -= 1
+            stats = self.stats.get(stage.name)
+            if stats is None:
+                stats = self.stats[stage.name] = {"calls": 0, "seconds": 0.0, "rows": 0, "peak_memory": None}
+            stats["calls"] += 1
+            stats["seconds"] += elapsed
+            if stage.rows is not None:
+                stats["rows"] += stage.rows
+            if peakMemory is not None:
+                stats["peak_memory"] = max(stats["peak_memory"] or 0, peakMemory)
+
+    def get_report(self) -> list:
+        """Stage statistics, slowest stage first
+
+        :return: list of dictionaries with stage name, number of calls, total seconds, rows and peak memory (bytes)
+        """
+        with self._lock:
+            report = [dict(stage=name, **stats) for name, stats in self.stats.items()]
+        return sorted(report, key=lambda x: x["seconds"], reverse=True)
+
+    def to_json(self) -> str:
+        return json.dumps(self.get_report(), indent=2)
+
+    def to_table(self) -> str:
+        lines = [f"{'stage':<56} {'calls':>7} {'seconds':>10} {'rows':>12} {'peak MB':>10}"]
+        for stats in self.get_report():
+            memory = "" if stats["peak_memory"] is None else f"{stats['peak_memory'] / 2 ** 20:.1f}"
+            lines.append(f"{stats['stage']:<56} {stats['calls']:>7} {stats['seconds']:>10.3f} {stats['rows']:>12} "
+                         f"{memory:>10}")
+        return "\n".join(lines)
+
+    def print_report(self, format: str = TABLE, file=None):
+        """Print the report as a table or as JSON (to stdout by default)"""
+        print(self.to_json() if format == JSON else self.to_table(), file=file)
+
+
+def is_enabled() -> bool:
+    return _current is not None
+
+
+@contextlib.contextmanager
+def stage(name: str, rows: int = None):
+    """Record a stage of work if profiling is on:
+
+        with profiling.stage("my_stage", len(df)) as st:
+            ...
+
+    :param name: stage name
+    :param rows: number of rows processed (can also be set later on the yielded Stage)
+    """
+    profile = _current
+    if profile is None:
+        yield _NULLSTAGE
+        return
+    current = Stage(name, rows)
+    profile._enter(current)
+    try:
+        yield current
+    finally:
+        profile._exit(current)
+
+
+def profiled(fn=None, name: str = None):
+    """Decorator recording every call of a function as a stage (named module.function by default). The rows
+    processed are the length of the first DataFrame argument, if any."""
+    if fn is None:
+        return functools.partial(profiled, name=name)
+    stageName = name or fn.__module__.split(".")[-1] + "." + fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _current
+        if profile is None:
+            return fn(*args, **kwargs)
+        current = Stage(stageName, _count_rows(args))
+        profile._enter(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile._exit(current)
+    return wrapper
+
+
+def _count_rows(args) -> int:
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, pd.Series)):
+            return len(arg)
+    return None
+
+
+@contextlib.contextmanager
+def profile(trackMemory: bool = True, output=None, format: str = TABLE):
+    """Turn profiling on within a block
+
+    :param trackMemory: record peak memory per stage with tracemalloc
+    :param output: optional stream (e.g. sys.stderr) the report is printed to at the end of the block
+    :param format: report format for `output` (TABLE or JSON)
+    :return: the Profile collecting the statistics
+    """
+    global _current
+    previous = _current
+    current = Profile(trackMemory)
+    startedTracing = trackMemory and not tracemalloc.is_tracing()
+    if startedTracing:
+        tracemalloc.start()
+    _current = current
+    try:
+        yield current
+    finally:
+        _current = previous
+        if startedTracing:
+            tracemalloc.stop()
+        if output is not None:
+            current.print_report(format, output)
+
+
+def add_profile_argument(parser):
+    """Add the `--profile [table|json]` option to a command line parser"""
+    parser.add_argument("--profile", nargs="?", const=TABLE, choices=FORMATS,
+                        help="Print the time, rows and peak memory of each stage to stderr")
+
+
+def profile_cli(format: str):
+    """Context manager for command line scripts: profile to stderr in `format`, or do nothing if `format` is None"""
+    if format is None:
+        return contextlib.nullcontext()
+    return profile(output=sys.stderr, format=format)
+
+
+def _enable_from_environment():
+    format = os.environ.get(PROFILEENVVAR, "").lower()
+    if format in ("", "0", "false"):
+        return
+    if format not in FORMATS:
+        format = TABLE
+    global _environmentProfile
+    # keep a reference to the context manager, which would otherwise end the profile when garbage collected
+    _environmentProfile = profile()
+    atexit.register(_environmentProfile.__enter__().print_report, format, sys.stderr)
+
+
+_enable_from_environment()
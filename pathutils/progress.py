@@ -0,0 +1,266 @@
+"""progress.py
+
+Progress reporting and cooperative cancellation for long-running analyses. Loading (files), indexing and funnel
+matching (sessions) report the units they have processed to the active progress callback, and check whether the
+operation was cancelled:
+
+    with progress.report(progress.TqdmProgress()):
+        funnelCounts = funnel_stats.get_funnel_stats(ctx, test_funnel, useResolvedUrls)
+
+A cancelled operation raises `OperationCancelled` at the next check, leaving the loaded data untouched. In Jupyter,
+the kernel doesn't process widget events while a cell is running, so use `start` to run the analysis in a background
+thread, with a progress bar and a cancel button:
+
+    job = progress.start(funnel_stats.get_funnel_stats, ctx, test_funnel, useResolvedUrls,
+                         callback=progress.WidgetProgress())
+    ...
+    funnelCounts = job.result()
+
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+# reporter for the current thread (or task), or None
+_reporter = contextvars.ContextVar("pathutils_progress", default=None)
+
+
+class OperationCancelled(Exception):
+    """Raised by instrumented loops once their operation has been cancelled"""
+    pass
+
+
+class CancellationToken:
+    """Flag shared between the code running an analysis and the code that may cancel it"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise OperationCancelled("Operation cancelled")
+
+
+class ProgressCallback:
+    """Progress callback protocol. Stages are named after the instrumented function (e.g.
+    "analyze_traffic.build_session_index"); `total` is None when the number of units isn't known upfront."""
+
+    def on_start(self, stage: str, total: int):
+        pass
+
+    def on_update(self, stage: str, done: int, total: int):
+        pass
+
+    def on_end(self, stage: str, done: int, total: int):
+        pass
+
+
+class TextProgress(ProgressCallback):
+    """Prints the progress of each stage, at most every `interval` seconds"""
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self._lastPrint = 0.0
+
+    def on_update(self, stage: str, done: int, total: int):
+        now = time.monotonic()
+        if now - self._lastPrint >= self.interval:
+            self._lastPrint = now
+            print(stage + ": " + _format_count(done, total))
+
+    def on_end(self, stage: str, done: int, total: int):
+        print(stage + ": " + _format_count(done, total) + " done")
+
+
+class TqdmProgress(ProgressCallback):
+    """tqdm progress bars (tqdm.auto, so that notebooks get widget bars), one per stage"""
+
+    def __init__(self, **tqdmArgs):
+        from tqdm.auto import tqdm
+        self._tqdm = tqdm
+        self._tqdmArgs = tqdmArgs
+        self._bars = {}
+
+    def on_start(self, stage: str, total: int):
+        self._bars[stage] = self._tqdm(total=total, desc=stage, **self._tqdmArgs)
+
+    def on_update(self, stage: str, done: int, total: int):
+        bar = self._bars[stage]
+        bar.update(done - bar.n)
+
+    def on_end(self, stage: str, done: int, total: int):
+        bar = self._bars.pop(stage)
+        bar.update(done - bar.n)
+        bar.close()
+
+
+class WidgetProgress(ProgressCallback):
+    """ipywidgets progress bar with a cancel button, for Jupyter notebooks
+
+    The cancel button only takes effect while the kernel can process widget events, i.e. when the analysis runs in a
+    background thread started with `start`.
+    """
+
+    def __init__(self, token: CancellationToken = None):
+        """
+        :param token: token cancelled by the button (`start` sets it to the job's token)
+        """
+        import ipywidgets
+        from IPython.display import display
+        self.token = token
+        self._bar = ipywidgets.IntProgress(min=0, max=1, value=0)
+        self._label = ipywidgets.Label("")
+        self._button = ipywidgets.Button(description="Cancel")
+        self._button.on_click(self._on_cancel)
+        display(ipywidgets.HBox([self._bar, self._label, self._button]))
+
+    def _on_cancel(self, button):
+        if self.token is not None:
+            self.token.cancel()
+            self._button.disabled = True
+            self._button.description = "Cancelling"
+
+    def on_start(self, stage: str, total: int):
+        self._bar.max = max(total or 1, 1)
+        self._bar.value = 0
+        self._label.value = stage
+
+    def on_update(self, stage: str, done: int, total: int):
+        self._bar.value = min(done, self._bar.max)
+        self._label.value = stage + ": " + _format_count(done, total)
+
+    def on_end(self, stage: str, done: int, total: int):
+        self.on_update(stage, done, total)
+
+
+class _Reporter:
+    def __init__(self, callback: ProgressCallback, token: CancellationToken, interval: int):
+        self.callback = callback
+        self.token = token
+        self.interval = interval
+
+
+class Tracker:
+    """Counts the units processed by one stage. Reports to the callback and checks for cancellation every
+    `interval` units."""
+    __slots__ = ["stage", "total", "done", "interval", "_reporter", "_next"]
+
+    def __init__(self, stage: str, total: int, reporter: _Reporter, interval: int = None):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self._reporter = reporter
+        if reporter is None:
+            self.interval = self._next = -1
+        else:
+            self.interval = self._next = interval or reporter.interval
+
+    def update(self, n: int = 1):
+        self.done += n
+        if self.done >= self._next >= 0:
+            self._next = self.done + self.interval
+            if self._reporter.token is not None:
+                self._reporter.token.raise_if_cancelled()
+            if self._reporter.callback is not None:
+                self._reporter.callback.on_update(self.stage, self.done, self.total)
+
+
+@contextlib.contextmanager
+def report(callback: ProgressCallback = None, token: CancellationToken = None, interval: int = 100):
+    """Report progress to `callback` and check `token` for cancellation within a block
+
+    :param callback: progress callback (or None, to only support cancellation)
+    :param token: cancellation token (or None)
+    :param interval: number of units (files, sessions) between two progress updates and cancellation checks
+    """
+    reset = _reporter.set(_Reporter(callback, token, interval))
+    try:
+        yield
+    finally:
+        _reporter.reset(reset)
+
+
+@contextlib.contextmanager
+def track(stage: str, total: int = None, interval: int = None):
+    """Track the units processed by an instrumented loop:
+
+        with progress.track("analyze_traffic.build_session_index", len(sids)) as tracker:
+            for sid in sids:
+                ...
+                tracker.update()
+
+    Without an active `report` block, updates only increment a counter. `interval` overrides the reporting interval
+    of the `report` block (e.g. 1 for stages with few, slow units).
+    """
+    reporter = _reporter.get()
+    tracker = Tracker(stage, total, reporter, interval)
+    if reporter is None:
+        yield tracker
+        return
+    if reporter.token is not None:
+        reporter.token.raise_if_cancelled()
+    if reporter.callback is not None:
+        reporter.callback.on_start(stage, total)
+    try:
+        yield tracker
+    finally:
+        if reporter.callback is not None:
+            reporter.callback.on_end(stage, tracker.done, total)
+
+
+class Job:
+    """Analysis running in a background thread (see `start`)"""
+
+    def __init__(self, fn, args, kwargs, callback: ProgressCallback, interval: int):
+        self.token = CancellationToken()
+        if isinstance(callback, WidgetProgress) and callback.token is None:
+            callback.token = self.token
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(fn, args, kwargs, callback, interval), daemon=True)
+        self._thread.start()
+
+    def _run(self, fn, args, kwargs, callback, interval):
+        with report(callback, self.token, interval):
+            try:
+                self._result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._error = e
+
+    def cancel(self):
+        """Ask the job to stop at its next cancellation check"""
+        self.token.cancel()
+
+    def done(self) -> bool:
+        return not self._thread.is_alive()
+
+    def result(self, timeout: float = None):
+        """Wait for the job to finish and return its result (or raise its exception, e.g. OperationCancelled)"""
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError("Job is still running")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def start(fn, *args, callback: ProgressCallback = None, interval: int = 100, **kwargs) -> Job:
+    """Run `fn(*args, **kwargs)` in a background thread, reporting progress to `callback`
+
+    :return: Job, which can be cancelled and waited on
+    """
+    return Job(fn, args, kwargs, callback, interval)
+
+
+def _format_count(done: int, total: int) -> str:
+    if total:
+        return str(done) + "/" + str(total) + " (" + str(int(100 * done / total)) + "%)"
+    return str(done)
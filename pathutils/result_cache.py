@@ -0,0 +1,240 @@
+"""result_cache.py
+
+Cache of analysis results, keyed by the data they were computed on. A key combines a fingerprint of the dataset (a
+hash of the events' contents), a fingerprint of the URL resolution rules (for results using resolved URLs), the
+analysis function and its normalized arguments. Loading new bundles gives a new dataset fingerprint, so results
+computed on older data are never returned, and don't need to be invalidated by hand:
+
+    cache = result_cache.ResultCache(folder="~/.pathutils_cache")
+    ctx = analysis_context.AnalysisContext(dffull)
+    funnelCounts = cache.call(funnel_stats.get_funnel_stats, ctx, test_funnel, useResolvedUrls)
+
+Results are kept in memory (least recently used first out) and, if a folder is given, pickled to disk so that they
+survive restarts. Fingerprints of AnalysisContexts are computed once per context; pass a context rather than a
+DataFrame when repeating queries on large datasets.
+
+"""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import threading
+import weakref
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from pathutils import analysis_context, analyze_traffic, hauser_reader, manage_resolutions
+
+DEFAULTMAXENTRIES = 256  # results kept in memory
+DEFAULTMAXDISKBYTES = 1 << 30
+CACHEEXTENSION = ".pkl"
+
+
+def get_events_fingerprint(events: pd.DataFrame) -> str:
+    """Hash of the contents of an events DataFrame (index and columns, except resolved URLs, which depend on the
+    rules rather than the data)"""
+    events = events.drop(columns=[analyze_traffic.RESOLVEDURL], errors="ignore")
+    digest = hashlib.sha1(json.dumps([str(col) for col in events.columns]).encode("utf-8"))
+    digest.update(np.int64(len(events)).tobytes())
+    digest.update(pd.util.hash_pandas_object(events, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def get_folder_fingerprint(folder: str) -> str:
+    """Hash of the names, sizes and modification times of the bundles in a Hauser folder, which changes when bundles
+    are added, removed or rewritten (a cheap way to find out that a folder needs reloading)"""
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(folder)):
+        if hauser_reader.is_bundle(name):
+            stat = os.stat(os.path.join(folder, name))
+            digest.update((name + ":" + str(stat.st_size) + ":" + str(stat.st_mtime_ns) + "\n").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_rules_fingerprint(rules: dict = None) -> str:
+    """Hash of URL resolution rules (the saved rules by default)"""
+    if rules is None:
+        rules = manage_resolutions.get_regex_dict() or {}
+    return hashlib.sha1(json.dumps(sorted(rules.items())).encode("utf-8")).hexdigest()
+
+
+def make_key(datasetFingerprint: str, rulesFingerprint: str, function: str, args: dict) -> str:
+    """Cache key of a result
+
+    :param datasetFingerprint: fingerprint of the events
+    :param rulesFingerprint: fingerprint of the resolution rules, or None if the result doesn't depend on them
+    :param function: name of the analysis
+    :param args: arguments of the analysis, other than the events (JSON serializable; lists and tuples are equal)
+    :return: key string, starting with the dataset fingerprint
+    """
+    payload = json.dumps([rulesFingerprint, function, args], sort_keys=True, default=repr)
+    return datasetFingerprint[:16] + "-" + hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU of analysis results, backed by an optional on-disk tier. Safe to share between threads."""
+
+    def __init__(self, maxEntries: int = DEFAULTMAXENTRIES, folder: str = None,
+                 maxDiskBytes: int = DEFAULTMAXDISKBYTES):
+        """
+        :param maxEntries: maximum number of results kept in memory
+        :param folder: folder for the on-disk tier (created if needed), or None to only cache in memory
+        :param maxDiskBytes: size above which the least recently used files are deleted from the on-disk tier
+        """
+        self.maxEntries = maxEntries
+        self.folder = None if folder is None else os.path.expanduser(folder)
+        self.maxDiskBytes = maxDiskBytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._fingerprints = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+
+    def get_fingerprint(self, events) -> str:
+        """Dataset fingerprint of an events DataFrame or AnalysisContext (computed once per context)"""
+        if not isinstance(events, analysis_context.AnalysisContext):
+            return get_events_fingerprint(events)
+        with self._lock:
+            fingerprint = self._fingerprints.get(events)
+        if fingerprint is None:
+            fingerprint = get_events_fingerprint(events.events)
+            with self._lock:
+                self._fingerprints[events] = fingerprint
+        return fingerprint
+
+    def get(self, key: str) -> (bool, object):
+        """Look a result up in memory, then on disk
+
+        :return: (found, result)
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+        found, value = self._read(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+                self._remember(key, value)
+            else:
+                self.misses += 1
+        return found, value
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._remember(key, value)
+        self._write(key, value)
+
+    def get_or_compute(self, key: str, compute):
+        """Return the cached result for `key`, computing (and caching) it with `compute()` if needed"""
+        found, value = self.get(key)
+        if not found:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def call(self, fn, *args, **kwargs):
+        """Call an analysis function (e.g. `funnel_stats.get_funnel_stats`), or return its cached result
+
+        The events argument (a DataFrame or AnalysisContext, at any position) is replaced by its fingerprint in the
+        key, and the resolution rules are part of the key when `useResolvedUrls` is set.
+        """
+        return self.get_or_compute(self.get_call_key(fn, *args, **kwargs), lambda: fn(*args, **kwargs))
+
+    def get_call_key(self, fn, *args, **kwargs) -> str:
+        """Cache key of an analysis function call (see `call`)"""
+        arguments = inspect.signature(fn).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        datasetFingerprint = None
+        params = {}
+        for name, value in arguments.arguments.items():
+            if isinstance(value, (pd.DataFrame, analysis_context.AnalysisContext)):
+                datasetFingerprint = self.get_fingerprint(value)
+            else:
+                params[name] = value
+        if datasetFingerprint is None:
+            raise ValueError("No events argument for " + fn.__name__)
+        rulesFingerprint = get_rules_fingerprint() if params.get("useResolvedUrls") else None
+        return make_key(datasetFingerprint, rulesFingerprint, fn.__module__ + "." + fn.__qualname__, params)
+
+    def clear(self, disk: bool = True):
+        """Drop all cached results (from memory, and from disk if `disk`)"""
+        with self._lock:
+            self._entries.clear()
+        if disk and self.folder is not None:
+            for name in self._list_files():
+                _remove(os.path.join(self.folder, name))
+
+    def prune(self, keepFingerprints: list):
+        """Delete the on-disk results of datasets other than `keepFingerprints` (e.g. after loading new bundles)"""
+        if self.folder is None:
+            return
+        prefixes = tuple(fingerprint[:16] + "-" for fingerprint in keepFingerprints)
+        for name in self._list_files():
+            if not name.startswith(prefixes):
+                _remove(os.path.join(self.folder, name))
+
+    def _remember(self, key: str, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key + CACHEEXTENSION)
+
+    def _list_files(self) -> list:
+        return [name for name in os.listdir(self.folder) if name.endswith(CACHEEXTENSION)]
+
+    def _read(self, key: str) -> (bool, object):
+        if self.folder is None:
+            return False, None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fread:
+                value = pickle.load(fread)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        # the modification time orders files for eviction
+        os.utime(path)
+        return True, value
+
+    def _write(self, key: str, value):
+        if self.folder is None:
+            return
+        # write to a temporary file first, so that concurrent readers never see a partial file
+        fd, tmpPath = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fwrite:
+            pickle.dump(value, fwrite, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self._path(key))
+        self._evict_files()
+
+    def _evict_files(self):
+        files = []
+        for name in self._list_files():
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.maxDiskBytes:
+                break
+            _remove(os.path.join(self.folder, name))
+            total -= size
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
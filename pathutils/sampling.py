@@ -0,0 +1,114 @@
+"""sampling.py
+
+Deterministic session sampling, and scaling of results computed on a sample. Sessions are kept or dropped as a whole,
+based on a hash of their session id, so the same sessions are sampled from every file, on every run, and for every
+analysis (unlike `limit_rows`, which cuts the dataset after the first rows):
+
+    df = analyze_traffic.get_hauser_as_df(folder, sample_fraction=0.01)
+    df = utils.preproc_events(df)
+    counts = get_popular_urls.get_popular(df, useResolvedUrls)
+    estimates = sampling.scale_counts(counts, 0.01)
+
+Scaled counts come with a confidence interval for the count in the whole dataset. Ratios between counts of the same
+sample (e.g. funnel conversion rates) don't need scaling; `estimate_proportion` gives their confidence interval.
+
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULTCONFIDENCE = 0.95
+
+# estimated value and bounds of its confidence interval
+Estimate = namedtuple("Estimate", ["value", "low", "high"])
+
+
+def get_session_ids(events: pd.DataFrame) -> np.ndarray:
+    """Session id of each event, for raw (Hauser) or preprocessed events DataFrames"""
+    if "distinct_session_id" in events.columns:
+        return events["distinct_session_id"].to_numpy(dtype=object)
+    return (events["UserId"].astype(str) + events["SessionId"].astype(str)).to_numpy(dtype=object)
+
+
+def session_hash(sids, seed: int = 0) -> np.ndarray:
+    """Deterministic uniform hash in [0, 1) of each session id"""
+    hashes = pd.util.hash_array(np.asarray(sids, dtype=object))
+    if seed:
+        hashes = pd.util.hash_array(hashes ^ np.uint64(seed))
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+
+def sample_sessions(events: pd.DataFrame, fraction: float, seed: int = 0) -> pd.DataFrame:
+    """Keep the events of a deterministic sample of sessions
+
+    :param events: raw or preprocessed events DataFrame
+    :param fraction: fraction of sessions to keep (between 0 and 1)
+    :param seed: changes the sample (the same seed always gives the same sessions)
+    :return: events of the sampled sessions
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError("Sample fraction should be in (0, 1]")
+    if fraction == 1:
+        return events
+    sids = get_session_ids(events)
+    uniqueSids, inverse = np.unique(sids.astype(str), return_inverse=True)
+    keep = session_hash(uniqueSids, seed) < fraction
+    return events.loc[keep[inverse]]
+
+
+def _z_score(confidence: float) -> float:
+    # scipy.stats takes most of the import time of the package, and is only needed here
+    from scipy import stats
+    return stats.norm.ppf(0.5 + confidence / 2)
+
+
+def estimate_count(sampleCount: int, fraction: float, confidence: float = DEFAULTCONFIDENCE) -> Estimate:
+    """Estimate of a session count in the whole dataset from its count in a sample
+
+    Each session is sampled independently with probability `fraction`, so the sample count is binomial and its
+    scaled value `sampleCount / fraction` is an unbiased estimate, with variance estimated by
+    `sampleCount * (1 - fraction) / fraction ** 2`. The interval is never below the observed count.
+
+    :param sampleCount: count observed in the sample (of sessions, or of events such as funnel occurrences)
+    :param fraction: sampling fraction
+    :param confidence: confidence level of the interval
+    :return: Estimate of the count in the whole dataset
+    """
+    value = sampleCount / fraction
+    # with no observation, use the count for which one observation would be expected
+    spread = _z_score(confidence) * np.sqrt(max(sampleCount, 1) * (1 - fraction)) / fraction
+    return Estimate(value, max(float(sampleCount), value - spread), value + spread)
+
+
+def estimate_proportion(successes: int, trials: int, confidence: float = DEFAULTCONFIDENCE) -> Estimate:
+    """Wilson score interval for a proportion measured on a sample (e.g. a funnel step conversion rate)"""
+    if trials == 0:
+        return Estimate(0.0, 0.0, 1.0)
+    z = _z_score(confidence)
+    p = successes / trials
+    denominator = 1 + z ** 2 / trials
+    center = (p + z ** 2 / (2 * trials)) / denominator
+    spread = z * np.sqrt(p * (1 - p) / trials + z ** 2 / (4 * trials ** 2)) / denominator
+    return Estimate(p, max(0.0, center - spread), min(1.0, center + spread))
+
+
+def scale_counts(counts: dict, fraction: float, confidence: float = DEFAULTCONFIDENCE) -> dict:
+    """Scale a dictionary of counts computed on a sample (as returned by `get_popular_urls.get_popular`,
+    `funnel_in_outs.get_in_outs` or `frequent_funnel.get_top_funnels_df`)
+
+    :return: dictionary of the same keys to Estimates
+    """
+    return {key: estimate_count(count, fraction, confidence) for key, count in counts.items()}
+
+
+def scale_funnel_stats(funnelCounts: list, fraction: float, confidence: float = DEFAULTCONFIDENCE) -> list:
+    """Scale funnel conversion statistics (as returned by `funnel_stats.get_funnel_stats`) computed on a sample
+
+    :return: list of (URL, Estimate of the session count, Estimate of the conversion rate from the first step)
+    """
+    if len(funnelCounts) == 0:
+        return []
+    first = funnelCounts[0][1]
+    return [(url, estimate_count(count, fraction, confidence), estimate_proportion(count, first, confidence))
+            for url, count in funnelCounts]
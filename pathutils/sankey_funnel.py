@@ -8,14 +8,13 @@ Plot a sankey diagram for a funnel
 
 import argparse
 import json
-import plotly.graph_objects as gobj
 import pandas as pd
 
 from collections import defaultdict
 from urllib.parse import urlparse
 from urllib.parse import urlunparse
 
-from pathutils import analyze_traffic, utils
+from pathutils import analyze_traffic, plotting, profiling, utils
 
 from pathutils.funnel_stats import get_funnel_stats
 from pathutils.funnel_in_outs import get_in_outs
@@ -31,7 +30,26 @@ def show_sankey(folder, funnelFile, useResolvedUrls, limitBranches, title):
     events = utils.preproc_events(events)
     plot_funnel(title, events, funnel, useResolvedUrls, limitBranches)
 
+@profiling.profiled
 def get_funnel_lists(title: str, events: pd.DataFrame, funnel: list, useResolvedUrls: bool, cutoff: int=10):
+    funnel_counts = get_funnel_stats(events, funnel, useResolvedUrls, 0)
+    ingress, egress = get_in_outs(events, funnel[:1], useResolvedUrls, 0)
+    egresses = [egress] + [get_in_outs(events, funnel[:j], useResolvedUrls, 0)[1] for j in range(2, len(funnel) + 1)]
+    return get_funnel_lists_from_stats(title, funnel, funnel_counts, ingress, egresses, cutoff)
+
+
+def get_funnel_lists_from_stats(title: str, funnel: list, funnel_counts: list, ingress: dict, egresses: list,
+                                cutoff: int=10):
+    """Sankey nodes and links of a funnel, from its statistics
+
+    :param title: title for the sankey diagram
+    :param funnel: funnel to be plotted
+    :param funnel_counts: conversion statistics of the funnel (see `funnel_stats.get_funnel_stats`)
+    :param ingress: ingress counts of the first step (see `funnel_in_outs.get_in_outs`)
+    :param egresses: egress counts of each prefix of the funnel (first step, first two steps...)
+    :param cutoff: number of inflow/outflow nodes to plot for each sankey node
+    :return: labels, colors, sources, targets, values and title
+    """
     labels = []
     colors = []
     sources = []
@@ -54,7 +72,6 @@ def get_funnel_lists(title: str, events: pd.DataFrame, funnel: list, useResolved
 
     nodecount = len(funnel)
 
-    funnel_counts = get_funnel_stats(events, funnel, useResolvedUrls, 0)
     totalIn = funnel_counts[0][1]
 
     for i in range(len(funnel_counts) - 1):
@@ -63,8 +80,6 @@ def get_funnel_lists(title: str, events: pd.DataFrame, funnel: list, useResolved
         values.append(funnel_counts[i + 1][1])
 
     # Add funnel sources
-    subfunnel = funnel[:1]
-    ingress, egress = get_in_outs(events, subfunnel, useResolvedUrls, 0)
     sortIn = sorted_dict_items(ingress, True)
     sortIn = sortIn[:cutoff]
     for input in sortIn:
@@ -87,8 +102,7 @@ def get_funnel_lists(title: str, events: pd.DataFrame, funnel: list, useResolved
     # Add funnel sinks
     for j in range(1, len(funnel) + 1):
         subfunnel = funnel[:j]
-        ingress, egress = get_in_outs(events, subfunnel, useResolvedUrls, 0)
-        sortOut = sorted_dict_items(egress, True)
+        sortOut = sorted_dict_items(egresses[j - 1], True)
         sortOutCut = sortOut[:cutoff]
         nextStepInFun = False
         for output in sortOutCut:
@@ -142,8 +156,12 @@ def plot_funnel(title: str, events: pd.DataFrame, funnel: list, useResolvedUrls:
     :param cutoff: number of inflow/outflow nodes to plot for each sankey node (all remaining nodes get grouped into Other)
     :return:
     """
-    labels, colors, sources, targets, values, title = get_funnel_lists(title, events, funnel, useResolvedUrls, cutoff)
+    plot_funnel_lists(*get_funnel_lists(title, events, funnel, useResolvedUrls, cutoff))
+
 
+def plot_funnel_lists(labels: list, colors: list, sources: list, targets: list, values: list, title: str):
+    """Plot a sankey diagram from the lists returned by `get_funnel_lists` or `get_funnel_lists_from_stats`"""
+    gobj = plotting.get_graph_objects()
     fig = gobj.Figure(data=[gobj.Sankey(
         arrangement="freeform",
         node=dict(
@@ -195,5 +213,7 @@ if __name__ == "__main__":
     parser.add_argument("limitBranches", type=int, help="Limit the number of branches for each sankey node")
     parser.add_argument("title", type=str, help="Plot title")
     parser.add_argument("--useResolvedUrls", dest="useResolvedUrls", action="store_const", const=True, help="Use resolved page URLs")
+    profiling.add_profile_argument(parser)
     args = parser.parse_args()
-    show_sankey(args.hauser_folder, args.funnel, args.useResolvedUrls, args.limitBranches, args.title)
\ No newline at end of file
+    with profiling.profile_cli(args.profile):
+        show_sankey(args.hauser_folder, args.funnel, args.useResolvedUrls, args.limitBranches, args.title)
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""schema.py
+
+Compact column types for Hauser events data. `pd.read_json` stores every string column as Python objects and every
+number as 64 bits, although most string columns (URLs, device, browser, user agent, event type) repeat a few distinct
+values. `apply_schema` converts them to categoricals, parses event times, downcasts numbers and optionally drops the
+columns holding personal data. `get_hauser_as_df` applies it when loading.
+
+"""
+import numpy as np
+import pandas as pd
+
+# string columns that always repeat a small number of values
+CATEGORYCOLUMNS = ["EventType", "PageUrl", "PageRefererUrl", "PageBrowser", "PageDevice", "PageOperatingSystem",
+                   "PageAgent", "EventTargetText", "EventTargetSelectorTok"]
+# identifiers need all 64 bits
+IDCOLUMNS = ["IndvId", "UserId", "SessionId", "PageId"]
+DATECOLUMNS = ["EventStart"]
+# columns holding personal data
+PIICOLUMNS = ["PageIp", "PageLatLong", "UserDisplayName", "UserEmail", "UserAppKey"]
+# other string columns become categorical if they have fewer distinct values than this fraction of rows
+CATEGORYMAXRATIO = 0.5
+
+
+def apply_schema(events: pd.DataFrame, drop_pii: bool = False) -> pd.DataFrame:
+    """Convert an events DataFrame (as read from Hauser exports) to compact column types
+
+    :param events: raw events DataFrame
+    :param drop_pii: drop the columns holding personal data (PIICOLUMNS)
+    :return: new DataFrame with the same rows
+    """
+    if drop_pii:
+        events = events.drop(columns=[col for col in PIICOLUMNS if col in events.columns])
+    columns = {}
+    for col in events.columns:
+        values = events[col]
+        if col in IDCOLUMNS or isinstance(values.dtype, pd.CategoricalDtype):
+            columns[col] = values
+        elif col in DATECOLUMNS:
+            columns[col] = pd.to_datetime(values, utc=True)
+        elif col in CATEGORYCOLUMNS:
+            columns[col] = values.astype("category")
+        elif values.dtype == object:
+            if values.nunique(dropna=False) < CATEGORYMAXRATIO * len(values):
+                columns[col] = values.astype("category")
+            else:
+                columns[col] = values
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            columns[col] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values.dtype):
+            columns[col] = _downcast_float(values)
+        else:
+            columns[col] = values
+    return pd.DataFrame(columns, index=events.index)
+
+
+def _downcast_float(values: pd.Series) -> pd.Series:
+    """Integer valued floats with missing values (e.g. click flags) become nullable integers, other floats float32"""
+    present = values.dropna()
+    if len(present) > 0 and (present == np.round(present)).all():
+        return values.astype(pd.to_numeric(present, downcast="integer").dtype.name.capitalize())
+    return pd.to_numeric(values, downcast="float")
+
+
+def memory_usage(events: pd.DataFrame) -> int:
+    """Memory used by a DataFrame in bytes, including the contents of string columns"""
+    return int(events.memory_usage(index=True, deep=True).sum())
+
+
+def format_memory_report(before: int, after: int) -> str:
+    return "Memory usage: " + f"{before / 2 ** 20:.1f}" + " MB -> " + f"{after / 2 ** 20:.1f}" + " MB (" + \
+        f"{before / max(after, 1):.1f}" + "x smaller)"
@@ -0,0 +1,312 @@
+"""server.py
+
+Local HTTP/JSON server answering analysis queries on a dataset loaded once. The Hauser folder is loaded,
+preprocessed and indexed at startup, and every query then runs against the same `AnalysisContext`, so that a query
+costs the analysis itself rather than a process start, a load and a preprocessing pass:
+
+    pathutils serve my_hauser_folder --port 8050
+    curl -d '{"funnel": ["https://www.example.com/", "https://www.example.com/cart"]}' localhost:8050/funnel_stats
+
+Analyses are POSTed to `/<analysis>` with their parameters as a JSON object (or sent as GET query parameters, whose
+values are parsed as JSON when possible), and answer `{"result": ..., "cached": ..., "seconds": ...}`. `GET /info`
+lists the dataset size and the analyses. Results are cached per (dataset, resolution rules, analysis, parameters) in
+a `result_cache.ResultCache`, and queries run concurrently, one thread per request. The folder is reloaded in the
+background when bundles are added.
+
+"""
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from pathutils import analysis_context, analyze_timing, analyze_traffic, frequent_funnel, funnel_in_outs, \
+    funnel_stats, get_popular_urls, result_cache, sankey_funnel, session_links, top_sessions, utils
+
+DEFAULTHOST = "127.0.0.1"
+DEFAULTPORT = 8050
+DEFAULTREFRESHINTERVAL = 60  # seconds
+
+
+def _sorted_counts(counts: dict, top: int = 0) -> list:
+    counts = sorted(counts.items(), key=lambda x: (-x[1], x[0]))
+    if top > 0:
+        counts = counts[:top]
+    return [[key, int(count)] for key, count in counts]
+
+
+def _popular(ctx, useResolvedUrls=False, limit_rows=0, top=0):
+    return _sorted_counts(get_popular_urls.get_popular(ctx, useResolvedUrls, limit_rows), top)
+
+
+def _funnel_stats(ctx, funnel, useResolvedUrls=False, limit_rows=0):
+    return [[url, int(count)] for url, count in funnel_stats.get_funnel_stats(ctx, funnel, useResolvedUrls, limit_rows)]
+
+
+def _in_outs(ctx, funnel, useResolvedUrls=False, limit_rows=0, top=0):
+    ingressCounts, egressCounts = funnel_in_outs.get_in_outs(ctx, funnel, useResolvedUrls, limit_rows)
+    return {"in": _sorted_counts(ingressCounts, top), "out": _sorted_counts(egressCounts, top)}
+
+
+def _top_funnels(ctx, url, length, useResolvedUrls=False, limit_rows=0, top=10):
+    funnelCounts = frequent_funnel.get_top_funnels_df(url, length, useResolvedUrls, ctx, limit_rows)
+    return [[list(funnel), count] for funnel, count in _sorted_counts(funnelCounts, top)]
+
+
+def _timing(ctx, funnel, useResolvedUrls=False):
+    return analyze_timing.get_timing_for_funnel(ctx, funnel, useResolvedUrls)
+
+
+def _sankey(ctx, funnel, useResolvedUrls=False, cutoff=10, title=""):
+    labels, colors, sources, targets, values, title = sankey_funnel.get_funnel_lists(title, ctx, funnel,
+                                                                                    useResolvedUrls, cutoff)
+    return dict(labels=labels, colors=colors, sources=[int(x) for x in sources],
+                targets=[int(x) for x in targets], values=[int(x) for x in values], title=title)
+
+
+def _top_sessions(ctx, funnel, useResolvedUrls=False, numSessions=10, rankBy=top_sessions.RECENT, OrgId=None,
+                  is_staging=False):
+    ranked = top_sessions.get_top_sessions(ctx, funnel, useResolvedUrls, numSessions, rankBy)
+    urls = session_links.get_session_urls([sid for sid, _ in ranked], OrgId, is_staging)
+    return [[sid, url, score.isoformat() if rankBy == top_sessions.RECENT else score]
+            for (sid, score), url in zip(ranked, urls)]
+
+
+# analysis name to function of (AnalysisContext, **parameters), returning a JSON serializable result
+ANALYSES = {
+    "popular": _popular,
+    "funnel_stats": _funnel_stats,
+    "in_outs": _in_outs,
+    "top_funnels": _top_funnels,
+    "timing": _timing,
+    "sankey": _sankey,
+    "top_sessions": _top_sessions,
+}
+
+
+class AnalysisServer:
+    """Runs analyses on a shared AnalysisContext and caches their results (independently of HTTP)"""
+
+    def __init__(self, ctx: analysis_context.AnalysisContext, cache: result_cache.ResultCache = None,
+                 folder: str = None, loadArgs: dict = None):
+        """
+        :param ctx: context of the dataset to serve
+        :param cache: cache of the results (an in-memory ResultCache by default)
+        :param folder: Hauser folder `ctx` was loaded from, to reload it when bundles are added (see `refresh`)
+        :param loadArgs: arguments of `load_context` used to reload the folder
+        """
+        self.ctx = ctx
+        self.cache = cache if cache is not None else result_cache.ResultCache()
+        self.folder = folder
+        self.loadArgs = loadArgs or {}
+        self._folderFingerprint = None if folder is None else result_cache.get_folder_fingerprint(folder)
+        self._warmResolved = False
+        self._reloadLock = threading.Lock()
+
+    def get_info(self) -> dict:
+        ctx = self.ctx
+        events = ctx.get_navigation_events()
+        return dict(events=len(events), sessions=int(events["distinct_session_id"].nunique()),
+                    fingerprint=self.cache.get_fingerprint(ctx), analyses=sorted(ANALYSES.keys()))
+
+    def run(self, name: str, params: dict) -> (object, bool):
+        """Run an analysis, or return its cached result
+
+        :param name: analysis name (key of ANALYSES)
+        :param params: keyword arguments of the analysis
+        :return: result and whether it came from the cache
+        """
+        if name not in ANALYSES:
+            raise KeyError("Unknown analysis: " + name)
+        # the same context for the key and the analysis, even if the folder is reloaded meanwhile
+        ctx = self.ctx
+        key = self.cache.get_call_key(ANALYSES[name], ctx, **params)
+        found, result = self.cache.get(key)
+        if not found:
+            result = ANALYSES[name](ctx, **params)
+            self.cache.put(key, result)
+        return result, found
+
+    def warm(self, useResolvedUrls: bool = False):
+        """Build the navigation events and inverted index upfront, so that the first queries don't pay for them"""
+        self._warmResolved = useResolvedUrls
+        _warm(self.ctx, useResolvedUrls)
+        # the dataset fingerprint is needed by every query
+        self.cache.get_fingerprint(self.ctx)
+
+    def refresh(self) -> bool:
+        """Reload the folder if bundles were added, removed or rewritten since it was loaded. Queries keep running on
+        the previous data until the new data is loaded and indexed; cached results of the previous data are not
+        returned for the new data, as their dataset fingerprints differ.
+
+        :return: whether the folder was reloaded
+        """
+        if self.folder is None:
+            return False
+        with self._reloadLock:
+            fingerprint = result_cache.get_folder_fingerprint(self.folder)
+            if fingerprint == self._folderFingerprint:
+                return False
+            ctx = load_context(self.folder, **self.loadArgs)
+            _warm(ctx, self._warmResolved)
+            self.cache.prune([self.cache.get_fingerprint(ctx)])
+            self.ctx = ctx
+            self._folderFingerprint = fingerprint
+        return True
+
+
+def _warm(ctx: analysis_context.AnalysisContext, useResolvedUrls: bool):
+    ctx.prepare(False)
+    if useResolvedUrls:
+        ctx.prepare(True)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # set on the subclass created by `make_server`
+    analysisServer = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        name = url.path.strip("/")
+        if name in ("", "info"):
+            self._send(200, self.analysisServer.get_info())
+            return
+        self._run(name, {key: _parse_value(value) for key, value in parse_qsl(url.query)})
+
+    def do_POST(self):
+        name = urlparse(self.path).path.strip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": "Invalid JSON: " + str(e)})
+            return
+        if not isinstance(params, dict):
+            self._send(400, {"error": "Parameters should be a JSON object"})
+            return
+        self._run(name, params)
+
+    def _run(self, name: str, params: dict):
+        if name not in ANALYSES:
+            self._send(404, {"error": "Unknown analysis: " + name})
+            return
+        start = time.perf_counter()
+        try:
+            result, cached = self.analysisServer.run(name, params)
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {"error": type(e).__name__ + ": " + str(e)})
+            return
+        except Exception as e:
+            self._send(500, {"error": type(e).__name__ + ": " + str(e)})
+            return
+        self._send(200, {"result": result, "cached": cached, "seconds": time.perf_counter() - start})
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body, default=_to_json).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def _parse_value(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _to_json(value):
+    if hasattr(value, "item"):
+        # numpy scalars
+        return value.item()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError("Not JSON serializable: " + type(value).__name__)
+
+
+def make_server(analysisServer: AnalysisServer, host: str = DEFAULTHOST, port: int = DEFAULTPORT,
+                quiet: bool = False) -> ThreadingHTTPServer:
+    """HTTP server for an AnalysisServer (call `serve_forever` to start it, `shutdown` from another thread to stop it)
+
+    :param analysisServer: AnalysisServer answering the queries
+    :param host: interface to listen on (local only by default)
+    :param port: port to listen on (0 picks a free port, see `server_address`)
+    :param quiet: don't log requests
+    :return: ThreadingHTTPServer
+    """
+    handler = type("RequestHandler", (_RequestHandler,), {"analysisServer": analysisServer})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    httpd.quiet = quiet
+    return httpd
+
+
+def load_context(folder: str, memory_budget: int = analysis_context.DEFAULTMEMORYBUDGET,
+                 **loadArgs) -> analysis_context.AnalysisContext:
+    """Load and preprocess a Hauser folder into an AnalysisContext
+
+    :param folder: path to the Hauser folder
+    :param memory_budget: memory budget of the context's intermediates
+    :param loadArgs: other arguments of `analyze_traffic.get_hauser_as_df` (e.g. sample_fraction)
+    :return: AnalysisContext
+    """
+    events = analyze_traffic.get_hauser_as_df(folder, **loadArgs)
+    if events is None:
+        raise ValueError("No Hauser bundles in " + folder)
+    return analysis_context.AnalysisContext(utils.preproc_events(events), memory_budget)
+
+
+def serve(folder: str, host: str = DEFAULTHOST, port: int = DEFAULTPORT, useResolvedUrls: bool = False,
+          cacheSize: int = result_cache.DEFAULTMAXENTRIES, cacheFolder: str = None,
+          refreshInterval: float = DEFAULTREFRESHINTERVAL, quiet: bool = False, **loadArgs):
+    """Load a Hauser folder and serve analyses on it until interrupted (see `load_context` and `make_server`)
+
+    :param cacheSize: maximum number of results cached in memory
+    :param cacheFolder: folder caching results on disk, or None
+    :param refreshInterval: seconds between two checks for new bundles in the folder (0 to never reload)
+    """
+    cache = result_cache.ResultCache(cacheSize, cacheFolder)
+    analysisServer = AnalysisServer(load_context(folder, **loadArgs), cache, folder, loadArgs)
+    analysisServer.warm(useResolvedUrls)
+    httpd = make_server(analysisServer, host, port, quiet)
+    if refreshInterval > 0:
+        threading.Thread(target=_refresh_periodically, args=(analysisServer, refreshInterval), daemon=True).start()
+    print("Serving " + folder + " on http://" + host + ":" + str(httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def _refresh_periodically(analysisServer: AnalysisServer, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            if analysisServer.refresh():
+                print("Reloaded " + analysisServer.folder)
+        except Exception as e:
+            print("WARNING: Reloading " + analysisServer.folder + " failed: " + str(e))
+
+
+def add_serve_arguments(parser):
+    parser.add_argument("hauser_folder", type=str, help="Path to folder containg data exported from hauser")
+    parser.add_argument("--host", type=str, default=DEFAULTHOST, help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULTPORT, help="Port to listen on")
+    parser.add_argument("--useResolvedUrls", dest="useResolvedUrls", action="store_const", const=True,
+                        default=False, help="Also index resolved page URLs at startup")
+    parser.add_argument("--cache_size", type=int, default=result_cache.DEFAULTMAXENTRIES,
+                        help="Maximum number of results cached in memory")
+    parser.add_argument("--cache_folder", type=str, default=None, help="Folder caching results on disk")
+    parser.add_argument("--refresh_interval", type=float, default=DEFAULTREFRESHINTERVAL,
+                        help="Seconds between two checks for new bundles (0 to never reload)")
+    parser.add_argument("--sample_fraction", type=float, default=1.0, help="Fraction of sessions to load")
+    parser.add_argument("--quiet", action="store_true", help="Don't log requests")
@@ -0,0 +1,122 @@
+"""session_links.py
+
+Session replay and Scope links for many sessions at once. `analyze_traffic.get_session_link` formats the links of
+one session; here the URL templates are resolved once per call and the links of a whole sequence of SIDs are built
+in one pass, which matters when exporting the tens of thousands of sessions matching a funnel:
+
+    sids = analyze_traffic.build_and_get_sids_for_funnel(df, test_funnel, analyze_traffic.PAGEURL)
+    links = session_links.get_session_links(sids, OrgId="o123")
+    session_links.write_session_links("sessions.csv", sids, OrgId="o123")
+
+Links are the same as those of `utils.get_beaker_lookup`. Sub-sessions (see `utils.split_sessions`) link to the
+session they belong to.
+
+"""
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from pathutils import utils
+
+SID = "sid"
+SESSIONURL = "session_url"
+SCOPEURL = "scope_url"
+SIDLENGTH = 32
+USERIDLENGTH = 16
+DEFAULTCHUNKSIZE = 10000
+CSVFORMAT = "csv"
+JSONLFORMAT = "jsonl"
+LINKFORMATS = [CSVFORMAT, JSONLFORMAT]
+
+_USERIDFIELD = "{UserId}"
+_SESSIONIDFIELD = "{SessionId}"
+
+
+def get_url_parts(OrgId: str = None, is_staging: bool = False) -> dict:
+    """Split the link templates of `utils.get_beaker_lookup` around the UserId and SessionId fields
+
+    :return: dictionary of link column (SESSIONURL, SCOPEURL) to (text before UserId, text between UserId and
+    SessionId, text after SessionId)
+    """
+    templates = utils.get_beaker_lookup(_USERIDFIELD, _SESSIONIDFIELD, OrgId, is_staging)
+    parts = {}
+    for col, template in templates.items():
+        prefix, rest = template.split(_USERIDFIELD, 1)
+        middle, suffix = rest.split(_SESSIONIDFIELD, 1)
+        parts[col] = (prefix, middle, suffix)
+    return parts
+
+
+def get_parent_sids(sids) -> list:
+    """SIDs of the sessions SIDs belong to (see `utils.get_parent_sid`), checked to be SIDLENGTH characters long"""
+    parents = [sid.partition(utils.SUBSESSIONSEP)[0] for sid in sids]
+    if np.any(np.fromiter(map(len, parents), dtype=np.int64, count=len(parents)) != SIDLENGTH):
+        raise ValueError("Expect sid to be " + str(SIDLENGTH) + " characters long")
+    return parents
+
+
+def get_session_urls(sids, OrgId: str = None, is_staging: bool = False, scope: bool = False) -> list:
+    """Session replay links (or Scope links if `scope`) of a sequence of SIDs, in the same order"""
+    prefix, middle, suffix = get_url_parts(OrgId, is_staging)[SCOPEURL if scope else SESSIONURL]
+    return _format(prefix, middle, suffix, get_parent_sids(sids))
+
+
+def get_session_links(sids, OrgId: str = None, is_staging: bool = False) -> pd.DataFrame:
+    """Session replay and Scope links of a sequence of SIDs
+
+    :param sids: sequence of SIDs
+    :param OrgId: FullStory OrgId for the organization
+    :param is_staging: set to True if FullStory staging environment should be used (for debugging purposes)
+    :return: DataFrame with SID, SESSIONURL and SCOPEURL columns, one row per SID
+    """
+    sids = list(sids)
+    parents = get_parent_sids(sids)
+    links = {SID: sids}
+    for col, (prefix, middle, suffix) in get_url_parts(OrgId, is_staging).items():
+        links[col] = _format(prefix, middle, suffix, parents)
+    return pd.DataFrame(links, columns=[SID, SESSIONURL, SCOPEURL])
+
+
+def _format(prefix: str, middle: str, suffix: str, parents: list) -> list:
+    # each SID is a UserId followed by a SessionId; plain concatenation is several times faster than numpy's
+    # string functions, which work on fixed width arrays
+    return [prefix + sid[:USERIDLENGTH] + middle + sid[USERIDLENGTH:] + suffix for sid in parents]
+
+
+def write_session_links(path: str, sids, OrgId: str = None, is_staging: bool = False, linkFormat: str = None,
+                        chunksize: int = DEFAULTCHUNKSIZE) -> int:
+    """Stream the session replay and Scope links of SIDs to a CSV or JSON lines file, one chunk of SIDs at a time
+
+    :param path: output file
+    :param sids: iterable of SIDs (e.g. a generator; at most `chunksize` links are held in memory)
+    :param OrgId: FullStory OrgId for the organization
+    :param is_staging: set to True if FullStory staging environment should be used (for debugging purposes)
+    :param linkFormat: CSVFORMAT or JSONLFORMAT (from the extension of `path` by default)
+    :param chunksize: number of SIDs per chunk
+    :return: number of links written
+    """
+    if linkFormat is None:
+        linkFormat = os.path.splitext(path)[1].lstrip(".").lower()
+    if linkFormat not in LINKFORMATS:
+        raise ValueError("Unknown link format: " + str(linkFormat) + " (expected one of " + ", ".join(LINKFORMATS)
+                         + ")")
+    sids = iter(sids)
+    numLinks = 0
+    with open(path, "w", newline="") as fwrite:
+        while True:
+            chunk = list(itertools.islice(sids, chunksize))
+            if len(chunk) == 0 and numLinks > 0:
+                break
+            links = get_session_links(chunk, OrgId, is_staging)
+            if linkFormat == CSVFORMAT:
+                links.to_csv(fwrite, header=numLinks == 0, index=False)
+            else:
+                for record in links.itertuples(index=False):
+                    fwrite.write(json.dumps(record._asdict()) + "\n")
+            numLinks += len(links)
+            if len(chunk) < chunksize:
+                break
+    return numLinks
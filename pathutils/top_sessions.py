@@ -0,0 +1,128 @@
+"""top_sessions.py
+
+The top sessions matching a funnel, ranked by relevance: most recent, most rage clicks, or longest time spent going
+through the funnel. `analyze_traffic.get_sessions_for_funnel` matches every candidate session before keeping
+`numSessions` of them; here candidates are visited from the highest possible score down, the best `numSessions`
+matches are kept in a bounded heap, and matching stops as soon as no remaining candidate can enter the heap:
+
+    ctx = analysis_context.AnalysisContext(dffull)
+    top = top_sessions.get_top_sessions(ctx, test_funnel, useResolvedUrls, 5, top_sessions.RAGECLICKS)
+    links = session_links.get_session_urls([sid for sid, _ in top], OrgId)
+
+For recency and rage clicks, the score is known before matching, so only the sessions up to the `numSessions`th
+match are matched. For funnel dwell, the session duration bounds the score. Ties are broken by SID, so results are
+deterministic.
+
+"""
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from pathutils import analysis_context, analyze_traffic, profiling, progress, utils
+
+RECENT = "recent"  # latest session start first
+RAGECLICKS = "rage_clicks"  # most rage clicks first
+DWELL = "dwell"  # longest time from the first to the last funnel step first
+RANKINGS = [RECENT, RAGECLICKS, DWELL]
+
+
+def get_rage_click_counts(ctx: "analysis_context.AnalysisContext") -> pd.Series:
+    """Number of rage clicks of each session with rage clicks, built once per context"""
+    return ctx.get_or_compute("rage_counts", lambda: _count_rage_clicks(ctx.events))
+
+
+def _count_rage_clicks(events: pd.DataFrame) -> pd.Series:
+    if "EventModFrustrated" not in events.columns:
+        return pd.Series(dtype=np.int64)
+    clicks = events.loc[(events["EventType"] == "click") & events["EventModFrustrated"].notna()]
+    return clicks.groupby(level=0, sort=False).size()
+
+
+def get_score_bounds(ctx: "analysis_context.AnalysisContext", sids: list, rankBy: str) -> (np.ndarray, bool):
+    """Upper bounds of the scores of sessions
+
+    :param ctx: context of the events
+    :param sids: SIDs of the sessions
+    :param rankBy: ranking (one of RANKINGS)
+    :return: array of bounds (nanoseconds since the epoch for RECENT, counts for RAGECLICKS, seconds for DWELL) and
+    whether they are the exact scores
+    """
+    if rankBy == RECENT:
+        starts = ctx.get_session_meta()[utils.SESSIONSTART].reindex(sids)
+        return starts.to_numpy(dtype="datetime64[ns]").astype(np.int64), True
+    if rankBy == RAGECLICKS:
+        return get_rage_click_counts(ctx).reindex(sids, fill_value=0).to_numpy(dtype=np.int64), True
+    if rankBy == DWELL:
+        meta = ctx.get_session_meta().reindex(sids)
+        durations = (meta[utils.SESSIONEND] - meta[utils.SESSIONSTART]).dt.total_seconds()
+        return durations.to_numpy(dtype=float), False
+    raise ValueError("Unknown ranking: " + str(rankBy) + " (expected one of " + ", ".join(RANKINGS) + ")")
+
+
+def get_funnel_dwell(sess_df: pd.DataFrame, indices: list, funnelLen: int) -> float:
+    """Longest time, in seconds, from the first to the last step of the funnel occurrences of a session
+
+    :param sess_df: navigate events of the session
+    :param indices: positions of the funnel occurrences (see `analyze_traffic.get_sublist_indices`)
+    :param funnelLen: number of funnel steps
+    :return: dwell time in seconds
+    """
+    times = sess_df["EventStart"].to_numpy(dtype="datetime64[ns]")
+    indices = np.asarray(indices)
+    return float((times[indices + funnelLen - 1] - times[indices]).max() / np.timedelta64(1, "s"))
+
+
+@profiling.profiled
+def get_top_sessions(events, funnel: list, useResolvedUrls: bool, numSessions: int = 10, rankBy: str = RECENT,
+                     strict: bool = True, sessions=None) -> list:
+    """Top sessions containing the funnel, ranked by relevance
+
+    :param events: events DataFrame or AnalysisContext (with the non-navigate events, to rank by RAGECLICKS)
+    :param funnel: funnel of interest
+    :param useResolvedUrls: indicates whether original or resolved URLs should be used
+    :param numSessions: number of sessions to return (if 0, return all matching sessions, ranked)
+    :param rankBy: ranking (one of RANKINGS)
+    :param strict: If `True`, the session has to follow the funnel steps in exact order (with no diversions between
+    the steps). The `False` option is currently not supported.
+    :param sessions: SIDs to choose from (e.g. the sessions with a click type), or None for all sessions
+    :return: list of (SID, score) pairs, best first. Scores are session start times (RECENT), rage click counts
+    (RAGECLICKS) or dwell times in seconds (DWELL).
+    """
+    ctx = events if isinstance(events, analysis_context.AnalysisContext) else analysis_context.AnalysisContext(events)
+    navEvents, si, columnToUse = ctx.prepare(useResolvedUrls)
+    candidates = analyze_traffic.get_unordered_sessions_for_funnel(si, funnel) or set()
+    if sessions is not None:
+        candidates = candidates.intersection(sessions)
+    # candidates are ranked by SID among equal scores, so a lower position ranks higher
+    candidates = sorted(candidates)
+    bounds, exact = get_score_bounds(ctx, candidates, rankBy)
+    if not exact and len(funnel) == 1:
+        # one-step funnels take no time
+        bounds, exact = np.zeros(len(candidates)), True
+    order = np.lexsort((np.arange(len(candidates)), -bounds))
+    heap = []
+    with progress.track("top_sessions.get_top_sessions", len(candidates)) as tracker:
+        for position in order:
+            # no remaining candidate can score above the worst session kept
+            if numSessions > 0 and len(heap) == numSessions and (bounds[position], -position) < heap[0][:2]:
+                break
+            sid = candidates[position]
+            sess_df = navEvents.loc[sid]
+            indices = analyze_traffic.get_sublist_indices(funnel, sess_df[columnToUse].tolist(), strict)
+            tracker.update()
+            if len(indices) == 0:
+                continue
+            score = bounds[position] if exact else get_funnel_dwell(sess_df, indices, len(funnel))
+            entry = (score, -position, sid)
+            if numSessions == 0 or len(heap) < numSessions:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+    ranked = sorted(heap, reverse=True)
+    if rankBy == RECENT:
+        starts = ctx.get_session_meta()[utils.SESSIONSTART]
+        return [(sid, starts[sid]) for _, _, sid in ranked]
+    if rankBy == RAGECLICKS:
+        return [(sid, int(score)) for score, _, sid in ranked]
+    return [(sid, float(score)) for score, _, sid in ranked]
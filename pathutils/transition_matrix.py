@@ -0,0 +1,206 @@
+"""transition_matrix.py
+
+First-order URL transition counts, stored as a sparse URL x URL matrix. Each session contributes one transition for
+every pair of consecutive navigate events, one transition from its entry point (the referrer of its first event, or
+the virtual START node if there is none) to its first URL, and one transition from its last URL to the virtual EXIT
+node.
+
+Next-page and previous-page distributions, single-step inflows and outflows (as returned by
+`analyze_traffic.get_funnel_in_outs` for a one-URL funnel) and Sankey branches are then row and column lookups.
+
+"""
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+
+from pathutils import analyze_traffic, profiling, utils
+
+START = "<Start>"
+EXIT = "<Exit>"
+
+
+class TransitionMatrix:
+    """Sparse matrix of transition counts between URLs (and START/EXIT virtual nodes)"""
+
+    def __init__(self, counts: sparse.csr_matrix, labels: np.ndarray):
+        """
+        :param counts: square sparse matrix; counts[i, j] is the number of transitions from labels[i] to labels[j]
+        :param labels: node labels (URLs, referrers, START and EXIT)
+        """
+        self.counts = counts
+        self.labels = labels
+        self._columns = counts.tocsc()
+        self._labelIndex = {}
+        for i, label in enumerate(labels):
+            # referrer nodes come last, so URL nodes take precedence
+            self._labelIndex.setdefault(label, i)
+
+    def index_of(self, url: str) -> int:
+        """Node index of a URL (or START/EXIT), or -1 if it's not a node of the matrix"""
+        return self._labelIndex.get(url, -1)
+
+    def next_pages(self, url: str) -> dict:
+        """Counts of URLs (or EXIT) navigated to immediately after `url`"""
+        i = self.index_of(url)
+        if i < 0:
+            return {}
+        row = self.counts[i]
+        return dict(zip(self.labels[row.indices], row.data.tolist()))
+
+    def previous_pages(self, url: str) -> dict:
+        """Counts of URLs, referrers (or START) immediately preceding `url`
+
+        A referrer which is also a URL is counted together with that URL.
+        """
+        i = self.index_of(url)
+        if i < 0:
+            return {}
+        col = self._columns[:, i]
+        counts = defaultdict(int)
+        for label, count in zip(self.labels[col.indices], col.data.tolist()):
+            counts[label] += count
+        return dict(counts)
+
+    def top_next_pages(self, url: str, cutoff: int = 10) -> list:
+        """Most frequent next pages (e.g. Sankey outflow branches) as a sorted list of (URL, count)"""
+        return utils.sorted_dict_items(self.next_pages(url), True)[:cutoff]
+
+    def top_previous_pages(self, url: str, cutoff: int = 10) -> list:
+        """Most frequent previous pages (e.g. Sankey inflow branches) as a sorted list of (URL, count)"""
+        return utils.sorted_dict_items(self.previous_pages(url), True)[:cutoff]
+
+    def get_in_outs(self, url: str) -> (dict, dict):
+        """Ingress and egress counts for a single-URL funnel, in the format of `analyze_traffic.get_funnel_in_outs`
+
+        :param url: URL of interest
+        :return: dictionaries of ingress and egress counts
+        """
+        ingressCounts = defaultdict(int)
+        egressCounts = defaultdict(int)
+        for label, count in self.previous_pages(url).items():
+            ingressCounts[analyze_traffic.UNKNOWN if label == START else label] += count
+        for label, count in self.next_pages(url).items():
+            egressCounts[analyze_traffic.UNKNOWN if label == EXIT else label] += count
+        return ingressCounts, egressCounts
+
+    def get_probabilities(self) -> sparse.csr_matrix:
+        """Row-normalized transition matrix (transition probabilities from each node)"""
+        return normalize_rows(self.counts)
+
+
+def normalize_rows(counts: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Scale each row of a sparse count matrix to sum to 1 (rows without counts are left empty)"""
+    totals = np.asarray(counts.sum(axis=1)).ravel()
+    scale = np.divide(1.0, totals, out=np.zeros(len(totals)), where=totals > 0)
+    return sparse.diags(scale).dot(counts).tocsr()
+
+
+def build_transition_matrix(events: pd.DataFrame, colName: str, referalColName: str) -> TransitionMatrix:
+    """Build the transition matrix for a navigate-only events DataFrame in a single pass over encoded session paths
+
+    :param events: navigate-only events DataFrame
+    :param colName: column name to use for URLs
+    :param referalColName: referral column name (entries are attributed to START if None)
+    :return: transition matrix
+    """
+    paths = utils.encode_paths(events, colName)
+    return build_transition_matrix_from_paths(paths, get_entry_referrers(events, referalColName))
+
+
+def get_entry_referrers(events: pd.DataFrame, referalColName: str) -> np.ndarray:
+    """Referrer of the first event of each session, in session order (None for sessions without one)"""
+    sidValues = events.index.get_level_values(0)
+    firsts = ~sidValues.duplicated()
+    if referalColName is None or referalColName not in events.columns:
+        return np.full(np.count_nonzero(firsts), None, dtype=object)
+    referrers = events[referalColName].to_numpy(dtype=object)[firsts]
+    return np.array([r if type(r) == str else None for r in referrers], dtype=object)
+
+
+@profiling.profiled
+def build_transition_matrix_from_paths(paths: utils.EncodedPaths, entryReferrers: np.ndarray = None) -> TransitionMatrix:
+    """Build the transition matrix from encoded session paths
+
+    :param paths: encoded session paths (see `utils.encode_paths`)
+    :param entryReferrers: optional referrer of each session's first event (None for sessions without one)
+    :return: transition matrix
+    """
+    codes = paths.codes
+    starts = paths.offsets[:-1]
+    ends = paths.offsets[1:]
+    numLabels = len(paths.labels)
+    # node layout: URLs, then a node for missing URLs, START, EXIT, and referrers. Referrers get their own nodes even
+    # if they are also URLs, so that session entries don't show up as transitions from the referring URL
+    missingNode, startNode, exitNode = numLabels, numLabels + 1, numLabels + 2
+    labels = list(paths.labels) + [analyze_traffic.UNKNOWN, START, EXIT]
+    nodes = np.where(codes < 0, missingNode, codes)
+
+    entryNodes = np.full(len(starts), startNode, dtype=np.int64)
+    if entryReferrers is not None:
+        hasReferrer = np.array([r is not None for r in entryReferrers], dtype=bool)
+        refCodes, refLabels = pd.factorize(entryReferrers[hasReferrer])
+        entryNodes[hasReferrer] = len(labels) + refCodes
+        labels += list(refLabels)
+
+    # consecutive events within a session
+    inner = np.ones(len(nodes), dtype=bool)
+    inner[starts] = False
+    dst = np.flatnonzero(inner)
+    sources = np.concatenate([nodes[dst - 1], entryNodes, nodes[ends - 1]])
+    targets = np.concatenate([nodes[dst], nodes[starts], np.full(len(ends), exitNode)])
+    numNodes = len(labels)
+    counts = sparse.coo_matrix((np.ones(len(sources), dtype=np.int64), (sources, targets)),
+                               shape=(numNodes, numNodes)).tocsr()
+    return TransitionMatrix(counts, np.array(labels, dtype=object))
+
+
+def merge_transition_matrices(matrices: list) -> TransitionMatrix:
+    """Sum transition matrices built on disjoint sets of sessions (e.g. one per day) into the matrix of all of them
+
+    Nodes are matched by label, keeping referrer nodes apart from URL nodes with the same label.
+
+    :param matrices: non-empty list of TransitionMatrix
+    :return: transition matrix with the union of the nodes
+    """
+    if len(matrices) == 0:
+        raise ValueError("No transition matrices to merge")
+    # node layout of the result, as in `build_transition_matrix_from_paths`: URLs, missing URLs, START, EXIT, referrers
+    urlNodes = {}
+    referrerNodes = {}
+    nodeKeys = []
+    for matrix in matrices:
+        # missing URLs, START and EXIT nodes are the three nodes ending at EXIT, and referrers come after them
+        exitNode = matrix.index_of(EXIT)
+        keys = [(True, label) if i > exitNode else (False, label) for i, label in enumerate(matrix.labels)]
+        for i, (isReferrer, label) in enumerate(keys):
+            if isReferrer:
+                referrerNodes.setdefault(label, len(referrerNodes))
+            elif i < exitNode - 2:
+                urlNodes.setdefault(label, len(urlNodes))
+        nodeKeys.append(keys)
+    numUrls = len(urlNodes)
+    rows = []
+    cols = []
+    values = []
+    for matrix, keys in zip(matrices, nodeKeys):
+        exitNode = matrix.index_of(EXIT)
+        mapping = np.empty(len(keys), dtype=np.int64)
+        for i, (isReferrer, label) in enumerate(keys):
+            if isReferrer:
+                mapping[i] = numUrls + 3 + referrerNodes[label]
+            elif i >= exitNode - 2:
+                mapping[i] = numUrls + i - (exitNode - 2)
+            else:
+                mapping[i] = urlNodes[label]
+        coo = matrix.counts.tocoo()
+        rows.append(mapping[coo.row])
+        cols.append(mapping[coo.col])
+        values.append(coo.data)
+    labels = list(urlNodes) + [analyze_traffic.UNKNOWN, START, EXIT] + list(referrerNodes)
+    numNodes = len(labels)
+    counts = sparse.coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                               shape=(numNodes, numNodes)).tocsr()
+    return TransitionMatrix(counts, np.array(labels, dtype=object))
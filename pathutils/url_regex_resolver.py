@@ -3,16 +3,28 @@
 Creates a column in the dataframe with URLs which have been resolved according to the existing rules dictionary
 
 """
+import numpy as np
 import pandas as pd
 import re
 
+from pathutils import profiling
 
+
+@profiling.profiled
 def resolve_urls(events: pd.DataFrame, toReplace: dict, fromCol: str, toCol: str):
-    events.loc[:,toCol] = events.apply(create_resolved_url, axis=1, args=(toReplace, fromCol))
+    # the rules are only applied once to each distinct URL
+    codes, uniques = pd.factorize(events[fromCol])
+    resolved = np.array([resolve_url(url, toReplace) for url in uniques] + [np.NaN], dtype=object)
+    events.loc[:,toCol] = resolved[codes]
 
 
-def create_resolved_url(row: pd.Series, toReplace: dict, fromCol: str):
-    origUrl = row[fromCol]
+def resolve_url(origUrl: str, toReplace: dict) -> str:
+    if toReplace is None:
+        return origUrl
     for rex in toReplace:
         origUrl = re.sub(rex, toReplace[rex], origUrl)
     return origUrl
+
+
+def create_resolved_url(row: pd.Series, toReplace: dict, fromCol: str):
+    return resolve_url(row[fromCol], toReplace)
@@ -4,10 +4,30 @@ Various utilities
 
 """
 import operator
-import webbrowser
 
+from collections import namedtuple
+
+import numpy as np
 import pandas as pd
 
+from pathutils import profiling
+
+
+# column names of the per-session metadata table built by `build_session_meta`
+SESSIONSTART = "SessionStart"
+SESSIONEND = "SessionEnd"
+EVENTCOUNT = "EventCount"
+ORGID = "OrgId"
+SESSIONMETACOLS = ["OrgId", "PageDevice", "PageBrowser"]
+
+# sub-sessions created by `split_sessions` are named <sid><SUBSESSIONSEP><k>, with k > 0
+SUBSESSIONSEP = "/"
+PARENTSESSIONID = "parent_session_id"
+DEFAULTINACTIVITYGAP = pd.Timedelta(minutes=30)
+
+# Session paths encoded as integer arrays (see `encode_paths`)
+EncodedPaths = namedtuple("EncodedPaths", ["codes", "labels", "offsets", "sids"])
+
 
 def sorted_dict_items(d, reverse=False):
     """Sorted (key, value) pairs by value.
@@ -50,6 +70,8 @@ def pseudo_beaker(UserId: str, SessionId: str, replay=True, scope=True, browser=
     Option to specify a browser (e.g. "safari", "chrome") otherwise the system
     default is used.
     """
+    import webbrowser
+
     url_dict = get_beaker_lookup(UserId, SessionId, OrgId, is_staging)
     if browser is None:
         w = webbrowser
@@ -71,14 +93,16 @@ def get_sessions(events_df: pd.DataFrame) -> list:
       events_df:  dataframe of events
 
     Output:
-      list of distinct session ids present in the input
+      list of distinct session ids present in the input, in the order of
+      their first events (which is sorted by sid after `preproc_events`)
     """
     # get_level_values(0) only pulls the `sid` first part of the multi-index,
     # at position 0. The second index (at position 1) is the time-ordered
     # position
-    return list(set(events_df.index.get_level_values(0)))
+    return events_df.index.get_level_values(0).unique().tolist()
 
 
+@profiling.profiled
 def preproc_events(events_df: pd.DataFrame) -> pd.DataFrame:
     """
     Input:
@@ -126,8 +150,216 @@ def preproc_events(events_df: pd.DataFrame) -> pd.DataFrame:
     return events_df.reset_index().set_index(["sid", "idx"])
 
 
+def get_subsession_offsets(events_df: pd.DataFrame, maxGap=DEFAULTINACTIVITYGAP) -> np.ndarray:
+    """
+    Inputs:
+      events_df:  dataframe with multi-index, as returned by `preproc_events`
+                  (events of a session must be contiguous and time-ordered)
+      maxGap:     longest inactivity (Timedelta, or string such as '30min')
+                  allowed between two consecutive events of a sub-session
+
+    Output:
+      integer array of sub-session start positions, followed by
+      `len(events_df)`, in the same layout as `EncodedPaths.offsets`. A new
+      sub-session starts at every new session and after every gap longer
+      than `maxGap`.
+    """
+    if len(events_df) == 0:
+        return np.array([0], dtype=np.int64)
+    sidValues = np.asarray(events_df.index.get_level_values(0))
+    times = events_df["EventStart"].to_numpy(dtype="datetime64[ns]")
+    breaks = np.r_[True, (sidValues[1:] != sidValues[:-1]) |
+                   (np.diff(times) > pd.Timedelta(maxGap).to_timedelta64())]
+    return np.r_[np.flatnonzero(breaks), len(events_df)]
+
+
+@profiling.profiled
+def split_sessions(events_df: pd.DataFrame, maxGap=DEFAULTINACTIVITYGAP) -> pd.DataFrame:
+    """
+    Inputs:
+      events_df:  dataframe with multi-index, as returned by `preproc_events`.
+                  It should contain all events, not only navigations, so that
+                  clicks count as activity.
+      maxGap:     longest inactivity (Timedelta, or string such as '30min')
+                  allowed between two consecutive events of a sub-session
+
+    Output:
+      Same dataframe, where sessions are split after every gap longer than
+      `maxGap`. The first part of a session keeps its sid, and the following
+      parts are named `sid + SUBSESSIONSEP + k` (k = 1, 2, ...). The `idx`
+      index level and `distinct_session_id` column refer to the sub-sessions,
+      and the original session id is kept in the `parent_session_id` column.
+
+    All analyses then treat sub-sessions as sessions: funnels and timings
+    never match across idle gaps. Use `get_parent_sid` to go back from a
+    sub-session to the FullStory session (e.g. for session links).
+    """
+    offsets = get_subsession_offsets(events_df, maxGap)
+    sidValues = np.asarray(events_df.index.get_level_values(0))
+    lengths = np.diff(offsets)
+    starts = offsets[:-1]
+    # number each sub-session within its parent session
+    newSession = np.r_[True, sidValues[starts[1:]] != sidValues[starts[:-1]]] if len(starts) > 0 else np.array([], dtype=bool)
+    sessionStarts = np.flatnonzero(newSession)
+    part = np.arange(len(starts)) - np.repeat(sessionStarts, np.diff(np.r_[sessionStarts, len(starts)]))
+    suffixes = np.where(part == 0, "", np.char.add(SUBSESSIONSEP, part.astype(str))).astype(object)
+    newSids = np.repeat(sidValues[starts].astype(object) + suffixes, lengths)
+
+    result = events_df.copy()
+    result[PARENTSESSIONID] = sidValues
+    result["distinct_session_id"] = newSids
+    idx = np.arange(len(result)) - np.repeat(starts, lengths)
+    result.index = pd.MultiIndex.from_arrays([pd.Index(newSids, dtype=object), idx], names=("sid", "idx"))
+    return result
+
+
+def get_parent_sid(sid: str) -> str:
+    """
+    Session id of the FullStory session a sub-session (see `split_sessions`)
+    belongs to. Session ids that weren't split are returned as they are.
+    """
+    return sid.split(SUBSESSIONSEP, 1)[0]
+
+
+@profiling.profiled
+def collapse_repeats(events_df: pd.DataFrame, colName: str, dedupPageIds: bool = True) -> pd.DataFrame:
+    """
+    Inputs:
+      events_df:     navigate-only dataframe with multi-index, as returned by
+                     `preproc_events`
+      colName:       name of the URL column to compare (original or resolved
+                     URLs)
+      dedupPageIds:  also drop navigate events repeating the URL of an earlier
+                     event with the same `PageId` in the session (re-fired
+                     navigations of a page load)
+
+    Output:
+      Dataframe without repeated navigations: consecutive events of a session
+      with the same URL are collapsed into the first one (keeping its
+      timestamp). The `idx` index level is renumbered.
+
+    Reloads and re-fired single page app navigations otherwise show up as
+    `A -> A` steps, which break strict funnels and make paths longer.
+    """
+    if len(events_df) == 0:
+        return events_df
+    codes, _ = pd.factorize(events_df[colName])
+    sidValues = np.asarray(events_df.index.get_level_values(0))
+    keep = np.r_[True, (sidValues[1:] != sidValues[:-1]) | (codes[1:] != codes[:-1])]
+    if dedupPageIds and "PageId" in events_df.columns:
+        pageIds, _ = pd.factorize(events_df["PageId"])
+        keep &= ~pd.DataFrame({"sid": sidValues, "page": pageIds, "url": codes}).duplicated().to_numpy()
+    result = events_df.loc[keep]
+    sids = sidValues[keep]
+    starts = np.flatnonzero(np.r_[True, sids[1:] != sids[:-1]])
+    idx = np.arange(len(sids)) - np.repeat(starts, np.diff(np.r_[starts, len(sids)]))
+    result.index = pd.MultiIndex.from_arrays([result.index.get_level_values(0), idx], names=("sid", "idx"))
+    return result
+
+
+@profiling.profiled
+def encode_paths(events_df: pd.DataFrame, colName: str) -> EncodedPaths:
+    """
+    Inputs:
+      events_df:  dataframe with multi-index, as returned by `preproc_events`
+                  (events of a session must be contiguous and time-ordered)
+      colName:    name of the column to encode (e.g. page URLs)
+
+    Output:
+      EncodedPaths tuple of
+        codes:    integer array with one code per event (-1 for missing values)
+        labels:   array of distinct values, so that `labels[codes[i]]` is
+                  the value of event `i`
+        offsets:  integer array of length `len(sids) + 1`; the path of
+                  session `k` is `codes[offsets[k]:offsets[k + 1]]`
+        sids:     array of session ids, in the order they appear in the input
+    """
+    codes, labels = pd.factorize(events_df[colName])
+    sidValues = np.asarray(events_df.index.get_level_values(0))
+    starts = np.flatnonzero(np.r_[True, sidValues[1:] != sidValues[:-1]]) if len(sidValues) > 0 else np.array([], dtype=int)
+    offsets = np.r_[starts, len(codes)]
+    return EncodedPaths(codes, np.asarray(labels), offsets, sidValues[starts])
+
+
+@profiling.profiled
+def build_session_meta(events_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Input:
+      events_df:  dataframe with multi-index, as returned by `preproc_events`
+
+    Output:
+      Per-session metadata table, indexed by sid and sorted by session start
+      time. Columns are the session start and end times, the number of events
+      and, where present in the input, the session's OrgId, device and browser.
+
+    The table only needs to be built once per preprocessed dataframe (it can be
+    stored with `save_session_meta`). Because it is sorted by start time, time
+    window queries become binary searches (see `get_sids_for_time_range`), and
+    it can be passed to `filter_events` as `session_meta` to avoid grouping the
+    whole events dataframe on every call.
+    """
+    groups = events_df.groupby(level=0, sort=False)
+    meta = pd.DataFrame({
+        SESSIONSTART: groups["EventStart"].min(),
+        SESSIONEND: groups["EventStart"].max(),
+        EVENTCOUNT: groups.size(),
+    })
+    for col in SESSIONMETACOLS:
+        if col in events_df.columns:
+            meta[col] = groups[col].first()
+    meta.index.name = "sid"
+    return meta.sort_values(SESSIONSTART, kind="mergesort")
+
+
+def save_session_meta(session_meta: pd.DataFrame, path: str):
+    """
+    Store a session metadata table built by `build_session_meta` on disk.
+    """
+    session_meta.to_pickle(path)
+
+
+def load_session_meta(path: str) -> pd.DataFrame:
+    """
+    Load a session metadata table stored by `save_session_meta`.
+    """
+    return pd.read_pickle(path)
+
+
+def get_sids_for_time_range(session_meta: pd.DataFrame, t0, t1) -> pd.Index:
+    """
+    Inputs:
+      session_meta:  session metadata table built by `build_session_meta`
+      t0, t1:        bounds (inclusive) for the first event time of a session,
+                     given as datetimes or strings in the format
+                     'YYYY-MM-DD HH:MM:SS UTC'
+
+    Output:
+      Index of session ids starting within the range, in start time order.
+    """
+    t0, t1 = pd.to_datetime(t0), pd.to_datetime(t1)
+    starts = session_meta[SESSIONSTART]
+    lo = starts.searchsorted(t0, side="left")
+    hi = starts.searchsorted(t1, side="right")
+    return session_meta.index[lo:hi]
+
+
+def get_sids_for_org(session_meta: pd.DataFrame, org) -> pd.Index:
+    """
+    Inputs:
+      session_meta:  session metadata table built by `build_session_meta`
+      org:           OrgId string or sequence of these
+
+    Output:
+      Index of session ids belonging to the org(s), in start time order.
+    """
+    if isinstance(org, str):
+        org = [org]
+    return session_meta.index[session_meta[ORGID].isin(org)]
+
+
+@profiling.profiled
 def filter_events(
-    events_df: pd.DataFrame, org=None, session=None, start_time=None
+    events_df: pd.DataFrame, org=None, session=None, start_time=None, session_meta=None
 ) -> pd.DataFrame:
     """
     Inputs:
@@ -137,6 +369,10 @@ def filter_events(
       start_time:  Singleton or sequence of pairs (t0, t1) bounding
                    first event time of a session, where times are given
                    in the format 'YYYY-MM-DD HH:MM:SS UTC'
+      session_meta:  Optional session metadata table built from `events_df`
+                   by `build_session_meta`. If given, org and start time
+                   restrictions are looked up in it instead of being computed
+                   from the events.
 
     Output:
       New dataframe copy of input, filtered according to arguments.
@@ -147,15 +383,13 @@ def filter_events(
         if isinstance(org, str):
             # singleton
             org = [org]
-        events_df = events_df.loc[
-            list(
-                set(
-                    events_df[events_df["OrgId"].isin(org)][
-                        "distinct_session_id"
-                    ]
-                )
-            )
-        ]
+        if session_meta is not None:
+            sids = get_sids_for_org(session_meta, org)
+            session_meta = session_meta.loc[sids]
+        else:
+            sids = events_df.loc[events_df["OrgId"].isin(org), "distinct_session_id"].unique()
+        # a mask keeps the sessions in their original order
+        events_df = events_df.loc[events_df.index.get_level_values(0).isin(sids)]
 
     # reduce dataset according to any session specification (one or more)
     if session is not None and len(session) != 0:
@@ -172,8 +406,14 @@ def filter_events(
         t0, t1 = [pd.to_datetime(t) for t in start_time]
         # ensure only whole sessions are found that start in this range.
         # (assumes original data set does not truncate any sessions.)
-        # get all session start times
-        groups = events_df.groupby("distinct_session_id")["EventStart"].min()
-        sids = groups[groups.between(t0, t1)].index
-        events_df = events_df.loc[sids]
+        if session_meta is not None:
+            sids = get_sids_for_time_range(session_meta, t0, t1)
+            if session is not None and len(session) != 0:
+                sids = sids[sids.isin(session)]
+            events_df = events_df.loc[events_df.index.get_level_values(0).isin(sids)]
+        else:
+            # get all session start times
+            groups = events_df.groupby("distinct_session_id")["EventStart"].min()
+            sids = groups[groups.between(t0, t1)].index
+            events_df = events_df.loc[sids]
     return events_df
\ No newline at end of file
@@ -10,5 +10,6 @@ setup(
     description="Collection of pathing analytics utilities for FullStory Hauser export data",
     long_description=open("README.md").read(),
     install_requires=requirements,
+    entry_points={"console_scripts": ["pathutils=pathutils.__main__:main"]},
     license="MIT"
 )
\ No newline at end of file